@@ -3,8 +3,8 @@ from django.db import migrations
 class Migration(migrations.Migration):
     dependencies = [
         ('auth', '__latest__'),
-        ('socials', '__latest__'),
-        ('posts', '__latest__'),
+        ('socials', '0001_initial'),
+        ('posts', '0003_attachment'),
     ]
 
     operations = [
@@ -0,0 +1,92 @@
+"""
+Resized copies of uploaded images.
+
+Each image gets one derivative per entry of IMAGE_DERIVATIVE_SIZES (longest
+edge in pixels), in WebP with a JPEG fallback, saved next to the original
+as <name>.<size>.webp / .jpg. Sizes the original is too small for are
+skipped. Derivatives are upright (EXIF orientation applied) and carry no
+metadata.
+
+`render_derivatives` only needs a path, so it can run in a worker process;
+`store_derivatives` writes its output through the file's storage and returns
+the map a model keeps in a JSONField, which `derivative_urls` turns into
+what serializers expose.
+"""
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+DEFAULT_SIZES = {'thumb': 160, 'medium': 640, 'large': 1280}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+
+
+def derivative_sizes():
+    from django.conf import settings
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def render_derivatives(path, sizes=DEFAULT_SIZES):
+    """{size name: {'width', 'height', 'webp': bytes, 'jpeg': bytes}} for the image at `path`"""
+    by_edge = sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+    with Image.open(path) as original:
+        longest = max(original.size)
+        wanted = [(name, edge) for name, edge in by_edge if edge < longest] or [by_edge[-1]]
+        # For JPEGs, decode straight at the smallest DCT scale that still
+        # covers the largest derivative instead of at full resolution
+        largest = min(wanted[0][1], longest)
+        original.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.info = {}  # no EXIF, XMP or ICC data is carried over
+
+    rendered = {}
+    for name, edge in wanted:
+        # Each size is reduced from the previous, larger one
+        image.thumbnail((edge, edge), Image.Resampling.LANCZOS, reducing_gap=3.0)
+        rendered[name] = {'width': image.width, 'height': image.height}
+        for key, (image_format, options) in FORMATS.items():
+            frame = image
+            if image_format == 'JPEG' and image.mode == 'RGBA':
+                frame = Image.new('RGB', image.size, 'white')
+                frame.paste(image, mask=image.getchannel('A'))
+            buffer = BytesIO()
+            frame.save(buffer, image_format, **options)
+            rendered[name][key] = buffer.getvalue()
+    return rendered
+
+
+def store_derivatives(field_file, rendered):
+    """Save `rendered` next to `field_file`; returns the same map with storage names instead of bytes"""
+    from django.core.files.base import ContentFile
+
+    stem = os.path.splitext(field_file.name)[0]
+    stored = {}
+    for name, variant in rendered.items():
+        stored[name] = {'width': variant['width'], 'height': variant['height']}
+        for key, extension in EXTENSIONS.items():
+            stored[name][key] = field_file.storage.save(f'{stem}.{name}.{extension}', ContentFile(variant[key]))
+    return stored
+
+
+def delete_derivatives(storage, derivatives):
+    for variant in derivatives.values():
+        for key in EXTENSIONS:
+            if variant.get(key):
+                storage.delete(variant[key])
+
+
+def derivative_urls(request, storage, derivatives):
+    """{size name: {'width', 'height', 'webp': url, 'jpeg': url}}, absolute when a request is given"""
+    def url(name):
+        return request.build_absolute_uri(storage.url(name)) if request is not None else storage.url(name)
+
+    return {
+        name: {'width': variant['width'], 'height': variant['height'],
+               **{key: url(variant[key]) for key in EXTENSIONS}}
+        for name, variant in derivatives.items()
+    }
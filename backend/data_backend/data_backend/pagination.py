@@ -0,0 +1,226 @@
+import base64
+import heapq
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination over a fixed, unique ordering such as ('-created_at', '-id').
+
+    The cursor stores the ordering values of the boundary row, and the next page
+    filters past it instead of using OFFSET, so every page is one index range scan
+    and no COUNT(*) is ever issued.
+    """
+    ordering = ('-id',)
+    page_size = 20
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginate the union of querysets that expose the same ordering fields.
+
+        Each queryset is sliced to one page on its own index, then the slices
+        are k-way merged with a heap; rows with identical keys are kept once.
+        """
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+
+        position, reverse = self.decode_cursor(request)
+        if position is not None:
+            position = self.convert_position(querysets[0], position)
+        ordering = self.get_ordering(reverse)
+        limit = self.page_size + 1
+        slices = []
+        for queryset in querysets:
+            queryset = queryset.order_by(*ordering)
+            if position is not None:
+                queryset = queryset.filter(self.get_keyset_filter(ordering, position))
+            slices.append(list(queryset[:limit]))
+
+        results = slices[0] if len(slices) == 1 else self.merge(slices, ordering, limit)
+        self.merged_rows = sum(len(rows) for rows in slices)
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        if reverse:
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def merge(self, slices, ordering, limit):
+        # heapq.merge needs one direction, so mixed orderings are not supported
+        descending = ordering[0].startswith('-')
+        results = []
+        last_key = None
+        for obj in heapq.merge(*slices, key=self.get_sort_key, reverse=descending):
+            key = self.get_sort_key(obj)
+            if key == last_key:
+                continue
+            results.append(obj)
+            last_key = key
+            if len(results) == limit:
+                break
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_ordering(self, reverse=False):
+        if not reverse:
+            return self.ordering
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in self.ordering
+        )
+
+    def get_keyset_filter(self, ordering, position):
+        """
+        Build the "strictly after `position`" filter for the given ordering.
+
+        The leading `lte`/`gte` bound duplicates the first term of the OR so the
+        planner can turn it into an index range condition.
+        """
+        fields = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        first_name, first_desc = fields[0]
+        keyset = Q()
+        for i, (name, desc) in enumerate(fields):
+            term = Q(**{f'{name}__{"lt" if desc else "gt"}': position[i]})
+            for j in range(i):
+                term &= Q(**{fields[j][0]: position[j]})
+            keyset |= term
+        bound = Q(**{f'{first_name}__{"lte" if first_desc else "gte"}': position[0]})
+        return bound & keyset
+
+    def get_sort_key(self, obj):
+        key = []
+        for field in self.ordering:
+            value = obj
+            for attr in field.lstrip('-').split('__'):
+                value = getattr(value, attr)
+            key.append(value)
+        return tuple(key)
+
+    def get_position(self, obj):
+        position = []
+        for value in self.get_sort_key(obj):
+            if isinstance(value, (datetime, date)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            position.append(value)
+        return position
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position = payload['p']
+            reverse = bool(payload.get('r'))
+        except (TypeError, ValueError, KeyError, UnicodeEncodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def get_ordering_field(self, queryset, name):
+        """The model field or annotation that ordering term `name` sorts on"""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        model = queryset.model
+        *path, last = name.split('__')
+        try:
+            for part in path:
+                model = model._meta.get_field(part).related_model
+            return model._meta.get_field(last)
+        except (FieldDoesNotExist, AttributeError):
+            return None
+
+    def convert_position(self, queryset, position):
+        """
+        The cursor's values as the ordering fields' Python types. Cursors are
+        client input, so a value the field cannot take is a bad cursor, not a
+        server error.
+        """
+        converted = []
+        for field, value in zip(self.ordering, position):
+            model_field = self.get_ordering_field(queryset, field.lstrip('-'))
+            try:
+                if value is None:
+                    raise ValueError("Cursor values cannot be null")
+                if model_field is not None:
+                    value = model_field.to_python(value)
+            except (ValueError, TypeError, ValidationError):
+                raise NotFound(self.invalid_cursor_message)
+            converted.append(value)
+        return converted
+
+    def encode_cursor(self, position, reverse):
+        payload = {'p': position}
+        if reverse:
+            payload['r'] = 1
+        encoded = base64.urlsafe_b64encode(
+            json.dumps(payload, separators=(',', ':')).encode('ascii')
+        ).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
@@ -70,6 +70,7 @@ INSTALLED_APPS = [
     "profiles",
     "posts",
     "socials",
+    "feeds",
     "authentification",
     "rest_framework",
     "rest_framework_simplejwt",
@@ -80,6 +81,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 ]
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -93,6 +95,72 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ]
 }
+# Keyset pagination for post listings (posts.pagination.PostCursorPagination)
+POSTS_PAGE_SIZE = 20
+POSTS_MAX_PAGE_SIZE = 100
+POSTS_SEARCH_MAX_CANDIDATES = 10000  # newest full-text matches that get ranked
+POSTS_FRIENDS_REACTED_LIMIT = 3  # friends shown per post in listings
+# Buffer react/unreact per process and write them in batches (posts.reaction_buffer)
+POSTS_REACTIONS_COALESCE = False
+POSTS_REACTIONS_FLUSH_MS = 20  # how long a change may wait before it is written
+POSTS_REACTIONS_MAX_PENDING = 1000  # buffered (user, post) pairs that force a flush
+REACTIONS_LOOKUP_MAX_IDS = 500  # post ids per /api/reactions/mine/ call
+# Attachment processing queue (manage.py process_attachments)
+ATTACHMENTS_WORKER_PROCESSES = 2
+ATTACHMENTS_POLL_INTERVAL = 1.0  # seconds between polls of an empty queue
+ATTACHMENTS_LEASE = 300  # seconds a claimed job is kept before another worker may retry it
+ATTACHMENTS_MAX_ATTEMPTS = 5
+ATTACHMENTS_RETRY_BACKOFF = 30  # seconds before the first retry, doubled after each failure
+# Resized WebP/JPEG copies of attachments and profile pictures (data_backend/images.py),
+# longest edge in pixels
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'medium': 640, 'large': 1280}
+VIDEO_THUMBNAIL_SAMPLES = 10  # frames seeked to per video for the thumbnail and preview sprite
+# Resumable chunked uploads (/api/uploads/, posts.models.UploadSession)
+ATTACHMENTS_UPLOAD_STAGING_DIR = os.path.join(BASE_DIR, 'upload_staging')  # not served, unlike MEDIA_ROOT
+ATTACHMENTS_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+ATTACHMENTS_UPLOAD_MAX_CHUNK = 16 * 1024 ** 2
+ATTACHMENTS_UPLOAD_TTL = 24 * 3600  # seconds an idle session is kept
+# Comment threads (posts.models.CommentManager)
+COMMENTS_THREAD_MAX_DEPTH = 8  # levels below the top returned per call
+COMMENTS_THREAD_MAX_NODES = 500  # comments returned per call, shallowest first
+COMMENTS_PAGE_SIZE = 20  # top-level comments per page
+COMMENTS_MAX_PAGE_SIZE = 100
+COMMENTS_REPLIES_PER_COMMENT = 3  # replies inlined under each comment of a page
+COMMENTS_MODERATION_MAX_IDS = 10000  # ids per bulk moderation call
+# User discovery (socials.views.UserSearchViewSet)
+USERS_PAGE_SIZE = 10
+USERS_MAX_PAGE_SIZE = 50
+RELATIONSHIP_STATUS_MAX_IDS = 200  # ids per /api/relationships/status/ call
+# Friend graph (socials.graph): per-process cache of sorted friend-id arrays
+FRIEND_GRAPH_MAX_USERS = 100000
+FRIEND_GRAPH_TTL = 300  # seconds; bounds staleness from other processes' writes
+# Block list (socials.graph): same cache for blocked pairs, read by socials.blocks
+BLOCK_LIST_MAX_USERS = 100000
+BLOCK_LIST_TTL = 300
+# People you may know (socials.recommendations)
+FRIEND_SUGGESTIONS_PER_USER = 50
+FRIEND_SUGGESTIONS_HALF_LIFE_DAYS = 90  # weight of a friendship halves every N days, down to 0.5
+FRIEND_SUGGESTIONS_BATCH_SIZE = 1000  # users scored per A·A block
+# Degrees of separation (socials.paths): hard limits per search
+FRIEND_PATH_MAX_DEPTH = 6
+FRIEND_PATH_MAX_FRONTIER = 10000  # ids expanded in one query
+FRIEND_PATH_MAX_EDGES = 100000  # edges read in one query
+FRIEND_PATH_TIMEOUT = 1.0  # seconds for the whole search
+# Username typeahead (socials.typeahead): per-process cache of hot prefixes
+TYPEAHEAD_LIMIT = 10
+TYPEAHEAD_CACHED_PREFIXES = 5000
+TYPEAHEAD_MAX_CACHED_PREFIX_LENGTH = 4  # longer prefixes go straight to the index
+TYPEAHEAD_TTL = 60  # seconds; bounds staleness from other processes' writes
+# Home feed (feeds app): fan-out-on-write timelines
+FEED_PAGE_SIZE = 20
+FEED_MAX_PAGE_SIZE = 100
+FEED_FANOUT_ASYNC = True  # queue jobs for the process_fanout worker; False runs them inline after commit
+FEED_FANOUT_POLL_INTERVAL = 1.0  # seconds between polls of an empty queue
+FEED_FANOUT_LEASE = 300  # seconds a claimed job is kept before another worker may retry it
+FEED_FANOUT_MAX_ATTEMPTS = 5
+FEED_FANOUT_RETRY_BACKOFF = 30  # seconds before the first retry, doubled after each failure
+FEED_BACKFILL_LIMIT = 200  # recent posts copied when a friendship is accepted
+FEED_FANOUT_THRESHOLD = 5000  # authors with more friends are pulled at read time
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -16,8 +16,9 @@ from authentification.views import (
     ResetPasswordView,
     UpdateUserView
 )
-from posts.views import ReactionViewSet, PostViewSet, CommentViewSet, AttachmentViewSet
+from posts.views import ReactionViewSet, PostViewSet, CommentViewSet, AttachmentViewSet, UploadSessionViewSet
 from profiles.views import ( ProfileCheck, ProfileCreateView, ProfileViewSet)
+from feeds.views import FeedViewSet
 router = DefaultRouter()
 router.register(r'relationships', RelationshipViewSet, basename='relationship')
 router.register(r'friends', FriendViewSet, basename='friend')
@@ -26,7 +27,9 @@ router.register(r'posts', PostViewSet)
 router.register(r'reactions', ReactionViewSet)
 router.register(r'comments', CommentViewSet)
 router.register(r'attachments', AttachmentViewSet, basename='attachments')
+router.register(r'uploads', UploadSessionViewSet, basename='uploads')
 router.register(r'profiles', ProfileViewSet, basename="profiles")
+router.register(r'feed', FeedViewSet, basename='feed')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
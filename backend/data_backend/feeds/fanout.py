@@ -0,0 +1,136 @@
+"""
+Fan-out worker for home timelines.
+
+Authors with up to FEED_FANOUT_THRESHOLD friends are pushed: each new post
+is copied into every friend's timeline. Busier authors are recorded as
+HighDegreeAuthor and pulled instead; FeedViewSet merges their posts in at
+read time.
+
+`dispatch` records the work as a FanoutJob row in the caller's transaction,
+so it commits (or rolls back) with the change and survives restarts, and
+the request returns immediately. The process_fanout command runs the
+jobs; several can run at once, each claiming its own with SKIP LOCKED.
+Every task is idempotent, since a job whose worker died is run again once
+its lease runs out.
+"""
+import logging
+
+from django.conf import settings
+from django.db import transaction
+
+from posts.models import Post
+from socials.models import Relationship
+from . import metrics
+from .models import FanoutJob, TimelineEntry, HighDegreeAuthor
+
+logger = logging.getLogger(__name__)
+
+
+def dispatch(func, *args):
+    """Queue `func(*args)` for the fan-out worker; it becomes visible when the current transaction commits"""
+    if getattr(settings, 'FEED_FANOUT_ASYNC', True):
+        FanoutJob.objects.create(task=func.__name__, args=list(args))
+    else:
+        transaction.on_commit(lambda: func(*args))
+
+
+def run_job(job):
+    """Run one claimed job; it is deleted when it succeeds and rescheduled when it fails"""
+    try:
+        TASKS[job.task](*job.args)
+    except Exception as exc:
+        logger.exception("Feed fan-out job %s (attempt %s) failed", job, job.attempts)
+        job.mark_failed(exc)
+        return False
+    job.delete()
+    return True
+
+
+def is_high_degree(friend_count):
+    return friend_count > getattr(settings, 'FEED_FANOUT_THRESHOLD', 5000)
+
+
+def recent_posts(author_id):
+    limit = getattr(settings, 'FEED_BACKFILL_LIMIT', 200)
+    return list(
+        Post.objects.filter(author_id=author_id).exclude(visibility=Post.ONLY_ME)
+        .order_by('-created_at', '-id')
+        .values_list('id', 'author_id', 'created_at')[:limit]
+    )
+
+
+def sync_author_degree(user_id, friend_ids=None):
+    """
+    Record whether `user_id` is pulled or pushed and return True when pulled.
+    An author dropping back under the threshold gets their recent posts
+    pushed, since posts written while pulled never reached any timeline.
+    """
+    if friend_ids is None:
+        friend_ids = Relationship.objects.get_friend_ids(user_id)
+    if is_high_degree(len(friend_ids)):
+        HighDegreeAuthor.objects.update_or_create(
+            user_id=user_id, defaults={'friend_count': len(friend_ids)}
+        )
+        return True
+    demoted, _ = HighDegreeAuthor.objects.filter(user_id=user_id).delete()
+    if demoted:
+        posts = recent_posts(user_id)
+        for friend_id in friend_ids:
+            TimelineEntry.objects.add_posts(friend_id, posts)
+    return False
+
+
+def fan_out_post(post_id):
+    """Push a new post into the timeline of each of its author's friends, or mark it for pull"""
+    post = Post.objects.filter(pk=post_id).exclude(visibility=Post.ONLY_ME) \
+        .values('author_id', 'created_at').first()
+    if post is None:
+        return 0
+    friend_ids = Relationship.objects.get_friend_ids(post['author_id'])
+    if sync_author_degree(post['author_id'], friend_ids):
+        metrics.incr('posts_pulled')
+        return 0
+    TimelineEntry.objects.add_post(post_id, post['author_id'], post['created_at'], friend_ids)
+    metrics.incr('posts_pushed')
+    metrics.incr('timeline_rows_written', len(friend_ids))
+    return len(friend_ids)
+
+
+def retract_post(post_id):
+    """Take a post that became visible only to its author back out of every timeline"""
+    if Post.objects.filter(pk=post_id, visibility=Post.ONLY_ME).exists():
+        return TimelineEntry.objects.filter(post_id=post_id).delete()[0]
+    return 0
+
+
+def backfill_friendship(user_id, friend_id):
+    """Give two new friends each other's recent posts"""
+    pulled = {
+        author_id for author_id in (user_id, friend_id) if sync_author_degree(author_id)
+    }
+    for owner_id, author_id in ((user_id, friend_id), (friend_id, user_id)):
+        if author_id not in pulled:
+            TimelineEntry.objects.add_posts(owner_id, recent_posts(author_id))
+
+
+def prune_friendship(user_id, friend_id):
+    """Drop each user's posts from the other's timeline after an unfriend or block"""
+    TimelineEntry.objects.remove_author(user_id, friend_id)
+    TimelineEntry.objects.remove_author(friend_id, user_id)
+    sync_author_degree(user_id)
+    sync_author_degree(friend_id)
+
+
+def rebuild_timeline(user_id):
+    """Rebuild one timeline from scratch out of the user's current pushed friends' recent posts"""
+    pulled = set(HighDegreeAuthor.objects.friends_of(user_id))
+    with transaction.atomic():
+        TimelineEntry.objects.filter(owner_id=user_id).delete()
+        for friend_id in Relationship.objects.get_friend_ids(user_id):
+            if friend_id not in pulled:
+                TimelineEntry.objects.add_posts(user_id, recent_posts(friend_id))
+
+
+TASKS = {func.__name__: func for func in (
+    fan_out_post, retract_post, backfill_friendship, prune_friendship, rebuild_timeline,
+)}
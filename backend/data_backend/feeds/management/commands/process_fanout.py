@@ -0,0 +1,39 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from feeds.fanout import run_job
+from feeds.models import FanoutJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued timeline fan-out jobs. Several workers can run at once; "
+        "each claims its own jobs."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Jobs claimed per round")
+        parser.add_argument('--poll-interval', type=float,
+                            default=getattr(settings, 'FEED_FANOUT_POLL_INTERVAL', 1.0))
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due")
+
+    def handle(self, *args, **options):
+        done = failed = 0
+        while True:
+            jobs = FanoutJob.objects.claim(options['batch_size'])
+            if not jobs:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                # Drop the connection if it broke or aged out while idle
+                close_old_connections()
+                continue
+            for job in jobs:
+                if run_job(job):
+                    done += 1
+                else:
+                    failed += 1
+        self.stdout.write(self.style.SUCCESS(f"Ran {done} fan-out job(s), {failed} failed"))
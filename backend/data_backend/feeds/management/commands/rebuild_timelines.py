@@ -0,0 +1,19 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from feeds.fanout import rebuild_timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild home timelines from current friendships (all users by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int)
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids'] or User.objects.values_list('id', flat=True).iterator()
+        rebuilt = 0
+        for user_id in user_ids:
+            rebuild_timeline(user_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rebuilt} timeline(s)"))
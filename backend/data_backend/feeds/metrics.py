@@ -0,0 +1,31 @@
+"""
+In-process counters for the feed engine: how much work went to push
+(fan-out-on-write) versus pull (merge-on-read), and what the merge costs.
+"""
+import threading
+from collections import Counter
+
+_lock = threading.Lock()
+_counters = Counter()
+
+
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+    reads = counters.get('feed_reads', 0)
+    posts = counters.get('posts_pushed', 0) + counters.get('posts_pulled', 0)
+    counters['push_ratio'] = counters.get('posts_pushed', 0) / posts if posts else None
+    counters['avg_pull_sources_per_read'] = counters.get('pull_sources', 0) / reads if reads else None
+    counters['avg_merged_rows_per_read'] = counters.get('merged_rows', 0) / reads if reads else None
+    counters['avg_merge_ms'] = counters.get('merge_ms', 0) / reads if reads else None
+    return counters
+
+
+def reset():
+    with _lock:
+        _counters.clear()
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('feeds', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HighDegreeAuthor',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='feed_high_degree', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('friend_count', models.PositiveIntegerField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
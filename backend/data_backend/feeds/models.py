@@ -0,0 +1,148 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models
+from django.contrib.auth.models import User
+from django.utils import timezone
+from posts.models import Post
+
+
+class TimelineEntryManager(models.Manager):
+    def add_post(self, post_id, author_id, created_at, owner_ids, batch_size=1000):
+        """Push one post into many timelines, skipping owners who already have it"""
+        return self.bulk_create(
+            [
+                self.model(owner_id=owner_id, post_id=post_id,
+                           author_id=author_id, created_at=created_at)
+                for owner_id in owner_ids
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def add_posts(self, owner_id, posts, batch_size=1000):
+        """Push (post_id, author_id, created_at) rows into a single timeline"""
+        return self.bulk_create(
+            [
+                self.model(owner_id=owner_id, post_id=post_id,
+                           author_id=author_id, created_at=created_at)
+                for post_id, author_id, created_at in posts
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+
+    def remove_author(self, owner_id, author_id):
+        return self.filter(owner_id=owner_id, author_id=author_id).delete()
+
+
+class TimelineEntry(models.Model):
+    """
+    One row per (reader, post) in the reader's home feed, written by the
+    fan-out worker. `author` and `created_at` are copied from the post so a
+    feed page is a range scan of (owner, created_at, post) alone.
+    """
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    objects = TimelineEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='feeds_timeline_owner_post_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-created_at', '-post'], name='feeds_timeline_page_idx'),
+            models.Index(fields=['owner', 'author'], name='feeds_timeline_author_idx'),
+        ]
+
+    def __str__(self):
+        return f"post {self.post_id} in {self.owner_id}'s feed"
+
+
+class HighDegreeAuthorManager(models.Manager):
+    def friends_of(self, user_id):
+        """Ids of the reader's friends whose posts are pulled at read time"""
+        from socials.models import Relationship
+        is_friend = Relationship.objects.between(user_id, models.OuterRef('user_id')) \
+            .filter(status='accepted')
+        return list(self.filter(models.Exists(is_friend)).values_list('user_id', flat=True))
+
+
+class HighDegreeAuthor(models.Model):
+    """
+    Authors with more than FEED_FANOUT_THRESHOLD friends. Their posts are not
+    pushed into timelines; readers pull and merge them when the feed is read.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+                                related_name='feed_high_degree')
+    friend_count = models.PositiveIntegerField()
+    updated_at = models.DateTimeField(auto_now=True)
+    objects = HighDegreeAuthorManager()
+
+    def __str__(self):
+        return f"{self.user_id} ({self.friend_count} friends, pulled)"
+
+
+CLAIM_FANOUT_JOBS_SQL = """
+UPDATE feeds_fanoutjob j
+SET attempts = j.attempts + 1, available_at = %(lease_until)s
+WHERE j.id IN (
+    SELECT id FROM feeds_fanoutjob
+    WHERE available_at <= %(now)s AND attempts < %(max_attempts)s
+    ORDER BY available_at, id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING j.id
+"""
+
+
+class FanoutJobManager(models.Manager):
+    def claim(self, limit, lease=None, now=None):
+        """
+        Lease up to `limit` due jobs for `lease` seconds and return them in
+        queue order. Jobs out of attempts stay in the table, with their
+        last error, until deleted by hand.
+        """
+        now = now or timezone.now()
+        lease = lease or getattr(settings, 'FEED_FANOUT_LEASE', 300)
+        with connection.cursor() as cursor:
+            cursor.execute(CLAIM_FANOUT_JOBS_SQL, {
+                'now': now, 'lease_until': now + timedelta(seconds=lease),
+                'max_attempts': getattr(settings, 'FEED_FANOUT_MAX_ATTEMPTS', 5), 'limit': limit,
+            })
+            ids = [row[0] for row in cursor.fetchall()]
+        return list(self.filter(pk__in=ids).order_by('available_at', 'id')) if ids else []
+
+
+class FanoutJob(models.Model):
+    """
+    A fan-out task waiting for the process_fanout worker: the name of a
+    function in feeds.fanout.TASKS and its arguments. Rows are written in
+    the transaction that made the change, so a job exists exactly when the
+    change committed and survives restarts; finished jobs are deleted.
+    """
+    task = models.CharField(max_length=50)
+    args = models.JSONField(default=list)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    objects = FanoutJobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['available_at', 'id'], name='feeds_fanoutjob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.task}{tuple(self.args)}"
+
+    def mark_failed(self, error, now=None):
+        """Retry with exponential backoff; claim() skips it once FEED_FANOUT_MAX_ATTEMPTS is reached"""
+        backoff = getattr(settings, 'FEED_FANOUT_RETRY_BACKOFF', 30) * 2 ** (self.attempts - 1)
+        self.available_at = (now or timezone.now()) + timedelta(seconds=backoff)
+        self.error = str(error)[:1000]
+        self.save(update_fields=['available_at', 'error'])
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+from data_backend.pagination import KeysetPagination
+
+
+class TimelineCursorPagination(KeysetPagination):
+    """Newest-first keyset pagination over one owner's timeline entries."""
+    ordering = ('-created_at', '-post_id')
+    page_size = getattr(settings, 'FEED_PAGE_SIZE', 20)
+    max_page_size = getattr(settings, 'FEED_MAX_PAGE_SIZE', 100)
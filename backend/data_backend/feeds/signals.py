@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from posts.models import Post
+from socials.models import Relationship
+from . import fanout
+
+
+@receiver(post_save, sender=Post)
+def fan_out_new_post(sender, instance, created, **kwargs):
+    loaded = getattr(instance, '_loaded_visibility', None)
+    if created:
+        instance._loaded_visibility = instance.visibility
+        fanout.dispatch(fanout.fan_out_post, instance.pk)
+        return
+    if loaded is None or loaded == instance.visibility:
+        return
+    instance._loaded_visibility = instance.visibility
+    if instance.visibility == Post.ONLY_ME:
+        fanout.dispatch(fanout.retract_post, instance.pk)
+    elif loaded == Post.ONLY_ME:
+        # Posts written as only_me were never fanned out
+        fanout.dispatch(fanout.fan_out_post, instance.pk)
+
+
+@receiver(post_save, sender=Relationship)
+def sync_timelines_on_relationship_change(sender, instance, **kwargs):
+    # Both tasks are idempotent, so re-saving an unchanged status is harmless
+    if instance.status == 'accepted':
+        fanout.dispatch(fanout.backfill_friendship, instance.sender_id, instance.receiver_id)
+    elif instance.status == 'blocked':
+        fanout.dispatch(fanout.prune_friendship, instance.sender_id, instance.receiver_id)
+
+
+@receiver(post_delete, sender=Relationship)
+def prune_timelines_on_unfriend(sender, instance, **kwargs):
+    if instance.status == 'accepted':
+        fanout.dispatch(fanout.prune_friendship, instance.sender_id, instance.receiver_id)
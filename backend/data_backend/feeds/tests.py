@@ -0,0 +1,181 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework import status
+from posts.models import Post
+from socials.models import Relationship
+from . import metrics
+from .models import TimelineEntry, HighDegreeAuthor, FanoutJob
+from .views import FeedViewSet
+
+
+@override_settings(FEED_FANOUT_ASYNC=False)
+class FeedTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+        self.carol = User.objects.create_user(username='carol', password='password123')
+        self.factory = APIRequestFactory()
+
+    def befriend(self, sender, receiver):
+        with self.captureOnCommitCallbacks(execute=True):
+            relationship = Relationship.send_request(sender, receiver)
+            relationship.accept()
+        return relationship
+
+    def post_as(self, user, title):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(title=title, content='feed', author=user)
+
+    def get_feed(self, user, url='/api/feed/'):
+        request = self.factory.get(url)
+        force_authenticate(request, user=user)
+        return FeedViewSet.as_view({'get': 'list'})(request)
+
+    def test_new_posts_fan_out_to_friends_only(self):
+        self.befriend(self.alice, self.bob)
+        post = self.post_as(self.bob, 'hello friends')
+
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.alice, post=post).exists())
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.carol).exists())
+
+        response = self.get_feed(self.alice)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['id'] for p in response.data['results']], [post.id])
+        self.assertEqual(self.get_feed(self.carol).data['results'], [])
+
+    def test_accepting_a_friendship_backfills_recent_posts(self):
+        older = self.post_as(self.carol, 'before we met')
+        self.befriend(self.alice, self.carol)
+        response = self.get_feed(self.alice)
+        self.assertEqual([p['id'] for p in response.data['results']], [older.id])
+
+    def test_unfriend_and_block_prune_timelines(self):
+        relationship = self.befriend(self.alice, self.bob)
+        self.post_as(self.bob, 'from bob')
+        self.post_as(self.alice, 'from alice')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            relationship.block()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            relationship.unblock()
+        self.assertEqual(TimelineEntry.objects.count(), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            relationship.unfriend()
+        self.assertFalse(TimelineEntry.objects.exists())
+
+    def test_feed_pages_follow_cursor(self):
+        self.befriend(self.alice, self.bob)
+        posts = [self.post_as(self.bob, f'post {i}') for i in range(5)]
+
+        seen = []
+        url = '/api/feed/?page_size=2'
+        while url:
+            response = self.get_feed(self.alice, url)
+            seen.extend(p['id'] for p in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [p.id for p in reversed(posts)])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_high_degree_authors_are_pulled_and_merged(self):
+        dave = User.objects.create_user(username='dave', password='password123')
+        self.befriend(self.bob, self.alice)
+        self.befriend(self.bob, self.carol)  # bob now has two friends: pulled
+        self.befriend(self.alice, dave)
+        self.assertTrue(HighDegreeAuthor.objects.filter(user=self.bob).exists())
+
+        metrics.reset()
+        first = self.post_as(dave, 'pushed 1')
+        pulled = self.post_as(self.bob, 'pulled')
+        last = self.post_as(dave, 'pushed 2')
+        self.assertFalse(TimelineEntry.objects.filter(post=pulled).exists())
+
+        seen = []
+        url = '/api/feed/?page_size=2'
+        while url:
+            response = self.get_feed(self.alice, url)
+            seen.extend(p['id'] for p in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, [last.id, pulled.id, first.id])
+
+        stats = metrics.snapshot()
+        self.assertEqual((stats['posts_pushed'], stats['posts_pulled']), (2, 1))
+        self.assertEqual(stats['pull_sources'], stats['feed_reads'])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=1)
+    def test_dropping_below_threshold_pushes_recent_posts(self):
+        self.befriend(self.bob, self.alice)
+        relationship = self.befriend(self.bob, self.carol)
+        pulled = self.post_as(self.bob, 'written while pulled')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            relationship.unfriend()
+        self.assertFalse(HighDegreeAuthor.objects.exists())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.alice, post=pulled).exists())
+
+    def test_visibility_changes_reach_timelines(self):
+        self.befriend(self.alice, self.bob)
+        post = self.post_as(self.bob, 'draft')
+        with self.captureOnCommitCallbacks(execute=True):
+            post.visibility = Post.ONLY_ME
+            post.save()
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+
+        # A post written as only_me is fanned out once it is opened up
+        post = Post.objects.get(pk=post.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.visibility = Post.PUBLIC
+            post.save()
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.alice, post=post).exists())
+
+
+@override_settings(FEED_FANOUT_ASYNC=True, FEED_FANOUT_MAX_ATTEMPTS=2, FEED_FANOUT_RETRY_BACKOFF=30)
+class FanoutQueueTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice', password='password123')
+        self.bob = User.objects.create_user(username='bob', password='password123')
+
+    def work(self):
+        call_command('process_fanout', '--once', stdout=StringIO())
+
+    def test_jobs_are_stored_with_the_change_and_run_by_the_worker(self):
+        relationship = Relationship.send_request(self.alice, self.bob)
+        relationship.accept()
+        post = Post.objects.create(title='queued', content='feed', author=self.bob, visibility=Post.ONLY_ME)
+        self.assertEqual(list(FanoutJob.objects.order_by('id').values_list('task', flat=True)),
+                         ['backfill_friendship', 'fan_out_post'])
+
+        self.work()
+        self.assertFalse(FanoutJob.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+
+        post.visibility = Post.FRIENDS
+        post.save()
+        self.work()
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.alice, post=post).exists())
+
+    def test_claims_skip_leased_jobs_and_failures_back_off(self):
+        first = FanoutJob.objects.create(task='fan_out_post', args=[0])
+        second = FanoutJob.objects.create(task='no_such_task', args=[])
+        self.assertEqual(FanoutJob.objects.claim(limit=1), [first])
+        [job] = FanoutJob.objects.claim(limit=5)
+        self.assertEqual(job, second)
+        self.assertEqual(FanoutJob.objects.claim(limit=5), [])
+
+        now = timezone.now()
+        job.mark_failed(KeyError('no_such_task'), now=now)
+        self.assertEqual(FanoutJob.objects.claim(limit=5, now=now + timedelta(seconds=29)), [])
+        [job] = FanoutJob.objects.claim(limit=5, now=now + timedelta(seconds=30))
+        self.assertEqual((job, job.attempts), (second, 2))
+        # Out of attempts: kept with its error instead of running again
+        self.assertEqual(FanoutJob.objects.claim(limit=5, now=now + timedelta(days=1)), [first])
+        job.refresh_from_db()
+        self.assertEqual(job.error, "'no_such_task'")
@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.db.models import F
+from rest_framework import viewsets, permissions
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from posts.models import Post
+from posts.serializers import PostSerializerWithAttachments
+from socials.blocks import exclude_blocked
+from . import metrics
+from .models import TimelineEntry, HighDegreeAuthor
+from .pagination import TimelineCursorPagination
+
+logger = logging.getLogger(__name__)
+
+
+class FeedViewSet(viewsets.GenericViewSet):
+    """
+    Home feed: posts from the user's friends, newest first.
+    """
+    serializer_class = PostSerializerWithAttachments
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = TimelineCursorPagination
+
+    def get_queryset(self):
+        return TimelineEntry.objects.filter(owner=self.request.user)
+
+    def get_pull_querysets(self):
+        """One keyset-ordered source per high-degree friend, shaped like a timeline entry"""
+        return [
+            Post.objects.filter(author_id=author_id).exclude(visibility=Post.ONLY_ME)
+            .only('id', 'created_at').annotate(post_id=F('id'))
+            for author_id in HighDegreeAuthor.objects.friends_of(self.request.user.id)
+        ]
+
+    def list(self, request):
+        # Pushed posts come from one index range scan of the timeline; pulled
+        # authors add one range scan each and are heap-merged into the page
+        pull_sources = self.get_pull_querysets()
+        started = time.perf_counter()
+        entries = self.paginator.paginate_querysets(
+            [self.get_queryset(), *pull_sources], request, view=self
+        )
+        merge_ms = (time.perf_counter() - started) * 1000
+
+        metrics.incr('feed_reads')
+        metrics.incr('pull_sources', len(pull_sources))
+        metrics.incr('merged_rows', self.paginator.merged_rows)
+        metrics.incr('merge_ms', merge_ms)
+        logger.debug("feed read user=%s pull_sources=%d merged_rows=%d merge_ms=%.2f",
+                     request.user.id, len(pull_sources), self.paginator.merged_rows, merge_ms)
+
+        # Visibility is rechecked at read time: a post may have been narrowed after fan-out
+        posts = Post.objects.visible_to(request.user, Post.objects.for_listing(request.user))
+        posts = exclude_blocked(posts, request.user, 'author').in_bulk([entry.post_id for entry in entries])
+        page = [posts[entry.post_id] for entry in entries if entry.post_id in posts]
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAdminUser])
+    def stats(self, request):
+        """Push/pull split and merge cost for this process"""
+        return Response(metrics.snapshot())
@@ -0,0 +1,104 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+
+from posts.models import Post
+
+BENCH_USERNAME = 'search-bench'
+
+# Words are drawn log-uniformly from VOCABULARY + SYNTHETIC_WORDS, so the
+# first entries are very common and the tail is rare, roughly like real text
+VOCABULARY = [
+    'travel', 'coffee', 'music', 'football', 'sunset', 'recipe', 'garden', 'movie',
+    'holiday', 'birthday', 'concert', 'mountain', 'beach', 'python', 'django', 'exam',
+    'weekend', 'family', 'friends', 'dinner', 'running', 'cycling', 'camera', 'puppy',
+    'kitten', 'rain', 'winter', 'summer', 'library', 'museum', 'wedding', 'festival',
+]
+SYNTHETIC_WORDS = 20_000
+
+SEED_SQL = """
+INSERT INTO posts_post (title, content, author_id, visibility, created_at, updated_at)
+SELECT
+    (SELECT string_agg((%(words)s::text[])[floor(power(%(n)s, random()))::int], ' ')
+       FROM generate_series(1, 4) t WHERE g > 0),
+    (SELECT string_agg((%(words)s::text[])[floor(power(%(n)s, random()))::int], ' ')
+       FROM generate_series(1, 40) t WHERE g > 0),
+    %(author)s,
+    'public',
+    now() - make_interval(secs => g),
+    now()
+FROM generate_series(1, %(batch)s) g
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark post full-text search latency. With --seed, synthetic posts are "
+        "added under a '%s' user until the table holds --posts rows." % BENCH_USERNAME
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=1_000_000,
+                            help="Target number of rows in posts_post when seeding")
+        parser.add_argument('--seed', action='store_true', help="Insert synthetic posts first")
+        parser.add_argument('--batch-size', type=int, default=200_000)
+        parser.add_argument('--runs', type=int, default=20, help="Timed runs per query")
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--legacy', action='store_true',
+                            help="Also time the old icontains search for comparison")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic posts and exit")
+        parser.add_argument('queries', nargs='*',
+                            default=['travel', 'kitten', 'wedding festival', '"summer museum"', 'w12345'])
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = Post.objects.filter(author__username=BENCH_USERNAME).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} synthetic row(s)"))
+            return
+
+        if options['seed']:
+            self.seed(options['posts'], options['batch_size'])
+
+        total = Post.objects.count()
+        self.stdout.write(f"posts_post rows: {total}")
+        for query in options['queries']:
+            self.report(f"fts    {query!r}", options['runs'],
+                        lambda: list(Post.objects.search_with_highlights(query)
+                                     .order_by('-rank', '-id')[:options['page_size']]))
+            if options['legacy']:
+                self.report(f"ilike  {query!r}", options['runs'],
+                            lambda: list(Post.objects.filter(
+                                Q(title__icontains=query) | Q(content__icontains=query)
+                            ).distinct()[:options['page_size']]))
+
+    def seed(self, target, batch_size):
+        author, _ = User.objects.get_or_create(username=BENCH_USERNAME)
+        words = VOCABULARY + [f'w{i}' for i in range(SYNTHETIC_WORDS)]
+        missing = target - Post.objects.count()
+        with connection.cursor() as cursor:
+            while missing > 0:
+                batch = min(batch_size, missing)
+                started = time.perf_counter()
+                cursor.execute(SEED_SQL, {
+                    'words': words, 'n': len(words), 'author': author.id, 'batch': batch,
+                })
+                missing -= batch
+                self.stdout.write(f"seeded {batch} posts in {time.perf_counter() - started:.1f}s")
+            cursor.execute("ANALYZE posts_post")
+
+    def report(self, label, runs, run_query):
+        run_query()  # warm the cache
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            run_query()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        self.stdout.write(
+            f"{label:<32} p50={statistics.median(timings):8.2f}ms p95={p95:8.2f}ms"
+        )
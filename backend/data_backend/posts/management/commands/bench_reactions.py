@@ -0,0 +1,133 @@
+import random
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import IntegrityError, close_old_connections, transaction
+
+from posts.models import Post, PostStats, Reaction
+from posts.reaction_buffer import ReactionBuffer
+
+BENCH_PREFIX = 'reaction-bench-'
+REACTIONS = [choice for choice, _ in Reaction.REACT_CHOICES]
+
+
+def legacy_set_reaction(user_id, post_id, reaction_type):
+    """The read-then-write flow set_reaction used before the single upsert"""
+    Post.objects.get(pk=post_id)  # the view's get_object_or_404
+    with transaction.atomic():
+        reaction = Reaction.objects.select_for_update().filter(user_id=user_id, post_id=post_id).first()
+        if reaction is None:
+            try:
+                with transaction.atomic():
+                    Reaction.objects.create(user_id=user_id, post_id=post_id, reaction=reaction_type)
+            except IntegrityError:
+                reaction = Reaction.objects.select_for_update().get(user_id=user_id, post_id=post_id)
+            else:
+                PostStats.objects.bump(post_id, **{f'{reaction_type}_count': 1})
+                return
+        if reaction.reaction != reaction_type:
+            PostStats.objects.bump(post_id, **{
+                f'{reaction.reaction}_count': -1,
+                f'{reaction_type}_count': 1,
+            })
+            reaction.reaction = reaction_type
+            reaction.save(update_fields=['reaction'])
+
+
+def legacy_delete_reaction(user_id, post_id):
+    Post.objects.get(pk=post_id)
+    with transaction.atomic():
+        removed = list(
+            Reaction.objects.select_for_update().filter(user_id=user_id, post_id=post_id)
+            .values_list('reaction', flat=True)
+        )
+        Reaction.objects.filter(user_id=user_id, post_id=post_id).delete()
+        if removed:
+            PostStats.objects.bump(post_id, **{f'{removed[0]}_count': -len(removed)})
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark a reaction storm on one post: --threads workers react and unreact "
+        "for --seconds as '%s*' users, then report write throughput." % BENCH_PREFIX
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--users', type=int, default=200, help="Distinct reacting users")
+        parser.add_argument('--seconds', type=float, default=5.0)
+        parser.add_argument('--unreact-ratio', type=float, default=0.2)
+        parser.add_argument('--mode', choices=['legacy', 'upsert', 'coalesce'], action='append',
+                            help="Write paths to time (default: all three)")
+        parser.add_argument('--flush-ms', type=float, default=20)
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic users and exit")
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            deleted, _ = User.objects.filter(username__startswith=BENCH_PREFIX).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} synthetic row(s)"))
+            return
+
+        users = self.seed_users(options['users'])
+        post = Post.objects.create(author_id=users[0], title='reaction bench', content='storm')
+        try:
+            for mode in options['mode'] or ['legacy', 'upsert', 'coalesce']:
+                self.run(mode, post.pk, users, options)
+        finally:
+            post.delete()
+
+    def seed_users(self, count):
+        existing = set(User.objects.filter(username__startswith=BENCH_PREFIX).values_list('username', flat=True))
+        User.objects.bulk_create(
+            User(username=f'{BENCH_PREFIX}{i}') for i in range(count) if f'{BENCH_PREFIX}{i}' not in existing
+        )
+        return list(User.objects.filter(username__startswith=BENCH_PREFIX).values_list('id', flat=True)[:count])
+
+    def run(self, mode, post_id, users, options):
+        Reaction.objects.filter(post_id=post_id).delete()
+        PostStats.objects.rebuild(post_ids=[post_id])
+        buffer = ReactionBuffer(options['flush_ms'] / 1000, max_pending=len(users))
+        if mode == 'legacy':
+            react, unreact = legacy_set_reaction, legacy_delete_reaction
+        elif mode == 'upsert':
+            react = lambda user_id, post_id, reaction: Reaction.objects.set_reaction(user_id, post_id, reaction)
+            unreact = Reaction.objects.delete_reaction
+        else:
+            react, unreact = buffer.react, buffer.unreact
+
+        deadline = time.perf_counter() + options['seconds']
+        counts, errors = [], []
+
+        def worker():
+            done = 0
+            try:
+                while time.perf_counter() < deadline:
+                    user_id = random.choice(users)
+                    if random.random() < options['unreact_ratio']:
+                        unreact(user_id, post_id)
+                    else:
+                        react(user_id, post_id, random.choice(REACTIONS))
+                    done += 1
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                counts.append(done)
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker) for _ in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        buffer.flush()
+        elapsed = time.perf_counter() - started
+
+        drifted = list(PostStats.objects.drifted(post_ids=[post_id]))
+        self.stdout.write(
+            f"{mode:<9} {sum(counts) / elapsed:10.0f} writes/s  "
+            f"({sum(counts)} in {elapsed:.1f}s, {len(errors)} errors, "
+            f"counters {'DRIFTED' if drifted else 'consistent'})"
+        )
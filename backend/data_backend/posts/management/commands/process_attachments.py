@@ -0,0 +1,88 @@
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from data_backend.images import derivative_sizes, render_derivatives
+from posts.media import process_file
+from posts.models import Attachment
+from profiles.models import Profile
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Process uploaded attachments and profile pictures: sniff their type and make "
+        "thumbnails in a process pool. Several workers can run at once; each claims "
+        "its own jobs. Pictures without derivatives are picked up too, so the first "
+        "run backfills existing ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=getattr(settings, 'ATTACHMENTS_WORKER_PROCESSES', 2))
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help="Jobs claimed per round (default: 4 per process)")
+        parser.add_argument('--poll-interval', type=float,
+                            default=getattr(settings, 'ATTACHMENTS_POLL_INTERVAL', 1.0))
+        parser.add_argument('--once', action='store_true', help="Exit once no job is due")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size'] or 4 * options['processes']
+        sizes = derivative_sizes()
+        samples = getattr(settings, 'VIDEO_THUMBNAIL_SAMPLES', 10)
+        processed = failed = pictures = 0
+        # Spawned rather than forked, so the children inherit nothing from
+        # this process, its database connection included
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=options['processes'], mp_context=context) as pool:
+            while True:
+                jobs = Attachment.objects.claim(batch_size)
+                profiles = Profile.objects.claim_pictures(batch_size)
+                if not jobs and not profiles:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    # Drop the connection if it broke or aged out while idle
+                    close_old_connections()
+                    continue
+                futures = {}
+                for job in [*jobs, *profiles]:
+                    # Resolving the path can fail too (a storage without local files); that fails this job only
+                    try:
+                        if isinstance(job, Profile):
+                            future = pool.submit(render_derivatives, job.profile_picture.path, sizes)
+                        else:
+                            future = pool.submit(process_file, job.file.path, sizes, samples)
+                    except Exception as exc:
+                        failed += self.fail(job, exc)
+                    else:
+                        futures[future] = job
+                for future in as_completed(futures):
+                    job = futures[future]
+                    try:
+                        if isinstance(job, Profile):
+                            job.mark_picture_ready(future.result())
+                            pictures += 1
+                        elif job.mark_ready(**future.result()):
+                            processed += 1
+                        else:
+                            logger.info("Attachment %s was deleted while it was processed", job.pk)
+                    except Exception as exc:
+                        failed += self.fail(job, exc)
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {processed} attachment(s), {failed} failed, and {pictures} profile picture(s)"
+        ))
+
+    def fail(self, job, exc):
+        """Reschedule a job that raised; returns 1 if it still exists, for the failure count"""
+        if isinstance(job, Profile):
+            job.mark_picture_failed(exc)
+            return 0
+        logger.warning("Attachment %s failed (attempt %s): %s", job.pk, job.attempts, exc)
+        return int(job.mark_failed(exc))
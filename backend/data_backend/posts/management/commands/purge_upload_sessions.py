@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = "Delete resumable upload sessions that expired unfinished, with their staging files."
+
+    def handle(self, *args, **options):
+        purged = UploadSession.objects.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f"Purged {purged} expired upload session(s)"))
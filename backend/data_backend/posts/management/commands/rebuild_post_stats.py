@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import PostStats
+
+
+class Command(BaseCommand):
+    help = "Verify and rebuild the denormalized PostStats counters from Reaction and Comment rows"
+
+    def add_arguments(self, parser):
+        parser.add_argument('post_ids', nargs='*', type=int,
+                            help="Only check these posts (default: every post)")
+        parser.add_argument('--verify', action='store_true',
+                            help="Report drifted counters without rewriting them")
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        post_ids = options['post_ids'] or None
+
+        drift = list(PostStats.objects.drifted(post_ids))
+        for post_id, field, stored, actual in drift:
+            self.stdout.write(f"post {post_id}: {field} stored={stored} actual={actual}")
+
+        if options['verify']:
+            if drift:
+                raise CommandError(f"{len(drift)} drifted counter(s) found")
+            self.stdout.write(self.style.SUCCESS("All post counters are consistent"))
+            return
+
+        written = PostStats.objects.rebuild(post_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt counters for {written} post(s), {len(drift)} drifted counter(s) fixed"
+        ))
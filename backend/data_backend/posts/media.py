@@ -0,0 +1,115 @@
+"""
+File inspection for attachments, run by the process_attachments worker.
+
+Everything here takes a path and returns plain data, without touching
+Django, so it can run in a process pool: decoding stays off the request
+threads and off the worker's own database connection.
+"""
+import cv2
+import magic
+import numpy as np
+
+from data_backend.images import DEFAULT_SIZES, render_derivatives
+
+THUMBNAIL_QUALITY = 85
+VIDEO_SAMPLES = 10  # frames sampled per video
+SCORE_WIDTH = 320  # frames are scored at this width
+SPRITE_TILE_WIDTH = 160
+SPRITE_COLUMNS = 5
+
+
+def sniff_file_type(path):
+    """'image', 'video' or 'other', from the file's leading bytes rather than its name"""
+    with open(path, 'rb') as f:
+        head = f.read(2048)
+    mime = magic.from_buffer(head, mime=True)
+    if mime.startswith('image/'):
+        return 'image'
+    if mime.startswith('video/'):
+        return 'video'
+    return 'other'
+
+
+def _encode_jpeg(frame):
+    encoded, jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return jpeg.tobytes() if encoded else None
+
+
+def _frame_score(frame):
+    """Sharpness (variance of the Laplacian) weighted down for frames that are mostly black or blown out"""
+    small = cv2.resize(frame, (SCORE_WIDTH, max(1, frame.shape[0] * SCORE_WIDTH // frame.shape[1])))
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    sharpness = cv2.Laplacian(gray, cv2.CV_64F).var()
+    exposure = 1 - abs(float(gray.mean()) - 128) / 128
+    return sharpness * exposure ** 2
+
+
+def _sprite_sheet(frames):
+    """Frames shrunk to SPRITE_TILE_WIDTH and laid out SPRITE_COLUMNS to a row"""
+    height, width = frames[0].shape[:2]
+    tile_height = max(1, round(height * SPRITE_TILE_WIDTH / width))
+    tiles = [cv2.resize(frame, (SPRITE_TILE_WIDTH, tile_height), interpolation=cv2.INTER_AREA)
+             for frame in frames]
+    columns = min(SPRITE_COLUMNS, len(tiles))
+    tiles += [np.zeros_like(tiles[0])] * (-len(tiles) % columns)
+    rows = [np.hstack(tiles[i:i + columns]) for i in range(0, len(tiles), columns)]
+    layout = {'columns': columns, 'rows': len(rows), 'tile_width': SPRITE_TILE_WIDTH, 'tile_height': tile_height}
+    return _encode_jpeg(np.vstack(rows)), layout
+
+
+def inspect_video(path, samples=VIDEO_SAMPLES):
+    """
+    Duration, resolution, the best of `samples` evenly spaced frames as a
+    JPEG thumbnail and a sprite sheet of all of them for scrubbing. Each
+    sample is one seek and one decoded frame, so the cost does not grow
+    with the length of the video.
+    """
+    capture = cv2.VideoCapture(path)
+    try:
+        if not capture.isOpened():
+            return {}
+        fps = capture.get(cv2.CAP_PROP_FPS)
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        width = int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)) or None
+        height = int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)) or None
+        duration = frame_count / fps if fps > 0 and frame_count > 0 else None
+
+        frames, timestamps = [], []
+        if duration:
+            # Midpoints of N equal slices: skips the usual black first frame
+            for i in range(samples):
+                position = (i + 0.5) * duration * 1000 / samples
+                capture.set(cv2.CAP_PROP_POS_MSEC, position)
+                success, frame = capture.read()
+                if success:
+                    frames.append(frame)
+                    timestamps.append(round(position))
+        if not frames:
+            # Unknown length (some streams report none) or seeking failed
+            capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = capture.read()
+            if success:
+                frames, timestamps = [frame], [0]
+    finally:
+        capture.release()
+
+    info = {'duration': duration, 'width': width, 'height': height}
+    if frames:
+        best = max(frames, key=_frame_score)
+        sprite, layout = _sprite_sheet(frames)
+        info.update(thumbnail=_encode_jpeg(best), sprite=sprite, sprite_layout={**layout, 'timestamps': timestamps})
+    return info
+
+
+def process_file(path, sizes=DEFAULT_SIZES, samples=VIDEO_SAMPLES):
+    """
+    Everything the worker stores for one attachment: 'file_type', plus
+    'derivatives' for images and the inspect_video() fields for videos.
+    """
+    file_type = sniff_file_type(path)
+    result = {'file_type': file_type}
+    if file_type == 'image':
+        result['derivatives'] = render_derivatives(path, sizes)
+    elif file_type == 'video':
+        result.update(inspect_video(path, samples))
+    return result
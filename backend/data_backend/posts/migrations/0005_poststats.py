@@ -0,0 +1,52 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+BACKFILL_SQL = """
+INSERT INTO posts_poststats
+    (post_id, like_count, love_count, dislike_count, hate_count, comment_count, reply_count)
+SELECT p.id,
+       COALESCE(r.like_count, 0), COALESCE(r.love_count, 0),
+       COALESCE(r.dislike_count, 0), COALESCE(r.hate_count, 0),
+       COALESCE(c.comment_count, 0), COALESCE(c.reply_count, 0)
+FROM posts_post p
+LEFT JOIN (
+    SELECT post_id,
+           COUNT(*) FILTER (WHERE reaction = 'like') AS like_count,
+           COUNT(*) FILTER (WHERE reaction = 'love') AS love_count,
+           COUNT(*) FILTER (WHERE reaction = 'dislike') AS dislike_count,
+           COUNT(*) FILTER (WHERE reaction = 'hate') AS hate_count
+    FROM posts_reaction GROUP BY post_id
+) r ON r.post_id = p.id
+LEFT JOIN (
+    SELECT post_id,
+           COUNT(*) AS comment_count,
+           COUNT(*) FILTER (WHERE parent_id IS NOT NULL) AS reply_count
+    FROM posts_comment WHERE NOT deleted GROUP BY post_id
+) c ON c.post_id = p.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_post_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostStats',
+            fields=[
+                ('post', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='posts.post')),
+                ('like_count', models.IntegerField(default=0)),
+                ('love_count', models.IntegerField(default=0)),
+                ('dislike_count', models.IntegerField(default=0)),
+                ('hate_count', models.IntegerField(default=0)),
+                ('comment_count', models.IntegerField(default=0)),
+                ('reply_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
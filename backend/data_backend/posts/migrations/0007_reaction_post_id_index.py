@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:41
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_post_search_vector'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reaction',
+            index=models.Index(fields=['post', '-id'], name='posts_reaction_post_id_idx'),
+        ),
+    ]
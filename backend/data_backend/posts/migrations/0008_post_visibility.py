@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0007_reaction_post_id_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='visibility',
+            field=models.CharField(choices=[('public', 'Public'), ('friends', 'Friends'), ('only_me', 'Only me')], default='public', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['visibility', '-created_at', '-id'], name='posts_post_visibility_idx'),
+        ),
+    ]
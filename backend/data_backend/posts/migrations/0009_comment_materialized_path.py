@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# Existing comments: walk every tree from its top-level comment down
+BACKFILL_SQL = """
+WITH RECURSIVE tree (id, path, depth, root_id) AS (
+    SELECT id, ''::text, 0, NULL::bigint
+    FROM posts_comment WHERE parent_id IS NULL
+  UNION ALL
+    SELECT c.id, t.path || lpad(t.id::text, 10, '0') || '/', t.depth + 1, COALESCE(t.root_id, t.id)
+    FROM posts_comment c JOIN tree t ON c.parent_id = t.id
+)
+UPDATE posts_comment c
+SET path = tree.path, depth = tree.depth, root_id = tree.root_id
+FROM tree
+WHERE c.id = tree.id AND tree.depth > 0
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_visibility'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='root',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.comment'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'depth', 'id'], name='posts_comment_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['path'], name='posts_comment_path_idx', opclasses=['text_pattern_ops']),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:58
+
+from django.conf import settings
+from django.db import migrations, models
+
+BACKFILL_SQL = """
+UPDATE posts_comment c
+SET reply_count = r.count
+FROM (
+    SELECT parent_id, count(*) AS count
+    FROM posts_comment
+    WHERE parent_id IS NOT NULL AND NOT deleted
+    GROUP BY parent_id
+) r
+WHERE c.id = r.parent_id
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_comment_materialized_path'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='reply_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['parent', 'id'], name='posts_comment_replies_idx'),
+        ),
+        migrations.RunSQL(BACKFILL_SQL, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_comment_reply_counts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='error',
+            field=models.TextField(blank=True),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='attachment',
+            name='file_type',
+            field=models.CharField(blank=True, choices=[('image', 'Image'), ('video', 'Video'), ('other', 'Other')], max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='attachment',
+            index=models.Index(condition=models.Q(('status__in', ['pending', 'processing'])), fields=['available_at', 'id'], name='posts_attachment_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0011_attachment_processing_queue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        # Images processed before derivatives existed go through the queue again
+        migrations.RunSQL(
+            "UPDATE posts_attachment SET status = 'pending', attempts = 0, available_at = now() "
+            "WHERE file_type = 'image' AND status = 'ready'",
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='sprite',
+            field=models.ImageField(blank=True, null=True, upload_to='sprites/%Y/%m/%d/'),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='sprite_layout',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='attachment',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        # Videos only ever got a first-frame thumbnail; redo them
+        migrations.RunSQL(
+            "UPDATE posts_attachment SET status = 'pending', attempts = 0, available_at = now() "
+            "WHERE file_type = 'video' AND status = 'ready'",
+            migrations.RunSQL.noop,
+        ),
+    ]
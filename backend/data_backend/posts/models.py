@@ -1,20 +1,51 @@
-from django.db import models
+from django.conf import settings
+from django.db import models, connection, transaction, IntegrityError
 from django.contrib.auth.models import User
-from django.db.models import Q, Prefetch, Count
+from django.db.models import Q, F, Prefetch, Count, Exists, OuterRef, Subquery, Value, IntegerField
+from django.db.models.expressions import RawSQL
+from django.db.models import Window
+from django.db.models.functions import Coalesce, Cast, RowNumber
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector, SearchVectorField, SearchQuery, SearchRank, SearchHeadline
 from django.utils import timezone
-from django.core.validators import FileExtensionValidator
-from django.core.files.base import ContentFile
-import magic
+from django.core.files.base import ContentFile, File
+import hashlib
 import os
-import cv2
-from PIL import Image
+import uuid
+from datetime import timedelta
+from socials.models import Relationship
+from socials.blocks import exclude_blocked, blocked_user_ids
+from data_backend.images import EXTENSIONS, store_derivatives
+
+SEARCH_CONFIG = 'english'
 
 class PostManager(models.Manager):
-    def search(self, query):
-        return self.filter(
-            Q(title__icontains=query) |
-            Q(content__icontains=query)
-        ).distinct()
+    def search(self, query, queryset=None):
+        """
+        Full-text match against the GIN-indexed `search_vector`, annotated
+        with `rank`. Pass `queryset` to keep its filters and prefetches.
+
+        Only the newest POSTS_SEARCH_MAX_CANDIDATES matches are ranked, so a
+        term that appears in half the table costs the same as a rare one.
+        """
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        queryset = self.all() if queryset is None else queryset
+        max_candidates = getattr(settings, 'POSTS_SEARCH_MAX_CANDIDATES', 10000)
+        candidates = queryset.filter(search_vector=search_query) \
+            .order_by('-created_at', '-id').values('pk')[:max_candidates]
+        # ts_rank returns float4; casting keeps cursor values exact on the round trip
+        return queryset.filter(pk__in=Subquery(candidates)).annotate(
+            rank=Cast(SearchRank(F('search_vector'), search_query), models.FloatField())
+        )
+
+    def search_with_highlights(self, query, queryset=None):
+        """`search` plus `title_highlight`/`content_highlight` snippets wrapped in <mark>"""
+        search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+        options = {'config': SEARCH_CONFIG, 'start_sel': '<mark>', 'stop_sel': '</mark>'}
+        return self.search(query, queryset).annotate(
+            title_highlight=SearchHeadline('title', search_query, highlight_all=True, **options),
+            content_highlight=SearchHeadline('content', search_query, max_words=35, min_words=15, **options),
+        )
 
     def get_posts_by_user(self, user):
         return self.filter(author=user).select_related('author').order_by('-created_at')
@@ -31,33 +62,335 @@ class PostManager(models.Manager):
     def get_post_with_attachments(self, post_id):
         return self.filter(id=post_id).prefetch_related('attachments').first()
 
+    def with_aggregates(self, user=None):
+        """
+        Annotate each post with `<reaction>_count` for every reaction type,
+        `live_comments_count` and the given user's `viewer_reaction`.
+        Counts are read from the denormalized PostStats row through a single
+        LEFT JOIN, so a page costs the same number of queries whatever its size.
+        """
+        annotations = {
+            f'{reaction_type}_count': Coalesce(F(f'stats__{reaction_type}_count'), 0)
+            for reaction_type, _ in Reaction.REACT_CHOICES
+        }
+        annotations['live_comments_count'] = Coalesce(F('stats__comment_count'), 0)
+        if user is not None and user.is_authenticated:
+            annotations['viewer_reaction'] = Subquery(
+                Reaction.objects.filter(post=OuterRef('pk'), user=user).values('reaction')[:1]
+            )
+        else:
+            annotations['viewer_reaction'] = Value(None, output_field=models.CharField())
+        return self.annotate(**annotations)
+
+    def for_listing(self, user=None):
+        """Posts with everything the list serializers read, in a fixed number of queries."""
+        return self.with_aggregates(user).select_related('author').prefetch_related('attachments')
+
+    def visible_to(self, user, queryset=None):
+        """
+        Posts `user` may read: public ones, their own, and friends-only posts
+        by their friends. Friendship is a semi-join on the canonical
+        Relationship pair, one index seek per friends-only candidate.
+        """
+        queryset = self.all() if queryset is None else queryset
+        if user is None or not user.is_authenticated:
+            return queryset.filter(visibility=Post.PUBLIC)
+        is_friend = Relationship.objects.between(user.pk, OuterRef('author_id')).filter(status='accepted')
+        return queryset.filter(
+            Q(visibility=Post.PUBLIC) | Q(author_id=user.pk) |
+            (Q(visibility=Post.FRIENDS) & Exists(is_friend))
+        )
+
+def _count_subquery(queryset):
+    counts = queryset.order_by().values('post').annotate(count=Count('pk')).values('count')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
 class Post(models.Model):
+    PUBLIC = 'public'
+    FRIENDS = 'friends'
+    ONLY_ME = 'only_me'
+    VISIBILITY_CHOICES = [
+        (PUBLIC, 'Public'),
+        (FRIENDS, 'Friends'),
+        (ONLY_ME, 'Only me'),
+    ]
+
     title = models.CharField(max_length=50)
     content = models.TextField()
     author = models.ForeignKey(User, on_delete=models.CASCADE)
+    visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default=PUBLIC)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Maintained by PostgreSQL on every write; titles rank above content
+    search_vector = models.GeneratedField(
+        expression=SearchVector('title', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('content', weight='B', config=SEARCH_CONFIG),
+        output_field=SearchVectorField(),
+        db_persist=True,
+    )
     objects = PostManager()
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='posts_post_created_id_idx'),
+            models.Index(fields=['author', '-created_at', '-id'], name='posts_post_author_created_idx'),
+            # Public-only listings (anonymous readers) stay one ordered range scan
+            models.Index(fields=['visibility', '-created_at', '-id'], name='posts_post_visibility_idx'),
+            GinIndex(fields=['search_vector'], name='posts_post_search_gin'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # What the row said when loaded, so post_save handlers can tell a change of audience
+        instance._loaded_visibility = instance.__dict__.get('visibility')
+        return instance
+
+BUMP_MANY_SQL = """
+UPDATE posts_poststats s SET {assignments}
+FROM unnest({arrays}) AS d ({columns})
+WHERE s.post_id = d.post_id
+RETURNING s.post_id
+"""
+
+class PostStatsManager(models.Manager):
+    def bump(self, post_id, **deltas):
+        """
+        Apply counter deltas with atomic F() increments. A missing row is
+        rebuilt from the source tables, which already include the caller's write.
+        """
+        updates = {field: F(field) + delta for field, delta in deltas.items() if delta}
+        if not updates:
+            return
+        if not self.filter(post_id=post_id).update(**updates):
+            self.rebuild(post_ids=[post_id])
+
+    def bump_many(self, deltas):
+        """
+        `bump` for many posts in one UPDATE: `deltas` maps post ids to
+        {field: delta} over the same fields.
+        """
+        deltas = {post_id: fields for post_id, fields in deltas.items() if any(fields.values())}
+        if not deltas:
+            return
+        fields = list(next(iter(deltas.values())))
+        columns = [list(deltas)] + [[row[field] for row in deltas.values()] for field in fields]
+        sql = BUMP_MANY_SQL.format(
+            assignments=', '.join(f'{field} = s.{field} + d.{field}' for field in fields),
+            arrays=', '.join(['%s::bigint[]'] + ['%s::int[]'] * len(fields)),
+            columns=', '.join(['post_id'] + fields),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, columns)
+            updated = {row[0] for row in cursor.fetchall()}
+        if missing := [post_id for post_id in deltas if post_id not in updated]:
+            self.rebuild(post_ids=missing)
+
+    def computed(self, post_ids=None):
+        """Counters recomputed from Reaction and Comment rows, one dict per post."""
+        posts = Post.objects.order_by('pk')
+        if post_ids is not None:
+            posts = posts.filter(pk__in=post_ids)
+        annotations = {
+            f'{reaction_type}_count': _count_subquery(
+                Reaction.objects.filter(post=OuterRef('pk'), reaction=reaction_type)
+            )
+            for reaction_type, _ in Reaction.REACT_CHOICES
+        }
+        annotations['comment_count'] = _count_subquery(
+            Comment.objects.filter(post=OuterRef('pk'), deleted=False)
+        )
+        annotations['reply_count'] = _count_subquery(
+            Comment.objects.filter(post=OuterRef('pk'), deleted=False, parent__isnull=False)
+        )
+        return posts.annotate(**annotations).values('id', *annotations)
+
+    def rebuild(self, post_ids=None, batch_size=1000):
+        """Recompute and upsert the counters of the given posts (all by default)."""
+        written = 0
+        batch = []
+        for row in self.computed(post_ids).iterator(chunk_size=batch_size):
+            batch.append(self.model(post_id=row.pop('id'), **row))
+            if len(batch) >= batch_size:
+                written += self._upsert(batch)
+                batch = []
+        if batch:
+            written += self._upsert(batch)
+        return written
+
+    def drifted(self, post_ids=None):
+        """Yield (post_id, field, stored, actual) for every counter that disagrees."""
+        stored = {
+            row['post_id']: row
+            for row in self.filter(**({'post_id__in': post_ids} if post_ids is not None else {}))
+            .values('post_id', *PostStats.COUNTER_FIELDS)
+        }
+        for row in self.computed(post_ids).iterator():
+            current = stored.get(row['id'], {})
+            for field in PostStats.COUNTER_FIELDS:
+                if current.get(field, 0) != row[field]:
+                    yield row['id'], field, current.get(field, 0), row[field]
+
+    def _upsert(self, rows):
+        self.bulk_create(
+            rows,
+            update_conflicts=True,
+            unique_fields=['post'],
+            update_fields=PostStats.COUNTER_FIELDS,
+        )
+        return len(rows)
+
+class PostStats(models.Model):
+    """
+    Denormalized per-post counters, kept in step by the Reaction and Comment
+    write paths and repairable with `manage.py rebuild_post_stats`.
+    """
+    post = models.OneToOneField(Post, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    like_count = models.IntegerField(default=0)
+    love_count = models.IntegerField(default=0)
+    dislike_count = models.IntegerField(default=0)
+    hate_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    reply_count = models.IntegerField(default=0)
+    objects = PostStatsManager()
+
+    REACTION_FIELDS = ['like_count', 'love_count', 'dislike_count', 'hate_count']
+    COUNTER_FIELDS = REACTION_FIELDS + ['comment_count', 'reply_count']
+
+    def __str__(self):
+        return f"Stats for post {self.post_id}"
+
+# One statement for a whole batch. `previous` locks and reads the rows that
+# already exist before the INSERT reaches them (the INSERT joins it), so the
+# counter deltas are exact; `inserted` tells new rows from updated ones.
+UPSERT_REACTIONS_SQL = """
+WITH input AS (
+    SELECT * FROM unnest(%s::int[], %s::bigint[], %s::varchar[]) AS i (user_id, post_id, reaction)
+    {restriction}
+), previous AS (
+    SELECT r.user_id, r.post_id, r.reaction
+    FROM posts_reaction r JOIN input USING (user_id, post_id)
+    FOR UPDATE OF r
+), upserted AS (
+    INSERT INTO posts_reaction (user_id, post_id, reaction)
+    SELECT i.user_id, i.post_id, i.reaction FROM input i LEFT JOIN previous p USING (user_id, post_id)
+    ON CONFLICT (user_id, post_id) DO UPDATE SET reaction = EXCLUDED.reaction
+    RETURNING id, user_id, post_id, reaction, xmax = 0 AS inserted
+)
+SELECT u.id, u.user_id, u.post_id, u.reaction, p.reaction, u.inserted
+FROM upserted u LEFT JOIN previous p USING (user_id, post_id)
+"""
+
+DELETE_REACTIONS_SQL = """
+DELETE FROM posts_reaction r
+USING unnest(%s::int[], %s::bigint[]) AS d (user_id, post_id)
+WHERE r.user_id = d.user_id AND r.post_id = d.post_id
+RETURNING r.post_id, r.reaction
+"""
 
 class ReactionManager(models.Manager):
-    def set_reaction(self, user, post, reaction_type):
+    def set_reaction(self, user, post, reaction_type, posts=None):
+        """
+        Create or change `user`'s reaction to `post`. Returns (reaction,
+        created), or None for an unknown reaction type or, when `posts` is
+        given, a post outside that queryset.
+        """
         if reaction_type not in dict(Reaction.REACT_CHOICES):
             return None
-        return self.update_or_create(
-            user=user,
-            post=post,
-            defaults={'reaction': reaction_type}
-        )
+        results = self.upsert([(getattr(user, 'pk', user), getattr(post, 'pk', post), reaction_type)], posts)
+        if not results:
+            return None
+        reaction, created = results[0]
+        if isinstance(user, User):
+            reaction.user = user
+        return reaction, created
 
     def delete_reaction(self, user, post):
-        return self.filter(user=user, post=post).delete()
+        deleted = self.remove([(getattr(user, 'pk', user), getattr(post, 'pk', post))])
+        return deleted, {Reaction._meta.label: deleted}
+
+    def upsert(self, rows, posts=None):
+        """
+        Write (user_id, post_id, reaction) rows with one INSERT ... ON
+        CONFLICT DO UPDATE and move the PostStats counters to match, in one
+        transaction. Pairs must be unique. Rows for posts outside `posts`
+        are skipped. Returns [(reaction, created), ...].
+        """
+        if not rows:
+            return []
+        restriction, params = '', []
+        if posts is not None:
+            selection, params = posts.order_by().values('pk').query.sql_with_params()
+            restriction = f'WHERE i.post_id IN ({selection})'
+        user_ids, post_ids, reactions = (list(column) for column in zip(*rows))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(UPSERT_REACTIONS_SQL.format(restriction=restriction),
+                               [user_ids, post_ids, reactions, *params])
+                written = cursor.fetchall()
+
+            deltas = {}
+            stale = set()
+            results = []
+            for reaction_id, user_id, post_id, reaction, previous, inserted in written:
+                counters = deltas.setdefault(post_id, dict.fromkeys(PostStats.REACTION_FIELDS, 0))
+                if previous is None and not inserted:
+                    # Created by a concurrent request after `previous` read the table
+                    stale.add(post_id)
+                elif previous != reaction:
+                    counters[f'{reaction}_count'] += 1
+                    if previous is not None:
+                        counters[f'{previous}_count'] -= 1
+                results.append((self.model(id=reaction_id, user_id=user_id, post_id=post_id,
+                                           reaction=reaction), inserted))
+            PostStats.objects.bump_many(deltas)
+            if stale:
+                # Holding the stats rows makes the recount exact: writers that
+                # already bumped them have committed, the rest bump after it
+                list(PostStats.objects.select_for_update().filter(post_id__in=stale).order_by('post_id').values('pk'))
+                PostStats.objects.rebuild(post_ids=sorted(stale))
+        return results
+
+    def remove(self, pairs):
+        """Delete the reactions of the given (user_id, post_id) pairs in one statement. Returns how many went."""
+        if not pairs:
+            return 0
+        user_ids, post_ids = (list(column) for column in zip(*pairs))
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(DELETE_REACTIONS_SQL, [user_ids, post_ids])
+                removed = cursor.fetchall()
+            deltas = {}
+            for post_id, reaction in removed:
+                deltas.setdefault(post_id, dict.fromkeys(PostStats.REACTION_FIELDS, 0))[f'{reaction}_count'] -= 1
+            PostStats.objects.bump_many(deltas)
+        return len(removed)
 
     def get_reaction(self, user, post):
         return self.filter(user=user, post=post).first()
 
+    def reactions_of(self, user, post_ids):
+        """{post_id: reaction} of `user` for the posts it reacted to, off the (user, post) unique index"""
+        if not post_ids:
+            return {}
+        return dict(self.filter(user=user, post_id__in=post_ids).values_list('post_id', 'reaction'))
+
+    def friends_reacted(self, post_ids, friend_ids, limit=3):
+        """
+        Up to `limit` reactions per post from `friend_ids`, most recent first,
+        for a whole page of posts in one query: {post_id: [reaction, ...]}.
+        """
+        if not post_ids or not friend_ids:
+            return {}
+        reactions = self.filter(post_id__in=post_ids, user_id__in=friend_ids).annotate(
+            position=Window(RowNumber(), partition_by=F('post_id'), order_by=F('id').desc())
+        ).filter(position__lte=limit).select_related('user').order_by('post_id', 'position')
+        by_post = {}
+        for reaction in reactions:
+            by_post.setdefault(reaction.post_id, []).append(reaction)
+        return by_post
+
 class Reaction(models.Model):
     REACT_CHOICES = [
         ('like', 'Like'),
@@ -72,25 +405,119 @@ class Reaction(models.Model):
 
     class Meta:
         unique_together = ['user', 'post']
+        indexes = [
+            # Newest-first keyset pages of one post's reactions
+            models.Index(fields=['post', '-id'], name='posts_reaction_post_id_idx'),
+        ]
+
+# The first `limit` replies of each parent, straight off the (parent, id) index
+FIRST_REPLIES_SQL = """
+SELECT r.id
+FROM unnest(%s::bigint[]) AS p (id)
+CROSS JOIN LATERAL (
+    SELECT id FROM posts_comment
+    WHERE parent_id = p.id AND NOT deleted AND user_id <> ALL(%s::bigint[])
+    ORDER BY id
+    LIMIT %s
+) r
+"""
+
+# Rows that change state report where their counters live; the final
+# `deleted` check makes a row that lost a race to the same state a no-op
+MODERATE_SQL = """
+UPDATE posts_comment SET deleted = %s, deleted_by_id = %s, deleted_at = %s, updated_at = now()
+WHERE id IN ({selection}) AND deleted = %s
+RETURNING post_id, parent_id
+"""
+
+BUMP_REPLY_COUNTS_SQL = """
+UPDATE posts_comment c SET reply_count = c.reply_count + d.delta
+FROM unnest(%s::bigint[], %s::int[]) AS d (id, delta)
+WHERE c.id = d.id
+"""
 
 class CommentManager(models.Manager):
-    def get_comments_for_post(self, post, include_deleted=False):
+    def get_comments_for_post(self, post, include_deleted=False, viewer=None):
+        """Top-level comments with their replies prefetched, minus any written across a block with `viewer`"""
         qs = self.filter(post=post, parent__isnull=True)
         if not include_deleted:
             qs = qs.filter(deleted=False)
-        return qs.select_related('user').prefetch_related(
-            Prefetch('replies',
-                   queryset=Comment.objects.filter(deleted=False)
-                   .select_related('user'))
+        replies = Comment.objects.filter(deleted=False).select_related('user')
+        return exclude_blocked(qs, viewer).select_related('user').prefetch_related(
+            Prefetch('replies', queryset=exclude_blocked(replies, viewer))
         )
 
+    def get_thread(self, post, root=None, viewer=None, max_depth=None, max_nodes=None):
+        """
+        A post's live comment tree, or the subtree under the `root` comment,
+        in one query. Returns the top-level comments (or [root]); every
+        comment carries `thread_replies` and `more_replies`, the number of
+        its live replies left out.
+
+        Comments more than COMMENTS_THREAD_MAX_DEPTH levels below the top,
+        and any past the first COMMENTS_THREAD_MAX_NODES (shallowest first),
+        are cut off; load them with another call rooted at their parent.
+        """
+        if max_depth is None:
+            max_depth = getattr(settings, 'COMMENTS_THREAD_MAX_DEPTH', 8)
+        if max_nodes is None:
+            max_nodes = getattr(settings, 'COMMENTS_THREAD_MAX_NODES', 500)
+        comments = self.filter(post=post, deleted=False)
+        top_depth = 0
+        if root is not None:
+            comments = comments.filter(Q(pk=root.pk) | Q(path__startswith=root.descendant_path))
+            top_depth = root.depth
+        rows = exclude_blocked(comments.filter(depth__lte=top_depth + max_depth), viewer) \
+            .select_related('user').order_by('depth', 'id')[:max_nodes]
+        return build_comment_tree(rows, top_depth)
+
+    def top_level(self, post, viewer=None):
+        """A post's live top-level comments, for paging by id on the (post, depth, id) index"""
+        return exclude_blocked(self.filter(post=post, depth=0, deleted=False), viewer).select_related('user')
+
+    def replies_to(self, parent, viewer=None):
+        """A comment's live direct replies, for paging by id on the (parent, id) index"""
+        return exclude_blocked(self.filter(parent=parent, deleted=False), viewer).select_related('user')
+
+    def attach_replies(self, comments, limit=None, viewer=None):
+        """
+        Give each of `comments` its first `limit` live replies, oldest first,
+        in one query. Sets `thread_replies` and `more_replies` like get_thread.
+
+        The replies are picked by a LATERAL subquery that reads at most
+        `limit` (parent, id) index entries per parent, so a page costs the
+        same whether a comment has three replies or twenty thousand.
+        """
+        if limit is None:
+            limit = getattr(settings, 'COMMENTS_REPLIES_PER_COMMENT', 3)
+        by_id = {comment.pk: comment for comment in comments}
+        for comment in comments:
+            comment.thread_replies = []
+        if by_id and limit > 0:
+            # Replies across a block are skipped before the limit, so they
+            # never take the place of one the viewer may see
+            first_replies = RawSQL(FIRST_REPLIES_SQL, [list(by_id), blocked_user_ids(viewer), limit])
+            replies = self.filter(pk__in=first_replies).select_related('user').order_by('parent_id', 'id')
+            for reply in replies:
+                reply.thread_replies = []
+                by_id[reply.parent_id].thread_replies.append(reply)
+        for comment in comments:
+            set_more_replies(comment)
+            for reply in comment.thread_replies:
+                set_more_replies(reply)
+        return comments
+
     def create_comment(self, user, post_id, content, parent=None):
-        return self.create(
-            user=user,
-            post_id=post_id,
-            content=content,
-            parent=parent
-        )
+        with transaction.atomic():
+            comment = self.create(
+                user=user,
+                post_id=post_id,
+                content=content,
+                parent=parent
+            )
+            PostStats.objects.bump(post_id, **comment.stats_deltas(1))
+            comment.bump_parent(1)
+        return comment
 
     def edit_comment(self, user, comment_id, new_content):
         comment = self.get(pk=comment_id)
@@ -103,20 +530,84 @@ class CommentManager(models.Manager):
 
     def delete_comment(self, user, comment_id, soft_delete=True):
         comment = self.get(pk=comment_id)
-        if comment.user != user and not user.has_perm('app.can_moderate'):
+        if comment.user != user and not user.has_perm(Comment.MODERATE_PERMISSION):
             raise PermissionError("You don't have permission to delete this comment")
         if soft_delete:
             comment.soft_delete(user)
         else:
-            comment.delete()
+            with transaction.atomic():
+                comment.delete()
+                # Replies go with it through the cascade, so recount the post
+                PostStats.objects.rebuild(post_ids=[comment.post_id])
+                if not comment.deleted:
+                    comment.bump_parent(-1)
         return comment
 
+    def moderate(self, comments, moderator, delete=True):
+        """
+        Soft-delete (or restore) every comment in the `comments` queryset
+        with a single UPDATE, then move the PostStats counters and the
+        parents' reply counts by the same amounts, all in one transaction.
+        Comments already in the target state are skipped, so earlier
+        deletions keep their deleted_by/deleted_at. Returns how many changed.
+        """
+        selection, params = comments.order_by().values('pk').query.sql_with_params()
+        if delete:
+            values = [True, moderator.pk, timezone.now()]
+        else:
+            values = [False, None, None]
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute(MODERATE_SQL.format(selection=selection), [*values, *params, not delete])
+                changed = cursor.fetchall()
+
+            sign = -1 if delete else 1
+            stats = {}
+            replies = {}
+            for post_id, parent_id in changed:
+                counters = stats.setdefault(post_id, {'comment_count': 0, 'reply_count': 0})
+                counters['comment_count'] += sign
+                if parent_id:
+                    counters['reply_count'] += sign
+                    replies[parent_id] = replies.get(parent_id, 0) + sign
+            PostStats.objects.bump_many(stats)
+            if replies:
+                with connection.cursor() as cursor:
+                    cursor.execute(BUMP_REPLY_COUNTS_SQL, [list(replies), list(replies.values())])
+        return len(changed)
+
     def get_user_comments(self, user, include_deleted=False):
         qs = self.filter(user=user)
         if not include_deleted:
             qs = qs.filter(deleted=False)
         return qs.order_by('-created_at')
 
+def build_comment_tree(comments, top_depth=0):
+    """
+    Link comments ordered by depth into trees in one pass. Comments whose
+    parent is missing (deleted, hidden or cut off) are dropped with their
+    subtree.
+    """
+    by_id = {}
+    roots = []
+    for comment in comments:
+        comment.thread_replies = []
+        if comment.depth == top_depth:
+            roots.append(comment)
+        elif comment.parent_id in by_id:
+            by_id[comment.parent_id].thread_replies.append(comment)
+        else:
+            continue
+        by_id[comment.pk] = comment
+    for comment in by_id.values():
+        set_more_replies(comment)
+    return roots
+
+def set_more_replies(comment):
+    # Counts include replies hidden from this viewer by a block, so this
+    # can overstate what a follow-up page returns, never understate it
+    comment.more_replies = max(comment.reply_count - len(getattr(comment, 'thread_replies', ())), 0)
+
 class Comment(models.Model):
     post = models.ForeignKey('Post', on_delete=models.CASCADE, related_name='comments')
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
@@ -140,13 +631,36 @@ class Comment(models.Model):
         related_name='deleted_comments'
     )
     deleted_at = models.DateTimeField(null=True, blank=True)
+    # Materialized path: the ids of every ancestor, top-level first, each
+    # zero-padded to PATH_WIDTH digits and followed by '/'. Set once on insert.
+    path = models.TextField(default='', blank=True, editable=False)
+    depth = models.PositiveIntegerField(default=0, editable=False)
+    root = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    # Live direct replies; only ever changed with F() updates in bump_parent
+    reply_count = models.PositiveIntegerField(default=0, editable=False)
     objects = CommentManager()
 
+    PATH_WIDTH = 10
+    MODERATE_PERMISSION = 'posts.can_moderate'
+
     class Meta:
         ordering = ['created_at']
         indexes = [
             models.Index(fields=['post', 'parent']),
             models.Index(fields=['created_at']),
+            # Whole threads, shallowest first
+            models.Index(fields=['post', 'depth', 'id'], name='posts_comment_thread_idx'),
+            # Reply pages and per-parent reply windows
+            models.Index(fields=['parent', 'id'], name='posts_comment_replies_idx'),
+            # Subtrees: path LIKE 'prefix%'
+            models.Index(fields=['path'], name='posts_comment_path_idx', opclasses=['text_pattern_ops']),
         ]
         permissions = [
             ('can_moderate', 'Can delete any comment'),
@@ -155,20 +669,78 @@ class Comment(models.Model):
     def __str__(self):
         return f"{self.user.username}: {self.content[:50]}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_id:
+            parent = self.parent
+            self.path = parent.descendant_path
+            self.depth = parent.depth + 1
+            self.root_id = parent.root_id or parent.pk
+        elif not self._state.adding and kwargs.get('update_fields') is None:
+            # Never write back a reply_count read before other replies landed
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'reply_count'
+            ]
+        super().save(*args, **kwargs)
+
+    def bump_parent(self, delta):
+        if self.parent_id:
+            Comment.objects.filter(pk=self.parent_id).update(reply_count=F('reply_count') + delta)
+
+    @property
+    def descendant_path(self):
+        """Prefix of the path of every comment below this one"""
+        return f'{self.path}{self.pk:0{self.PATH_WIDTH}d}/'
+
     def is_edited(self):
         return self.edited and (self.updated_at - self.created_at).total_seconds() > 60
 
+    def stats_deltas(self, sign):
+        """PostStats counter deltas for this comment becoming live (1) or not (-1)."""
+        return {
+            'comment_count': sign,
+            'reply_count': sign if self.parent_id else 0,
+        }
+
     def soft_delete(self, user):
-        self.deleted = True
-        self.deleted_by = user
-        self.deleted_at = timezone.now()
-        self.save()
+        with transaction.atomic():
+            was_deleted = Comment.objects.select_for_update().values_list(
+                'deleted', flat=True).get(pk=self.pk)
+            self.deleted = True
+            self.deleted_by = user
+            self.deleted_at = timezone.now()
+            self.save()
+            if not was_deleted:
+                PostStats.objects.bump(self.post_id, **self.stats_deltas(-1))
+                self.bump_parent(-1)
 
     def restore(self):
-        self.deleted = False
-        self.deleted_by = None
-        self.deleted_at = None
-        self.save()
+        with transaction.atomic():
+            was_deleted = Comment.objects.select_for_update().values_list(
+                'deleted', flat=True).get(pk=self.pk)
+            self.deleted = False
+            self.deleted_by = None
+            self.deleted_at = None
+            self.save()
+            if was_deleted:
+                PostStats.objects.bump(self.post_id, **self.stats_deltas(1))
+                self.bump_parent(1)
+
+# Claim up to %(limit)s due jobs. SKIP LOCKED lets several workers poll the
+# same table without waiting on each other; a claim is a lease, so a job
+# whose worker died is picked up again once `available_at` passes.
+CLAIM_ATTACHMENTS_SQL = """
+UPDATE posts_attachment a
+SET status = 'processing', attempts = a.attempts + 1, available_at = %(lease_until)s
+WHERE a.id IN (
+    SELECT id FROM posts_attachment
+    WHERE status IN ('pending', 'processing') AND available_at <= %(now)s AND attempts < %(max_attempts)s
+    ORDER BY available_at, id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING a.id
+"""
 
 class AttachmentManager(models.Manager):
     def bulk_create_for_post(self, post, files):
@@ -202,67 +774,252 @@ class AttachmentManager(models.Manager):
         if new_files:
             return self.bulk_create_for_post(post, new_files)
         return None
+
+    def claim(self, limit, lease=None, now=None):
+        """
+        Mark up to `limit` due attachments as processing for `lease` seconds
+        and return them. Jobs whose lease ran out with no attempts left are
+        marked failed first.
+        """
+        now = now or timezone.now()
+        lease = lease or getattr(settings, 'ATTACHMENTS_LEASE', 300)
+        max_attempts = getattr(settings, 'ATTACHMENTS_MAX_ATTEMPTS', 5)
+        self.filter(
+            status=Attachment.PROCESSING, available_at__lte=now, attempts__gte=max_attempts
+        ).update(status=Attachment.FAILED, error='Processing did not finish')
+        with connection.cursor() as cursor:
+            cursor.execute(CLAIM_ATTACHMENTS_SQL, {
+                'now': now, 'lease_until': now + timedelta(seconds=lease),
+                'max_attempts': max_attempts, 'limit': limit,
+            })
+            ids = [row[0] for row in cursor.fetchall()]
+        return list(self.filter(pk__in=ids).order_by('available_at', 'id')) if ids else []
+
 class Attachment(models.Model):
     FILE_TYPES = (
         ('image', 'Image'),
         ('video', 'Video'),
         ('other', 'Other'),
     )
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    READY = 'ready'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    )
     post = models.ForeignKey('Post', related_name='attachments', on_delete=models.CASCADE)
     file = models.FileField(upload_to='attachments/%Y/%m/%d/')
-    file_type = models.CharField(max_length=10, choices=FILE_TYPES)
+    # Filled in by the process_attachments worker (see posts/media.py)
+    file_type = models.CharField(max_length=10, choices=FILE_TYPES, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     thumbnail = models.ImageField(upload_to='thumbnails/%Y/%m/%d/', null=True, blank=True)
+    # Resized copies of image files, see data_backend/images.py
+    derivatives = models.JSONField(default=dict, blank=True)
+    # Videos: frames sampled across the video for scrubbing previews, and
+    # how they are laid out ({columns, rows, tile_width, tile_height, timestamps})
+    sprite = models.ImageField(upload_to='sprites/%Y/%m/%d/', null=True, blank=True)
+    sprite_layout = models.JSONField(default=dict, blank=True)
+    duration = models.FloatField(null=True, blank=True)  # seconds
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # When a pending job is due, or when a processing job's lease runs out
+    available_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True)
     objects = AttachmentManager()
 
     class Meta:
         ordering = ['created_at']
+        indexes = [
+            # The worker's queue: only unfinished jobs are indexed
+            models.Index(fields=['available_at', 'id'], name='posts_attachment_queue_idx',
+                         condition=Q(status__in=['pending', 'processing'])),
+        ]
+
+    def generated_files(self):
+        """Storage names of everything the worker made for this attachment"""
+        names = [field_file.name for field_file in (self.thumbnail, self.sprite) if field_file]
+        for variant in self.derivatives.values():
+            names += [variant[key] for key in EXTENSIONS if variant.get(key)]
+        return names
 
-    # models.py (Attachment model)
-def save(self, *args, **kwargs):
-    # First save to move file to permanent storage
-    super().save(*args, **kwargs)
-
-    # Detect file type after file is saved
-    if not self.file_type:
-        self.detect_file_type()
-        self.save(update_fields=['file_type'])  # Update file_type field
-
-    # Generate thumbnail using permanent file path
-    if self.file_type == 'video' and not self.thumbnail:
-        self.generate_video_thumbnail()
-
-def detect_file_type(self):
-    with open(self.file.path, 'rb') as f:
-        file_data = f.read(1024)
-
-    mime = magic.Magic(mime=True)
-    file_mime = mime.from_buffer(file_data)
-    if file_mime.startswith('image/'):
-        self.file_type = 'image'
-    elif file_mime.startswith('video/'):
-        self.file_type = 'video'
-    else:
-        self.file_type = 'other'
-
-def generate_video_thumbnail(self):
-    temp_path = 'temp_thumbnails'
-    os.makedirs(temp_path, exist_ok=True)
-
-    # Use the final file path from MEDIA_ROOT
-    vidcap = cv2.VideoCapture(self.file.path)
-    success, image = vidcap.read()
-
-    if success:
-        temp_image_path = os.path.join(temp_path, f'thumb_{self.id}.jpg')
-        cv2.imwrite(temp_image_path, image)
-
-        with open(temp_image_path, 'rb') as f:
-            self.thumbnail.save(
-                f'thumb_{os.path.basename(self.file.name)}.jpg',
-                ContentFile(f.read()),
-                save=False
+    def delete_files(self, names):
+        for name in names:
+            self.file.storage.delete(name)
+
+    def mark_ready(self, file_type, derivatives=None, thumbnail=None, sprite=None, sprite_layout=None,
+                   duration=None, width=None, height=None):
+        """
+        Store what posts.media.process_file found and finish the job. Returns
+        False, leaving nothing behind, when the attachment was deleted while
+        it was being processed.
+        """
+        name = os.path.splitext(os.path.basename(self.file.name))[0]
+        previous = self.generated_files()
+        try:
+            self.file_type = file_type
+            if derivatives:
+                self.derivatives = store_derivatives(self.file, derivatives)
+            if thumbnail:
+                self.thumbnail.save(f'thumb_{name}.jpg', ContentFile(thumbnail), save=False)
+            if sprite:
+                self.sprite.save(f'sprite_{name}.jpg', ContentFile(sprite), save=False)
+                self.sprite_layout = sprite_layout
+            self.duration, self.width, self.height = duration, width, height
+            self.status = self.READY
+            self.error = ''
+            # An UPDATE rather than save(): a deleted row is simply not matched
+            updated = Attachment.objects.filter(pk=self.pk).update(
+                file_type=self.file_type, derivatives=self.derivatives, thumbnail=self.thumbnail.name,
+                sprite=self.sprite.name, sprite_layout=self.sprite_layout, duration=duration,
+                width=width, height=height, status=self.status, error=self.error,
             )
+        except Exception:
+            self.delete_files(set(self.generated_files()) - set(previous))
+            raise
+        current = self.generated_files()
+        if not updated:
+            self.delete_files(set(current) - set(previous))
+            return False
+        # Left over from an earlier run of the same job
+        self.delete_files(set(previous) - set(current))
+        return True
+
+    def mark_failed(self, error, now=None):
+        """
+        Schedule another attempt with exponential backoff, or give up after
+        ATTACHMENTS_MAX_ATTEMPTS. Returns False when the attachment is gone.
+        """
+        if self.attempts >= getattr(settings, 'ATTACHMENTS_MAX_ATTEMPTS', 5):
+            self.status = self.FAILED
+        else:
+            backoff = getattr(settings, 'ATTACHMENTS_RETRY_BACKOFF', 30) * 2 ** (self.attempts - 1)
+            self.status = self.PENDING
+            self.available_at = (now or timezone.now()) + timedelta(seconds=backoff)
+        self.error = str(error)[:1000]
+        return bool(Attachment.objects.filter(pk=self.pk).update(
+            status=self.status, available_at=self.available_at, error=self.error,
+        ))
+
+
+class StagedFile(File):
+    """A finished upload; FileSystemStorage moves it into place instead of copying it"""
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class UploadSessionManager(models.Manager):
+    def live(self):
+        return self.filter(expires_at__gt=timezone.now())
+
+    def purge_expired(self):
+        """Delete expired sessions and their staging files. Returns how many went."""
+        expired = list(self.filter(expires_at__lte=timezone.now()))
+        for session in expired:
+            session.delete()
+        return len(expired)
+
+
+class UploadSession(models.Model):
+    """
+    A resumable upload of one attachment. Chunks are appended in order to a
+    staging file outside MEDIA_ROOT; `received` only moves once a chunk is
+    on disk and matched its checksum, so a client that lost its connection
+    resumes from there. complete() turns the file into an Attachment.
+    """
+    READ_BLOCK = 64 * 1024
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    sha256 = models.CharField(max_length=64, blank=True)  # of the whole file, checked on completion
+    received = models.BigIntegerField(default=0)
+    attachment = models.OneToOneField(Attachment, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    objects = UploadSessionManager()
+
+    class ChecksumMismatch(Exception):
+        pass
+
+    class Incomplete(Exception):
+        pass
+
+    @staticmethod
+    def staging_dir():
+        return getattr(settings, 'ATTACHMENTS_UPLOAD_STAGING_DIR', os.path.join(settings.BASE_DIR, 'upload_staging'))
+
+    @property
+    def staging_path(self):
+        return os.path.join(self.staging_dir(), f'{self.pk}.part')
+
+    def extend(self):
+        self.expires_at = timezone.now() + timedelta(seconds=getattr(settings, 'ATTACHMENTS_UPLOAD_TTL', 86400))
+
+    def save(self, *args, **kwargs):
+        if self.expires_at is None:
+            self.extend()
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        if os.path.exists(self.staging_path):
+            os.remove(self.staging_path)
+        return super().delete(*args, **kwargs)
+
+    def append(self, stream, length, checksum):
+        """
+        Write `length` bytes from `stream` at offset `received`, a block at a
+        time. A short read or a wrong SHA-256 leaves the file and `received`
+        as they were. Call inside a transaction holding this row's lock.
+        """
+        os.makedirs(self.staging_dir(), exist_ok=True)
+        digest = hashlib.sha256()
+        with open(self.staging_path, 'ab+') as staging:
+            # Drop whatever an interrupted chunk left behind
+            staging.truncate(self.received)
+            remaining = length
+            while remaining:
+                block = stream.read(min(self.READ_BLOCK, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                staging.write(block)
+                remaining -= len(block)
+            if remaining or digest.hexdigest() != checksum.lower():
+                staging.truncate(self.received)
+                raise self.ChecksumMismatch('Chunk was cut short' if remaining else 'Chunk checksum mismatch')
+            staging.flush()
+            os.fsync(staging.fileno())
+        self.received += length
+        self.extend()
+        self.save(update_fields=['received', 'expires_at'])
 
-        os.remove(temp_image_path)
-        self.save(update_fields=['thumbnail'])
+    def complete(self):
+        """Move the staged file into an Attachment, queued for processing. Returns the attachment."""
+        if self.received != self.size:
+            raise self.Incomplete(f'{self.received} of {self.size} bytes received')
+        if self.sha256:
+            digest = hashlib.sha256()
+            with open(self.staging_path, 'rb') as staging:
+                for block in iter(lambda: staging.read(self.READ_BLOCK), b''):
+                    digest.update(block)
+            if digest.hexdigest() != self.sha256.lower():
+                # Nothing to resume from: start over
+                os.remove(self.staging_path)
+                self.received = 0
+                self.save(update_fields=['received'])
+                raise self.ChecksumMismatch('File checksum mismatch')
+        attachment = Attachment(post=self.post)
+        with open(self.staging_path, 'rb') as staging:
+            attachment.file.save(self.filename, StagedFile(staging, name=self.filename), save=False)
+        attachment.save()
+        self.attachment = attachment
+        self.save(update_fields=['attachment'])
+        return attachment
@@ -0,0 +1,37 @@
+from django.conf import settings
+
+from data_backend.pagination import KeysetPagination
+
+
+class PostCursorPagination(KeysetPagination):
+    """
+    Newest-first keyset pagination for posts, backed by the
+    (created_at, id) and (author, created_at, id) indexes on Post.
+    """
+    ordering = ('-created_at', '-id')
+    page_size = getattr(settings, 'POSTS_PAGE_SIZE', 20)
+    max_page_size = getattr(settings, 'POSTS_MAX_PAGE_SIZE', 100)
+
+
+class PostSearchPagination(KeysetPagination):
+    """Best-match-first keyset pagination over `Post.objects.search` results."""
+    ordering = ('-rank', '-id')
+    page_size = getattr(settings, 'POSTS_PAGE_SIZE', 20)
+    max_page_size = getattr(settings, 'POSTS_MAX_PAGE_SIZE', 100)
+
+
+class ReactionCursorPagination(KeysetPagination):
+    """Newest-first reactions of one post, backed by the (post, id) index."""
+    ordering = ('-id',)
+    page_size = getattr(settings, 'POSTS_PAGE_SIZE', 20)
+    max_page_size = getattr(settings, 'POSTS_MAX_PAGE_SIZE', 100)
+
+
+class CommentCursorPagination(KeysetPagination):
+    """
+    Oldest-first pages of a post's top-level comments or of one comment's
+    replies, backed by the (post, depth, id) and (parent, id) indexes.
+    """
+    ordering = ('id',)
+    page_size = getattr(settings, 'COMMENTS_PAGE_SIZE', 20)
+    max_page_size = getattr(settings, 'COMMENTS_MAX_PAGE_SIZE', 100)
@@ -0,0 +1,87 @@
+"""
+Write coalescing for reactions.
+
+With POSTS_REACTIONS_COALESCE on, ReactionViewSet.react/unreact record the
+change here instead of writing it. Only the latest change per (user, post)
+is kept, and the buffer is flushed POSTS_REACTIONS_FLUSH_MS after its first
+change (or as soon as it holds POSTS_REACTIONS_MAX_PENDING) as one
+multi-row upsert and one multi-row delete, so a reaction storm on one post
+costs a few statements per flush instead of a few per click.
+
+Changes are acknowledged before they are written: a reader can miss them
+for up to one interval, and changes still buffered when the process is
+killed (rather than shut down) are lost.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import Post, Reaction
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionBuffer:
+    def __init__(self, interval, max_pending):
+        self.interval = interval
+        self.max_pending = max_pending
+        self._pending = {}  # (user_id, post_id) -> reaction, or None to remove it
+        self._timer = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def react(self, user_id, post_id, reaction_type):
+        self._add(user_id, post_id, reaction_type)
+
+    def unreact(self, user_id, post_id):
+        self._add(user_id, post_id, None)
+
+    def _add(self, user_id, post_id, reaction_type):
+        with self._lock:
+            self._pending[user_id, post_id] = reaction_type
+            full = len(self._pending) >= self.max_pending
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.interval, self._run)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def _run(self):
+        close_old_connections()
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("Reaction flush failed")
+        finally:
+            close_old_connections()
+
+    def flush(self):
+        """Write every buffered change. Returns (rows upserted, rows deleted)."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not batch:
+                return 0, 0
+            # Rows are locked in (post, user) order so concurrent flushes from
+            # other processes wait on each other instead of deadlocking
+            keys = sorted(batch, key=lambda key: (key[1], key[0]))
+            upserts = [(*key, batch[key]) for key in keys if batch[key] is not None]
+            removals = [key for key in keys if batch[key] is None]
+            # Posts deleted since the change was accepted are skipped
+            written = Reaction.objects.upsert(upserts, posts=Post.objects.all())
+            deleted = Reaction.objects.remove(removals)
+            return len(written), deleted
+
+
+reactions = ReactionBuffer(
+    interval=getattr(settings, 'POSTS_REACTIONS_FLUSH_MS', 20) / 1000,
+    max_pending=getattr(settings, 'POSTS_REACTIONS_MAX_PENDING', 1000),
+)
+atexit.register(reactions.flush)
@@ -1,11 +1,21 @@
 # serializers.py
 from rest_framework import serializers
+from rest_framework.reverse import reverse
 from django.contrib.auth.models import User
-from .models import Post, Reaction, Comment, Attachment
+from .models import Post, Reaction, Comment, Attachment, UploadSession
+from .pagination import CommentCursorPagination
 from authentification.serializers import UserSerializer
+from socials.graph import friend_graph
+from socials.blocks import blocked_user_ids
+from data_backend.images import derivative_urls
+from django.conf import settings
+import os
+from django.db import models
 from django.db.models import Count
 from django.core.validators import FileExtensionValidator
 
+FRIENDS_REACTED_LIMIT = getattr(settings, 'POSTS_FRIENDS_REACTED_LIMIT', 3)
+
 # Use this for circular reference issues
 class ReactionSerializer(serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
@@ -26,6 +36,13 @@ class ReactionSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'post']
         extra_kwargs = {'post': {'read_only': True}}
 
+class FriendReactionSerializer(serializers.ModelSerializer):
+    user = UserSerializer(read_only=True)
+
+    class Meta:
+        model = Reaction
+        fields = ['reaction', 'user']
+
 class ReactionCountSerializer(serializers.Serializer):
     reaction = serializers.CharField()
     count = serializers.IntegerField()
@@ -33,11 +50,17 @@ class ReactionCountSerializer(serializers.Serializer):
 class AttachmentSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
+    # {size: {width, height, webp, jpeg}}; empty for non-images and until processed
+    srcset = serializers.SerializerMethodField()
+    # Videos: {url, columns, rows, tile_width, tile_height, timestamps} for scrubbing
+    preview = serializers.SerializerMethodField()
 
     class Meta:
         model = Attachment
-        fields = ['id', 'post', 'file', 'file_type', 'created_at', 'file_url', 'thumbnail_url']
-        read_only_fields = ['id', 'file_type', 'created_at', 'file_url', 'thumbnail_url']
+        fields = ['id', 'post', 'file', 'file_type', 'status', 'created_at', 'file_url', 'thumbnail_url', 'srcset',
+                  'duration', 'width', 'height', 'preview']
+        read_only_fields = ['id', 'file_type', 'status', 'created_at', 'file_url', 'thumbnail_url', 'srcset',
+                            'duration', 'width', 'height', 'preview']
 
     def get_file_url(self, obj):
         request = self.context.get('request')
@@ -51,6 +74,16 @@ class AttachmentSerializer(serializers.ModelSerializer):
             return request.build_absolute_uri(obj.thumbnail.url)
         return None
 
+    def get_srcset(self, obj):
+        return derivative_urls(self.context.get('request'), obj.file.storage, obj.derivatives)
+
+    def get_preview(self, obj):
+        if not obj.sprite:
+            return None
+        request = self.context.get('request')
+        url = request.build_absolute_uri(obj.sprite.url) if request is not None else obj.sprite.url
+        return {'url': url, **obj.sprite_layout}
+
 class AttachmentCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Attachment
@@ -75,7 +108,37 @@ class AttachmentCreateSerializer(serializers.ModelSerializer):
             )
         return value
 
+class UploadSessionSerializer(serializers.ModelSerializer):
+    """Opening (and checking on) a resumable upload; chunks go to PUT /api/uploads/<id>/"""
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', required=False, allow_blank=True)
+    max_chunk_size = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'post', 'filename', 'size', 'sha256', 'received', 'max_chunk_size',
+                  'attachment', 'expires_at']
+        read_only_fields = ['id', 'received', 'attachment', 'expires_at']
+
+    def get_max_chunk_size(self, obj):
+        return getattr(settings, 'ATTACHMENTS_UPLOAD_MAX_CHUNK', 16 * 1024 ** 2)
+
+    def validate_filename(self, value):
+        value = os.path.basename(value)
+        extension = value.rsplit('.', 1)[-1].lower() if '.' in value else ''
+        if extension not in settings.FILE_EXTENSION_VALIDATORS:
+            raise serializers.ValidationError(
+                f"Unsupported file type. Allowed: {', '.join(settings.FILE_EXTENSION_VALIDATORS)}"
+            )
+        return value
+
+    def validate_size(self, value):
+        limit = getattr(settings, 'ATTACHMENTS_UPLOAD_MAX_SIZE', 2 * 1024 ** 3)
+        if not 0 < value <= limit:
+            raise serializers.ValidationError(f'Size must be between 1 and {limit} bytes.')
+        return value
+
 class CommentSerializer(serializers.ModelSerializer):
+    """A comment and its replies, as assembled by CommentManager.get_thread"""
     user = UserSerializer(read_only=True)
     user_id = serializers.PrimaryKeyRelatedField(
         queryset=User.objects.all(),
@@ -83,18 +146,33 @@ class CommentSerializer(serializers.ModelSerializer):
         source='user'
     )
     replies = serializers.SerializerMethodField()
+    more_replies = serializers.SerializerMethodField()
+    more_replies_url = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
         fields = ['id', 'post', 'content', 'user', 'user_id',
-                 'parent', 'created_at', 'updated_at', 'edited',
-                 'deleted', 'replies']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'edited']
+                 'parent', 'depth', 'created_at', 'updated_at', 'edited',
+                 'deleted', 'replies', 'more_replies', 'more_replies_url']
+        read_only_fields = ['id', 'depth', 'created_at', 'updated_at', 'edited']
 
     def get_replies(self, obj):
-        if hasattr(obj, 'replies'):
-            return CommentSerializer(obj.replies.filter(deleted=False), many=True).data
-        return []
+        return CommentSerializer(getattr(obj, 'thread_replies', []), many=True, context=self.context).data
+
+    def get_more_replies(self, obj):
+        return getattr(obj, 'more_replies', 0)
+
+    def get_more_replies_url(self, obj):
+        """Replies page that continues after the last reply shown here"""
+        request = self.context.get('request')
+        if request is None or not getattr(obj, 'more_replies', 0):
+            return None
+        paginator = CommentCursorPagination()
+        paginator.base_url = reverse('comment-replies', args=[obj.pk], request=request)
+        shown = getattr(obj, 'thread_replies', [])
+        if not shown:
+            return paginator.base_url
+        return paginator.encode_cursor(paginator.get_position(shown[-1]), reverse=False)
 
 class CommentCreateSerializer(serializers.ModelSerializer):
     class Meta:
@@ -102,10 +180,73 @@ class CommentCreateSerializer(serializers.ModelSerializer):
         fields = ['id', 'post', 'content', 'parent']
         read_only_fields = ['id']
 
+    def validate(self, data):
+        # A reply inherits its parent's path, so the parent must be a live
+        # comment on the same post that the replier can see
+        parent, post = data.get('parent'), data.get('post')
+        if parent is not None and post is not None:
+            request = self.context.get('request')
+            if parent.post_id != post.id or parent.deleted or \
+                    (request is not None and parent.user_id in blocked_user_ids(request.user)):
+                raise serializers.ValidationError({'parent': "Not a visible comment on this post."})
+        return data
+
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
         return super().create(validated_data)
 
+class CommentModerationSerializer(serializers.Serializer):
+    action = serializers.ChoiceField(choices=['delete', 'restore'])
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        max_length=getattr(settings, 'COMMENTS_MODERATION_MAX_IDS', 10000),
+        required=False
+    )
+    author = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), required=False)
+    post = serializers.PrimaryKeyRelatedField(queryset=Post.objects.all(), required=False)
+
+    def validate(self, data):
+        if not {'ids', 'author', 'post'} & data.keys():
+            raise serializers.ValidationError("Select comments with ids, author or post")
+        return data
+
+def friends_reacted(request, post_ids):
+    """{post_id: [reaction, ...]} of the requesting user's friends, in one query"""
+    if not request or not request.user.is_authenticated:
+        return {}
+    friend_ids = friend_graph.friend_ids(request.user).tolist()
+    return Reaction.objects.friends_reacted(post_ids, friend_ids, limit=FRIENDS_REACTED_LIMIT)
+
+def viewer_reactions(request, post_ids):
+    """
+    {post_id: reaction} of the requesting user for those of `post_ids` it
+    reacted to. Results are memoized on the request, so repeated lookups in
+    one request only query the ids not seen yet.
+    """
+    if not request or not request.user.is_authenticated:
+        return {}
+    memo = getattr(request, '_viewer_reactions', None)
+    if memo is None:
+        memo = request._viewer_reactions = {}
+    if missing := [post_id for post_id in dict.fromkeys(post_ids) if post_id not in memo]:
+        found = Reaction.objects.reactions_of(request.user, missing)
+        memo.update((post_id, found.get(post_id)) for post_id in missing)
+    return {post_id: memo[post_id] for post_id in post_ids if memo[post_id] is not None}
+
+class PostListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        # Resolve friends' reactions for the whole page before the rows render
+        posts = list(data.all() if isinstance(data, models.Manager) else data)
+        if 'friends_reacted' not in self.context:
+            self.context['friends_reacted'] = friends_reacted(
+                self.context.get('request'), [post.pk for post in posts]
+            )
+        if posts and not hasattr(posts[0], 'viewer_reaction'):
+            # Fills the request memo that get_user_reaction reads
+            viewer_reactions(self.context.get('request'), [post.pk for post in posts])
+        return super().to_representation(posts)
+
 class PostSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
     author_id = serializers.PrimaryKeyRelatedField(
@@ -113,30 +254,49 @@ class PostSerializer(serializers.ModelSerializer):
         write_only=True,
         source='author'
     )
-    reactions = ReactionSerializer(source='reaction_set', many=True, read_only=True)
+    # The full reactor list is paginated at /api/posts/<id>/reactions/
     reaction_counts = serializers.SerializerMethodField()
+    friends_reacted = serializers.SerializerMethodField()
     user_reaction = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'content', 'author', 'author_id',
-                 'created_at', 'updated_at', 'reactions',
-                 'reaction_counts', 'user_reaction', 'comments_count']
+        fields = ['id', 'title', 'content', 'visibility', 'author', 'author_id',
+                 'created_at', 'updated_at', 'reaction_counts',
+                 'friends_reacted', 'user_reaction', 'comments_count']
         read_only_fields = ['id', 'created_at', 'updated_at']
+        list_serializer_class = PostListSerializer
 
     def get_reaction_counts(self, obj):
-        counts = obj.reaction_set.values('reaction').annotate(count=Count('id'))
+        # Querysets built with Post.objects.with_aggregates() carry the counts
+        if hasattr(obj, 'live_comments_count'):
+            counts = [
+                {'reaction': reaction_type, 'count': getattr(obj, f'{reaction_type}_count')}
+                for reaction_type, _ in Reaction.REACT_CHOICES
+                if getattr(obj, f'{reaction_type}_count')
+            ]
+        else:
+            counts = obj.reaction_set.values('reaction').annotate(count=Count('id'))
         return ReactionCountSerializer(counts, many=True).data
 
+    def get_friends_reacted(self, obj):
+        by_post = self.context.get('friends_reacted')
+        if by_post is None:
+            by_post = friends_reacted(self.context.get('request'), [obj.pk])
+        return FriendReactionSerializer(by_post.get(obj.pk, []), many=True).data
+
     def get_user_reaction(self, obj):
         request = self.context.get('request')
         if request and hasattr(request, 'user') and request.user.is_authenticated:
-            reaction = obj.reaction_set.filter(user=request.user).first()
-            return reaction.reaction if reaction else None
+            if hasattr(obj, 'viewer_reaction'):
+                return obj.viewer_reaction
+            return viewer_reactions(request, [obj.pk]).get(obj.pk)
         return None
 
     def get_comments_count(self, obj):
+        if hasattr(obj, 'live_comments_count'):
+            return obj.live_comments_count
         return obj.comments.filter(deleted=False).count()
 
 class PostSerializerWithAttachments(PostSerializer):
@@ -145,6 +305,14 @@ class PostSerializerWithAttachments(PostSerializer):
     class Meta(PostSerializer.Meta):
         fields = PostSerializer.Meta.fields + ['attachments']
 
+class PostSearchSerializer(PostSerializerWithAttachments):
+    rank = serializers.FloatField(read_only=True)
+    title_highlight = serializers.CharField(read_only=True)
+    content_highlight = serializers.CharField(read_only=True)
+
+    class Meta(PostSerializerWithAttachments.Meta):
+        fields = PostSerializerWithAttachments.Meta.fields + ['rank', 'title_highlight', 'content_highlight']
+
 class PostDetailSerializer(PostSerializerWithAttachments):
     comments = serializers.SerializerMethodField()
 
@@ -152,8 +320,12 @@ class PostDetailSerializer(PostSerializerWithAttachments):
         fields = PostSerializerWithAttachments.Meta.fields + ['comments']
 
     def get_comments(self, obj):
-        comments = Comment.objects.get_comments_for_post(obj)
-        return CommentSerializer(comments, many=True).data
+        # First page only; the rest is paged at /api/comments/post/<id>/
+        request = self.context.get('request')
+        viewer = request and request.user
+        comments = list(Comment.objects.top_level(obj, viewer).order_by('id')[:CommentCursorPagination.page_size])
+        Comment.objects.attach_replies(comments, viewer=viewer)
+        return CommentSerializer(comments, many=True, context=self.context).data
 
 class PostCreateUpdateSerializer(serializers.ModelSerializer):
     attachments = serializers.ListField(
@@ -164,7 +336,7 @@ class PostCreateUpdateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        fields = ['id', 'title', 'content', 'attachments']
+        fields = ['id', 'title', 'content', 'visibility', 'attachments']
         read_only_fields = ['id']
 
     def create(self, validated_data):
@@ -0,0 +1,13 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from .models import Attachment
+
+
+@receiver(post_delete, sender=Attachment)
+def delete_generated_files(sender, instance, **kwargs):
+    # Covers queryset and cascade deletes too. Files go once the delete
+    # commits, so a rolled-back delete keeps them.
+    if names := instance.generated_files():
+        transaction.on_commit(lambda: instance.delete_files(names))
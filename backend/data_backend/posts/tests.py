@@ -1,11 +1,32 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.urls import reverse
-from django.contrib.auth.models import User
+from django.contrib.auth.models import User, Permission
 from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 from rest_framework import status
-from .models import Post, Reaction
-from .views import PostViewSet, ReactionViewSet
+from .models import Post, Reaction, Comment, PostStats, Attachment, UploadSession
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from .views import PostViewSet, ReactionViewSet, CommentViewSet, AttachmentViewSet
+from .reaction_buffer import ReactionBuffer
+from .serializers import PostSerializer, AttachmentSerializer
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from socials.graph import friend_graph, block_list
+from socials.models import Relationship
+import base64
 import json
+from urllib.parse import urlparse, parse_qs
+from datetime import timedelta
+from io import BytesIO
+import hashlib
+import os
+import tempfile
+import cv2
+import numpy as np
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.utils import timezone
+from PIL import Image as PILImage
 
 class PostAPITestCase(TestCase):
     def setUp(self):
@@ -36,7 +57,55 @@ class PostAPITestCase(TestCase):
         request = self.factory.get('/api/posts/')
         response = view(request)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 4)  # Adjust if you're using pagination
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+    def test_list_posts_cursor_pagination(self):
+        for i in range(5):
+            Post.objects.create(title=f'Paged {i}', content='paged', author=self.user1)
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+        view = PostViewSet.as_view({'get': 'list'})
+        seen = []
+        url = '/api/posts/?page_size=3'
+        while url:
+            response = view(self.factory.get(url))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, expected)
+
+        # Walking back from the last page returns the previous window
+        response = view(self.factory.get(response.data['previous']))
+        self.assertEqual([post['id'] for post in response.data['results']], expected[3:6])
+
+    def test_list_posts_invalid_cursor(self):
+        view = PostViewSet.as_view({'get': 'list'})
+        response = view(self.factory.get('/api/posts/?cursor=not-a-cursor'))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_with_bad_values_is_invalid(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position}).encode()).decode()
+
+        view = PostViewSet.as_view({'get': 'list'})
+        for position in (['notadate', 1], ['2026-01-01T00:00:00+00:00', 'abc'], [None, 1], [[], {}]):
+            response = view(self.factory.get('/api/posts/', {'cursor': cursor(position)}))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, position)
+        # Annotated orderings are checked against the annotation's type
+        search = PostViewSet.as_view({'get': 'search'})
+        response = search(self.factory.get('/api/posts/search/', {'q': 'test', 'cursor': cursor(['abc', 1])}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = view(self.factory.get('/api/posts/', {'cursor': cursor(['2026-01-01T00:00:00+00:00', 1])}))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_user_posts_paginated(self):
+        view = PostViewSet.as_view({'get': 'user_posts'})
+        request = self.factory.get(f'/api/posts/user/{self.user1.id}/')
+        force_authenticate(request, user=self.user2)
+        response = view(request, user_id=self.user1.id)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['id'] for post in response.data['results']], [self.post1.id])
 
     def test_create_post(self):
         # Use the viewset directly
@@ -69,6 +138,42 @@ class PostAPITestCase(TestCase):
         self.assertIsNotNone(reaction)
         self.assertEqual(reaction.reaction, 'like')
 
+    def test_generic_create_reacts_as_the_caller_and_checks_visibility(self):
+        view = ReactionViewSet.as_view({'post': 'create'})
+        request = self.factory.post('/api/reactions/', {
+            'post_id': self.post2.id, 'user_id': self.user2.id, 'reaction': 'love',
+        }, format='json')
+        force_authenticate(request, user=self.user1)
+        self.assertEqual(view(request).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(list(Reaction.objects.values_list('user', 'reaction')), [(self.user1.id, 'love')])
+
+        hidden = Post.objects.create(title='Hidden', content='x', author=self.user2, visibility=Post.ONLY_ME)
+        request = self.factory.post('/api/reactions/', {'post_id': hidden.id, 'reaction': 'like'}, format='json')
+        force_authenticate(request, user=self.user1)
+        self.assertEqual(view(request).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Reaction.objects.filter(post=hidden).exists())
+
+    def test_my_reactions_for_a_set_of_posts(self):
+        Reaction.objects.set_reaction(self.user1, self.post1, 'love')
+        Reaction.objects.set_reaction(self.user1, self.post2, 'hate')
+        Reaction.objects.set_reaction(self.user2, self.post1, 'like')
+        view = ReactionViewSet.as_view({'get': 'mine'})
+
+        def lookup(post_ids):
+            request = self.factory.get('/api/reactions/mine/', {'post_ids': post_ids})
+            force_authenticate(request, user=self.user1)
+            return view(request)
+
+        with CaptureQueriesContext(connection) as ctx:
+            response = lookup(f'{self.post1.id},{self.post2.id},{self.post2.id + 1000}')
+        self.assertEqual(len(ctx.captured_queries), 1)
+        self.assertEqual(response.data['reactions'], {self.post1.id: 'love', self.post2.id: 'hate'})
+        self.assertEqual(lookup('').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(lookup('1,x').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(lookup('\u00b2').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(lookup(str(10 ** 20)).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(lookup(','.join(['1'] * 501)).status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_unreact_to_post(self):
         # First create a reaction
         Reaction.objects.create(
@@ -90,3 +195,723 @@ class PostAPITestCase(TestCase):
         # Check if reaction was deleted
         reaction = Reaction.objects.filter(user=self.user1, post=self.post2).first()
         self.assertIsNone(reaction)
+
+    def test_react_and_unreact_reject_ids_int_cannot_parse(self):
+        for action in ('react', 'unreact'):
+            view = ReactionViewSet.as_view({'post': action})
+            request = self.factory.post(f'/api/reactions/{action}/', {'post': '\u00b2', 'reaction': 'like'})
+            force_authenticate(request, user=self.user1)
+            self.assertEqual(view(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_list_query_count_is_constant(self):
+        view = PostViewSet.as_view({'get': 'list'})
+
+        Relationship.send_request(self.user1, self.user2).accept()
+
+        def count_queries():
+            request = self.factory.get('/api/posts/')
+            force_authenticate(request, user=self.user1)
+            friend_graph.clear()
+            block_list.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                response = view(request)
+            return len(ctx.captured_queries), response
+
+        baseline, _ = count_queries()
+        for i in range(10):
+            post = Post.objects.create(title=f'Busy {i}', content='busy', author=self.user2)
+            Reaction.objects.set_reaction(self.user1, post, 'love')
+            Reaction.objects.set_reaction(self.user2, post, 'like')
+            Comment.objects.create_comment(self.user2, post.id, 'hi')
+        queries, response = count_queries()
+
+        self.assertEqual(queries, baseline)
+        busy = response.data['results'][0]
+        self.assertEqual(busy['user_reaction'], 'love')
+        self.assertEqual(busy['comments_count'], 1)
+        self.assertEqual(
+            {c['reaction']: c['count'] for c in busy['reaction_counts']},
+            {'like': 1, 'love': 1}
+        )
+        self.assertNotIn('reactions', busy)
+        self.assertEqual(
+            [(r['user']['id'], r['reaction']) for r in busy['friends_reacted']],
+            [(self.user2.id, 'like')]
+        )
+
+    def test_serializer_fallback_without_annotations(self):
+        Reaction.objects.create(user=self.user1, post=self.post1, reaction='hate')
+        Comment.objects.create(user=self.user2, post=self.post1, content='hi')
+        Comment.objects.create(user=self.user2, post=self.post1, content='gone', deleted=True)
+        request = self.factory.get('/')
+        request.user = self.user1
+        data = PostSerializer(self.post1, context={'request': request}).data
+        self.assertEqual(data['user_reaction'], 'hate')
+        self.assertEqual(data['comments_count'], 1)
+        self.assertEqual(list(map(dict, data['reaction_counts'])), [{'reaction': 'hate', 'count': 1}])
+
+
+    def test_search_ranks_title_matches_first(self):
+        in_content = Post.objects.create(title='Weekend', content='Sunset at the harbour', author=self.user2)
+        in_title = Post.objects.create(title='Sunset photos', content='From the hill', author=self.user1)
+
+        view = PostViewSet.as_view({'get': 'search'})
+        request = self.factory.get('/api/posts/search/?q=sunset')
+        force_authenticate(request, user=self.user1)
+        response = view(request)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([p['id'] for p in results], [in_title.id, in_content.id])
+        self.assertIn('<mark>Sunset</mark>', results[0]['title_highlight'])
+        self.assertIn('<mark>Sunset</mark>', results[1]['content_highlight'])
+
+    def test_search_paginates_by_rank(self):
+        for i in range(5):
+            Post.objects.create(title=f'Garden {i}', content='garden ' * i, author=self.user1)
+        view = PostViewSet.as_view({'get': 'search'})
+        seen = []
+        url = '/api/posts/search/?q=garden&page_size=2'
+        while url:
+            response = view(self.factory.get(url))
+            seen.extend(p['id'] for p in response.data['results'])
+            url = response.data['next']
+        expected = list(Post.objects.search('garden').order_by('-rank', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(seen), 5)
+
+    def test_list_search_keeps_user_filter(self):
+        Post.objects.create(title='Coffee', content='espresso', author=self.user2)
+        view = PostViewSet.as_view({'get': 'list'})
+        response = view(self.factory.get(f'/api/posts/?search=coffee&user_id={self.user1.id}'))
+        self.assertEqual(response.data['results'], [])
+
+    def test_non_integer_user_id_is_a_bad_request(self):
+        search = PostViewSet.as_view({'get': 'search'})
+        response = search(self.factory.get('/api/posts/search/?q=travel&user_id=abc'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = PostViewSet.as_view({'get': 'list'})(self.factory.get('/api/posts/?user_id=abc'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_friends_reacted_is_capped_and_reactions_are_paginated(self):
+        friend_graph.clear()
+        friends = [User.objects.create_user(username=f'friend{i}') for i in range(5)]
+        for friend in friends:
+            Relationship.send_request(self.user1, friend).accept()
+            Reaction.objects.set_reaction(friend, self.post2, 'like')
+        Reaction.objects.set_reaction(self.user2, self.post2, 'love')
+
+        request = self.factory.get('/api/posts/')
+        force_authenticate(request, user=self.user1)
+        post = PostViewSet.as_view({'get': 'list'})(request).data['results'][0]
+        self.assertEqual(post['id'], self.post2.id)
+        # Newest three friends only; user2 reacted but is not a friend
+        self.assertEqual([r['user']['id'] for r in post['friends_reacted']], [f.id for f in friends[:1:-1]])
+
+        view = PostViewSet.as_view({'get': 'reactions'})
+        seen = []
+        url = f'/api/posts/{self.post2.id}/reactions/?page_size=4'
+        while url:
+            request = self.factory.get(url)
+            force_authenticate(request, user=self.user1)
+            response = view(request, pk=self.post2.id)
+            seen.extend(r['id'] for r in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 6)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        friend_graph.clear()
+
+class PostStatsTestCase(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username='statsuser1', password='password123')
+        self.user2 = User.objects.create_user(username='statsuser2', password='password123')
+        self.post = Post.objects.create(title='Stats', content='counted', author=self.user1)
+
+    def stats(self):
+        return PostStats.objects.get(post=self.post)
+
+    def test_reaction_counters_follow_writes(self):
+        Reaction.objects.set_reaction(self.user1, self.post, 'like')
+        Reaction.objects.set_reaction(self.user2, self.post, 'like')
+        self.assertEqual(self.stats().like_count, 2)
+
+        # Changing type moves the count between buckets
+        Reaction.objects.set_reaction(self.user2, self.post, 'hate')
+        stats = self.stats()
+        self.assertEqual((stats.like_count, stats.hate_count), (1, 1))
+
+        # Re-sending the same reaction is a no-op
+        Reaction.objects.set_reaction(self.user2, self.post, 'hate')
+        self.assertEqual(self.stats().hate_count, 1)
+
+        Reaction.objects.delete_reaction(self.user1, self.post)
+        stats = self.stats()
+        self.assertEqual((stats.like_count, stats.hate_count), (0, 1))
+
+    def test_comment_counters_follow_soft_delete_and_restore(self):
+        parent = Comment.objects.create_comment(self.user1, self.post.id, 'top')
+        reply = Comment.objects.create_comment(self.user2, self.post.id, 'reply', parent=parent)
+        stats = self.stats()
+        self.assertEqual((stats.comment_count, stats.reply_count), (2, 1))
+
+        reply.soft_delete(self.user2)
+        reply.soft_delete(self.user2)
+        stats = self.stats()
+        self.assertEqual((stats.comment_count, stats.reply_count), (1, 0))
+
+        reply.restore()
+        stats = self.stats()
+        self.assertEqual((stats.comment_count, stats.reply_count), (2, 1))
+
+        Comment.objects.delete_comment(self.user1, parent.id, soft_delete=False)
+        stats = self.stats()
+        self.assertEqual((stats.comment_count, stats.reply_count), (0, 0))
+
+    def test_rebuild_command_repairs_drift(self):
+        Reaction.objects.set_reaction(self.user1, self.post, 'love')
+        # Rows written behind the manager's back leave the counters stale
+        Reaction.objects.create(user=self.user2, post=self.post, reaction='love')
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_post_stats', '--verify', stdout=StringIO())
+
+        call_command('rebuild_post_stats', stdout=StringIO())
+        self.assertEqual(self.stats().love_count, 2)
+        call_command('rebuild_post_stats', '--verify', stdout=StringIO())
+
+    def test_batched_writes_keep_counters_exact(self):
+        other = Post.objects.create(title='Other', content='counted', author=self.user2)
+        Reaction.objects.set_reaction(self.user1, self.post, 'like')
+        results = Reaction.objects.upsert([
+            (self.user1.id, self.post.id, 'love'),
+            (self.user2.id, self.post.id, 'love'),
+            (self.user1.id, other.id, 'hate'),
+        ])
+        self.assertEqual([created for _, created in results], [False, True, True])
+        self.assertEqual((self.stats().like_count, self.stats().love_count), (0, 2))
+
+        self.assertEqual(Reaction.objects.remove([(self.user2.id, self.post.id), (self.user2.id, other.id)]), 1)
+        self.assertEqual(self.stats().love_count, 1)
+        self.assertEqual(list(PostStats.objects.drifted()), [])
+
+        # Rows for posts outside `posts` are skipped
+        hidden = Post.objects.filter(pk=other.pk)
+        self.assertEqual(Reaction.objects.upsert([(self.user2.id, self.post.id, 'like')], posts=hidden), [])
+        self.assertIsNone(Reaction.objects.set_reaction(self.user2, self.post, 'like', posts=hidden))
+
+    def test_buffer_coalesces_changes_into_one_flush(self):
+        buffer = ReactionBuffer(interval=60, max_pending=100)
+        buffer.react(self.user1.id, self.post.id, 'like')
+        buffer.react(self.user1.id, self.post.id, 'hate')
+        buffer.react(self.user2.id, self.post.id, 'love')
+        buffer.unreact(self.user2.id, self.post.id)
+        self.assertFalse(Reaction.objects.exists())
+        PostStats.objects.rebuild(post_ids=[self.post.id])
+
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(buffer.flush(), (1, 0))
+        # The upsert, its counter update and the delete
+        statements = [q['sql'] for q in ctx.captured_queries if not q['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(list(Reaction.objects.values_list('user_id', 'reaction')), [(self.user1.id, 'hate')])
+        self.assertEqual(list(PostStats.objects.drifted()), [])
+        self.assertEqual(buffer.flush(), (0, 0))
+
+
+class PostVisibilityTestCase(TestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.friend = User.objects.create_user(username='friend')
+        self.stranger = User.objects.create_user(username='stranger')
+        Relationship.send_request(self.author, self.friend).accept()
+        self.posts = {
+            visibility: Post.objects.create(title=visibility, content='audience test',
+                                            author=self.author, visibility=visibility)
+            for visibility in (Post.PUBLIC, Post.FRIENDS, Post.ONLY_ME)
+        }
+        for post in self.posts.values():
+            Comment.objects.create_comment(self.author, post.id, 'note')
+        self.factory = APIRequestFactory()
+
+    def get(self, view, url, user, **kwargs):
+        request = self.factory.get(url)
+        if user is not None:
+            force_authenticate(request, user=user)
+        return view(request, **kwargs)
+
+    def visible_titles(self, user):
+        response = self.get(PostViewSet.as_view({'get': 'list'}), '/api/posts/', user)
+        return {post['title'] for post in response.data['results']}
+
+    def test_every_read_path_respects_visibility(self):
+        self.assertEqual(self.visible_titles(self.author), {'public', 'friends', 'only_me'})
+        self.assertEqual(self.visible_titles(self.friend), {'public', 'friends'})
+        self.assertEqual(self.visible_titles(self.stranger), {'public'})
+        self.assertEqual(self.visible_titles(None), {'public'})
+
+        retrieve = PostViewSet.as_view({'get': 'retrieve'})
+        private = self.posts[Post.ONLY_ME]
+        self.assertEqual(self.get(retrieve, '/', self.friend, pk=private.pk).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get(retrieve, '/', self.author, pk=private.pk).status_code, status.HTTP_200_OK)
+
+        user_posts = self.get(PostViewSet.as_view({'get': 'user_posts'}), '/', self.stranger, user_id=self.author.id)
+        self.assertEqual([p['title'] for p in user_posts.data['results']], ['public'])
+
+        search = self.get(PostViewSet.as_view({'get': 'search'}), '/api/posts/search/?q=audience', self.friend)
+        self.assertEqual({p['title'] for p in search.data['results']}, {'public', 'friends'})
+
+        comments = CommentViewSet.as_view({'get': 'post_comments'})
+        friends_only = self.posts[Post.FRIENDS]
+        self.assertEqual(self.get(comments, '/', self.stranger, post_id=friends_only.pk).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(len(self.get(comments, '/', self.friend, post_id=friends_only.pk).data['results']), 1)
+        listed = self.get(CommentViewSet.as_view({'get': 'list'}), '/', self.stranger)
+        self.assertEqual({c['post'] for c in listed.data}, {self.posts[Post.PUBLIC].id})
+
+        react = self.factory.post('/api/reactions/react/', {'post': private.pk, 'reaction': 'like'})
+        force_authenticate(react, user=self.friend)
+        self.assertEqual(ReactionViewSet.as_view({'post': 'react'})(react).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Reaction.objects.exists())
+
+    def test_page_of_fifty_has_a_fixed_query_budget(self):
+        view = PostViewSet.as_view({'get': 'list'})
+
+        def count_queries():
+            friend_graph.clear()
+            block_list.clear()
+            request = self.factory.get('/api/posts/?page_size=50')
+            force_authenticate(request, user=self.friend)
+            with CaptureQueriesContext(connection) as ctx:
+                response = view(request)
+            return len(ctx.captured_queries), response
+
+        baseline, _ = count_queries()
+        visibilities = [Post.PUBLIC, Post.FRIENDS, Post.ONLY_ME]
+        for i in range(120):
+            author = self.author if i % 2 else self.stranger
+            Post.objects.create(title=f'p{i}', content='bulk', author=author, visibility=visibilities[i % 3])
+        queries, response = count_queries()
+        self.assertEqual(queries, baseline)
+        self.assertEqual(len(response.data['results']), 50)
+
+
+class CommentThreadTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='commenter')
+        self.post = Post.objects.create(title='thread', content='x', author=self.user)
+        # chain[0] <- chain[1] <- ... <- chain[5], plus a second reply to chain[0]
+        self.chain = [Comment.objects.create_comment(self.user, self.post.id, 'c0')]
+        for depth in range(1, 6):
+            self.chain.append(Comment.objects.create_comment(
+                self.user, self.post.id, f'c{depth}', parent=self.chain[-1]))
+        self.sibling = Comment.objects.create_comment(self.user, self.post.id, 'sibling', parent=self.chain[0])
+        self.factory = APIRequestFactory()
+
+    def get(self, action, **kwargs):
+        request = self.factory.get('/', kwargs.pop('params', {}))
+        force_authenticate(request, user=self.user)
+        return CommentViewSet.as_view({'get': action})(request, **kwargs)
+
+    def query(self, url):
+        return {key: values[0] for key, values in parse_qs(urlparse(url).query).items()}
+
+    def test_replies_must_name_a_live_parent_on_the_same_post(self):
+        other_post = Post.objects.create(title='elsewhere', content='x', author=self.user)
+        self.chain[2].soft_delete(self.user)
+        view = CommentViewSet.as_view({'post': 'create'})
+
+        def reply(post, parent):
+            request = self.factory.post('/api/comments/', {'post': post.id, 'content': 'hi', 'parent': parent.id})
+            force_authenticate(request, user=self.user)
+            return view(request)
+
+        self.assertEqual(reply(other_post, self.chain[0]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(reply(self.post, self.chain[2]).status_code, status.HTTP_400_BAD_REQUEST)
+        self.chain[0].refresh_from_db()
+        self.assertEqual(self.chain[0].reply_count, 2)
+        self.assertEqual(reply(self.post, self.chain[0]).status_code, status.HTTP_201_CREATED)
+
+    def test_path_depth_and_root_are_set_on_insert(self):
+        leaf = self.chain[-1]
+        self.assertEqual(leaf.depth, 5)
+        self.assertEqual(leaf.root_id, self.chain[0].id)
+        self.assertEqual(leaf.path, ''.join(f'{c.id:010d}/' for c in self.chain[:-1]))
+
+    def test_whole_thread_loads_in_one_query(self):
+        with self.assertNumQueries(1):
+            [top] = Comment.objects.get_thread(self.post)
+            self.assertEqual([r.content for r in top.thread_replies], ['c1', 'sibling'])
+            node = top
+            while node.thread_replies:
+                node = node.thread_replies[0]
+            self.assertEqual(node.content, 'c5')
+
+    def test_cut_off_threads_are_resumed_from_the_parent(self):
+        response = self.get('thread', pk=self.chain[0].id, params={'max_depth': 2})
+        c2 = response.data['replies'][0]['replies'][0]
+        self.assertEqual((c2['content'], c2['replies'], c2['more_replies']), ('c2', [], 1))
+
+        rest = self.get('thread', pk=c2['id'])
+        self.assertEqual(rest.data['content'], 'c2')
+        self.assertEqual(rest.data['replies'][0]['replies'][0]['replies'][0]['content'], 'c5')
+
+    def test_deleted_comments_take_their_subtree_with_them(self):
+        self.chain[2].soft_delete(self.user)
+        [top] = Comment.objects.get_thread(self.post)
+        c1 = top.thread_replies[0]
+        self.assertEqual((c1.thread_replies, c1.more_replies), ([], 0))
+
+
+    def test_pages_inline_the_first_replies_of_each_comment(self):
+        tops = [self.chain[0]] + [
+            Comment.objects.create_comment(self.user, self.post.id, f'top{i}') for i in range(2)
+        ]
+        more = [Comment.objects.create_comment(self.user, self.post.id, f'r{i}', parent=tops[1])
+                for i in range(5)]
+
+        # Block list, post visibility, the page, then every page's replies at once
+        with self.assertNumQueries(4):
+            page = self.get('post_comments', post_id=self.post.id, params={'page_size': 2})
+        self.assertEqual([c['id'] for c in page.data['results']], [tops[0].id, tops[1].id])
+        first, second = page.data['results']
+        self.assertEqual([r['content'] for r in first['replies']], ['c1', 'sibling'])
+        self.assertEqual(first['replies'][0]['more_replies'], 1)
+        self.assertEqual([r['id'] for r in second['replies']], [r.id for r in more[:3]])
+        self.assertEqual(second['more_replies'], 2)
+
+        rest = self.get('replies', pk=tops[1].id, params=self.query(second['more_replies_url']))
+        self.assertEqual([r['id'] for r in rest.data['results']], [r.id for r in more[3:]])
+        self.assertIsNone(rest.data['next'])
+
+        last = self.get('post_comments', post_id=self.post.id,
+                        params=self.query(page.data['next']))
+        self.assertEqual([c['id'] for c in last.data['results']], [tops[2].id])
+
+
+class CommentModerationTestCase(TestCase):
+    def setUp(self):
+        self.moderator = User.objects.create_user(username='moderator')
+        self.moderator.user_permissions.add(Permission.objects.get(codename='can_moderate'))
+        self.spammer = User.objects.create_user(username='spammer')
+        self.member = User.objects.create_user(username='member')
+        self.posts = [Post.objects.create(title=f'p{i}', content='x', author=self.member) for i in range(2)]
+        self.top = Comment.objects.create_comment(self.member, self.posts[0].id, 'legit')
+        self.spam = [
+            Comment.objects.create_comment(self.spammer, post.id, 'spam', parent=parent)
+            for post, parent in [(self.posts[0], self.top), (self.posts[0], self.top),
+                                 (self.posts[0], None), (self.posts[1], None)]
+        ]
+        self.factory = APIRequestFactory()
+
+    def moderate(self, user=None, **data):
+        request = self.factory.post('/api/comments/moderate/', data, format='json')
+        force_authenticate(request, user=user or self.moderator)
+        return CommentViewSet.as_view({'post': 'moderate'})(request)
+
+    def assert_counters_consistent(self):
+        self.assertEqual(list(PostStats.objects.drifted()), [])
+        self.top.refresh_from_db()
+        self.assertEqual(self.top.reply_count, Comment.objects.filter(parent=self.top, deleted=False).count())
+
+    def test_bulk_delete_and_restore_keep_counters_in_step(self):
+        earlier = self.spam[3]
+        earlier.soft_delete(self.member)
+
+        # Permissions (2), the author lookup, then one UPDATE per table in a savepoint
+        with self.assertNumQueries(8):
+            response = self.moderate(action='delete', author=self.spammer.id)
+        self.assertEqual(response.data, {'action': 'delete', 'affected': 3})
+        self.assertFalse(Comment.objects.filter(user=self.spammer, deleted=False).exists())
+        # Already deleted rows keep who deleted them
+        earlier.refresh_from_db()
+        self.assertEqual(earlier.deleted_by, self.member)
+        self.assertEqual(set(Comment.objects.filter(deleted_by=self.moderator)), set(self.spam[:3]))
+        self.assert_counters_consistent()
+        self.assertEqual(self.moderate(action='delete', author=self.spammer.id).data['affected'], 0)
+
+        response = self.moderate(action='restore', ids=[c.id for c in self.spam[:2]], post=self.posts[0].id)
+        self.assertEqual(response.data['affected'], 2)
+        self.assert_counters_consistent()
+
+    def test_only_moderators_with_a_selector_are_accepted(self):
+        self.assertEqual(self.moderate(self.member, action='delete', post=self.posts[0].id).status_code,
+                         status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.moderate(action='delete').status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Comment.objects.filter(deleted=True).count(), 0)
+
+
+class BlockedUsersTestCase(TestCase):
+    def setUp(self):
+        block_list.clear()
+        self.viewer = User.objects.create_user(username='viewer')
+        self.blocked = User.objects.create_user(username='blocked')
+        self.other = User.objects.create_user(username='other')
+        self.relationship = Relationship.send_request(self.blocked, self.viewer)
+        self.relationship.block()
+
+        self.blocked_post = Post.objects.create(title='hidden', content='x', author=self.blocked)
+        self.post = Post.objects.create(title='shown', content='x', author=self.other)
+        comment = Comment.objects.create_comment(self.other, self.post.id, 'top')
+        Comment.objects.create_comment(self.blocked, self.post.id, 'reply', parent=comment)
+        Comment.objects.create_comment(self.blocked, self.post.id, 'hidden top')
+        Reaction.objects.set_reaction(self.blocked, self.post, 'like')
+        Reaction.objects.set_reaction(self.other, self.post, 'love')
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        block_list.clear()
+
+    def get(self, view, url='/', **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.viewer)
+        return view(request, **kwargs)
+
+    def test_listings_hide_users_on_either_side_of_a_block(self):
+        posts = self.get(PostViewSet.as_view({'get': 'list'}))
+        self.assertEqual([p['title'] for p in posts.data['results']], ['shown'])
+        detail = self.get(PostViewSet.as_view({'get': 'retrieve'}), pk=self.blocked_post.pk)
+        self.assertEqual(detail.status_code, status.HTTP_404_NOT_FOUND)
+
+        comments = self.get(CommentViewSet.as_view({'get': 'post_comments'}), post_id=self.post.pk)
+        self.assertEqual([(c['content'], c['replies']) for c in comments.data['results']], [('top', [])])
+        listed = self.get(CommentViewSet.as_view({'get': 'list'}))
+        self.assertEqual({c['content'] for c in listed.data}, {'top'})
+
+        reactions = self.get(PostViewSet.as_view({'get': 'reactions'}), pk=self.post.pk)
+        self.assertEqual([r['reaction'] for r in reactions.data['results']], ['love'])
+
+    def test_comments_across_a_block_cannot_be_replied_to(self):
+        hidden = Comment.objects.get(content='hidden top')
+        request = self.factory.post('/api/comments/', {'post': self.post.id, 'content': 'hi', 'parent': hidden.id})
+        force_authenticate(request, user=self.viewer)
+        response = CommentViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(COMMENTS_REPLIES_PER_COMMENT=2)
+    def test_blocked_replies_do_not_use_up_the_inlined_replies(self):
+        top = Comment.objects.get(content='top')
+        # top's first reply is the blocked user's; two visible ones follow
+        for content in ('second', 'third'):
+            Comment.objects.create_comment(self.other, self.post.id, content, parent=top)
+        comments = self.get(CommentViewSet.as_view({'get': 'post_comments'}), post_id=self.post.pk)
+        [listed] = comments.data['results']
+        self.assertEqual([r['content'] for r in listed['replies']], ['second', 'third'])
+
+    def test_unblocking_restores_listings_and_blocks_cost_no_query(self):
+        view = PostViewSet.as_view({'get': 'list'})
+        self.get(view)
+        with CaptureQueriesContext(connection) as ctx:
+            self.get(view)
+        self.assertFalse(any('socials_relationship' in q['sql'] and 'blocked' in q['sql']
+                             for q in ctx.captured_queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.relationship.unblock()
+        titles = {p['title'] for p in self.get(view).data['results']}
+        self.assertEqual(titles, {'shown', 'hidden'})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ATTACHMENTS_MAX_ATTEMPTS=2, ATTACHMENTS_RETRY_BACKOFF=30)
+class AttachmentProcessingTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='uploader')
+        self.post = Post.objects.create(title='Media', content='files', author=self.user)
+        self.factory = APIRequestFactory()
+
+    def png(self, name='pixel.png', size=(4, 4)):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, 'red').save(buffer, format='PNG')
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+    def test_upload_returns_before_processing_and_the_worker_finishes_it(self):
+        request = self.factory.post('/api/attachments/', {'post': self.post.id, 'file': [
+            self.png(), SimpleUploadedFile('notes.png', b'plain text, whatever the name says'),
+        ]}, format='multipart')
+        force_authenticate(request, user=self.user)
+        response = AttachmentViewSet.as_view({'post': 'create'})(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([a['status'] for a in response.data], ['pending', 'pending'])
+
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        attachments = list(Attachment.objects.order_by('id'))
+        self.assertEqual([(a.status, a.file_type) for a in attachments], [('ready', 'image'), ('ready', 'other')])
+        self.assertEqual(AttachmentSerializer(attachments[1]).data['srcset'], {})
+
+    def test_images_get_upright_stripped_derivatives_next_to_the_original(self):
+        buffer = BytesIO()
+        exif = PILImage.Exif()
+        exif[0x0112] = 6  # stored sideways, shown rotated 90 degrees
+        PILImage.new('RGB', (800, 400), 'blue').save(buffer, format='JPEG', exif=exif)
+        attachment = Attachment.objects.create(
+            post=self.post, file=SimpleUploadedFile('wide.jpg', buffer.getvalue(), content_type='image/jpeg')
+        )
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        attachment.refresh_from_db()
+
+        # Only the sizes smaller than the original are made
+        srcset = AttachmentSerializer(attachment).data['srcset']
+        self.assertEqual({name: (v['width'], v['height']) for name, v in srcset.items()},
+                         {'medium': (320, 640), 'thumb': (80, 160)})
+        stem = attachment.file.name.rsplit('.', 1)[0]
+        self.assertEqual(attachment.derivatives['medium']['webp'], f'{stem}.medium.webp')
+        self.assertTrue(srcset['thumb']['jpeg'].endswith('.thumb.jpg'))
+        with PILImage.open(attachment.file.storage.path(attachment.derivatives['medium']['jpeg'])) as medium:
+            self.assertEqual(medium.size, (320, 640))
+            self.assertNotIn(0x0112, medium.getexif())
+
+    def test_deleting_attachments_removes_what_the_worker_made(self):
+        attachment = Attachment.objects.create(post=self.post, file=self.png(size=(400, 200)))
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        attachment.refresh_from_db()
+        storage = attachment.file.storage
+        generated = attachment.generated_files()
+        self.assertTrue(generated and all(storage.exists(name) for name in generated))
+
+        # Cascades and queryset deletes included
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertFalse(any(storage.exists(name) for name in generated))
+
+    def test_an_attachment_deleted_mid_processing_is_skipped_without_leftovers(self):
+        Attachment.objects.create(post=self.post, file=self.png())
+        [job] = Attachment.objects.claim(limit=1)
+        Attachment.objects.filter(pk=job.pk).delete()
+
+        thumbnail = BytesIO()
+        PILImage.new('RGB', (4, 4)).save(thumbnail, format='JPEG')
+        self.assertFalse(job.mark_ready('video', thumbnail=thumbnail.getvalue()))
+        self.assertFalse(job.file.storage.exists(job.thumbnail.name))
+        self.assertFalse(job.mark_failed('gone'))
+
+    def test_claims_skip_locked_jobs_and_retries_back_off(self):
+        first = Attachment.objects.create(post=self.post, file=self.png())
+        second = Attachment.objects.create(post=self.post, file=self.png())
+        claimed = Attachment.objects.claim(limit=1)
+        self.assertEqual(claimed, [first])
+        # A claimed job is leased; only the other one is due
+        self.assertEqual(Attachment.objects.claim(limit=5), [second])
+        self.assertEqual(Attachment.objects.claim(limit=5), [])
+
+        now = timezone.now()
+        job = claimed[0]
+        job.mark_failed(FileNotFoundError('gone'), now=now)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        self.assertEqual(job.available_at, now + timedelta(seconds=30))
+        self.assertEqual(Attachment.objects.claim(limit=5, now=now + timedelta(seconds=29)), [])
+
+        job = Attachment.objects.claim(limit=5, now=now + timedelta(seconds=30))[0]
+        job.mark_failed('still gone')
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.error), ('failed', 2, 'still gone'))
+
+        # An expired lease with no attempts left fails instead of running again
+        second.refresh_from_db()
+        self.assertEqual(Attachment.objects.claim(limit=5, now=second.available_at), [second])
+        Attachment.objects.claim(limit=5, now=second.available_at + timedelta(hours=1))
+        second.refresh_from_db()
+        self.assertEqual(second.status, 'failed')
+
+    def test_videos_get_a_sampled_thumbnail_and_sprite_sheet(self):
+        path = os.path.join(tempfile.mkdtemp(), 'clip.mp4')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), 10, (64, 48))
+        checkerboard = np.kron(np.indices((6, 8)).sum(axis=0) % 2 * 255, np.ones((8, 8))).astype(np.uint8)
+        for i in range(40):
+            # A black opening, as most clips have
+            writer.write(np.zeros((48, 64, 3), np.uint8) if i < 5 else cv2.merge([checkerboard] * 3))
+        writer.release()
+        with open(path, 'rb') as f:
+            attachment = Attachment.objects.create(
+                post=self.post, file=SimpleUploadedFile('clip.mp4', f.read(), content_type='video/mp4')
+            )
+
+        with override_settings(VIDEO_THUMBNAIL_SAMPLES=4):
+            call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        attachment.refresh_from_db()
+        self.assertEqual((attachment.file_type, attachment.duration, attachment.width, attachment.height),
+                         ('video', 4.0, 64, 48))
+        with PILImage.open(attachment.thumbnail.path) as thumbnail:
+            self.assertGreater(np.asarray(thumbnail.convert('L')).mean(), 64)
+
+        preview = AttachmentSerializer(attachment).data['preview']
+        self.assertEqual(preview['timestamps'], [500, 1500, 2500, 3500])
+        self.assertEqual((preview['columns'], preview['rows'], preview['tile_height']), (4, 1, 120))
+        with PILImage.open(attachment.sprite.path) as sprite:
+            self.assertEqual(sprite.size, (4 * 160, 120))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ATTACHMENTS_UPLOAD_STAGING_DIR=tempfile.mkdtemp())
+class UploadSessionTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='mobile')
+        self.other = User.objects.create_user(username='other')
+        self.post = Post.objects.create(title='Clip', content='big file', author=self.user)
+        self.data = os.urandom(250_000)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def open_session(self, **extra):
+        response = self.client.post('/api/uploads/', {
+            'post': self.post.id, 'filename': 'clip.mp4', 'size': len(self.data), **extra,
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def put(self, session_id, start, end, checksum=None):
+        chunk = self.data[start:end]
+        return self.client.generic(
+            'PUT', f'/api/uploads/{session_id}/', chunk, content_type='application/octet-stream',
+            HTTP_CONTENT_RANGE=f'bytes {start}-{end - 1}/{len(self.data)}',
+            HTTP_X_CHUNK_SHA256=checksum or hashlib.sha256(chunk).hexdigest(),
+        )
+
+    def test_chunks_resume_after_failures_and_complete_into_an_attachment(self):
+        session_id = self.open_session(sha256=hashlib.sha256(self.data).hexdigest())
+
+        response = self.put(session_id, 0, 100_000, checksum='0' * 64)
+        self.assertEqual((response.status_code, response.data['received']), (status.HTTP_400_BAD_REQUEST, 0))
+        self.assertEqual(self.put(session_id, 0, 100_000).data['received'], 100_000)
+        # Out of order: the client is told where to resume
+        response = self.put(session_id, 200_000, 250_000)
+        self.assertEqual((response.status_code, response.data['received']), (status.HTTP_409_CONFLICT, 100_000))
+        self.assertEqual(self.client.get(f'/api/uploads/{session_id}/').data['received'], 100_000)
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').status_code,
+                         status.HTTP_409_CONFLICT)
+
+        self.put(session_id, 100_000, 200_000)
+        self.put(session_id, 200_000, 250_000)
+        response = self.client.post(f'/api/uploads/{session_id}/complete/')
+        self.assertEqual((response.status_code, response.data['status']), (status.HTTP_201_CREATED, 'pending'))
+        attachment = Attachment.objects.get(pk=response.data['id'])
+        with attachment.file.open('rb') as f:
+            self.assertEqual(f.read(), self.data)
+        self.assertFalse(os.path.exists(UploadSession.objects.get(pk=session_id).staging_path))
+        # Completing twice returns the same attachment
+        self.assertEqual(self.client.post(f'/api/uploads/{session_id}/complete/').data['id'], attachment.id)
+
+    def test_an_interrupted_chunk_leaves_no_trace(self):
+        session = UploadSession.objects.get(pk=self.open_session())
+        session.append(BytesIO(self.data[:1000]), 1000, hashlib.sha256(self.data[:1000]).hexdigest())
+        with self.assertRaises(UploadSession.ChecksumMismatch):
+            # The connection dropped halfway through the chunk
+            session.append(BytesIO(self.data[1000:1500]), 1000, hashlib.sha256(self.data[1000:2000]).hexdigest())
+        self.assertEqual(session.received, 1000)
+        self.assertEqual(os.path.getsize(session.staging_path), 1000)
+
+    def test_sessions_are_private_and_checked_up_front(self):
+        session_id = self.open_session()
+        outsider = APIClient()
+        outsider.force_authenticate(self.other)
+        self.assertEqual(outsider.get(f'/api/uploads/{session_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(outsider.post('/api/uploads/', {
+            'post': self.post.id, 'filename': 'clip.mp4', 'size': 10,
+        }, format='json').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(self.client.post('/api/uploads/', {
+            'post': self.post.id, 'filename': 'setup.exe', 'size': 10,
+        }, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        for content_length in ('ten', '\u00b2'):
+            response = self.client.generic(
+                'PUT', f'/api/uploads/{session_id}/', self.data[:10], content_type='application/octet-stream',
+                CONTENT_LENGTH=content_length, HTTP_CONTENT_RANGE=f'bytes 0-9/{len(self.data)}',
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
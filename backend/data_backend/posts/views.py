@@ -1,15 +1,37 @@
 from rest_framework import viewsets, status, permissions, filters
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
-from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from django.contrib.auth.models import User
-from .models import Post, Reaction,Comment, Attachment
+from django.conf import settings
+from django.db import transaction, DatabaseError
+import re
+from .models import Post, Reaction,Comment, Attachment, UploadSession, set_more_replies
 from .serializers import (
     PostSerializer, PostDetailSerializer, PostCreateUpdateSerializer,
-    ReactionSerializer,CommentCreateSerializer,CommentSerializer,AttachmentSerializer,PostSerializerWithAttachments
+    ReactionSerializer,CommentCreateSerializer,CommentSerializer,AttachmentSerializer,PostSerializerWithAttachments,
+    CommentModerationSerializer, UploadSessionSerializer,
+    PostSearchSerializer, viewer_reactions
 )
+from .pagination import (
+    PostCursorPagination, PostSearchPagination, ReactionCursorPagination, CommentCursorPagination
+)
+from .reaction_buffer import reactions as reaction_buffer
+from socials.blocks import exclude_blocked
+
+MAX_ID = 2 ** 63 - 1  # bigint primary keys
+
+
+def parse_id(value):
+    """`value` as a database id, or None for anything else: only ASCII digits, within bigint range"""
+    value = str(value)
+    if value.isascii() and value.isdecimal() and 0 < int(value) <= MAX_ID:
+        return int(value)
+    return None
+
+
 class IsPostAuthorOrReadOnly(permissions.BasePermission):
     """
     Permission for attachments - checks the parent post's author
@@ -33,28 +55,40 @@ class PostViewSet(viewsets.ModelViewSet):
     """
     queryset = Post.objects.all()
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    search_fields = ['title', 'content']
-    ordering_fields = ['created_at', 'updated_at']
+    # ?search= is answered by the full-text index in get_queryset, not SearchFilter
+    filter_backends = [DjangoFilterBackend]
     filterset_fields = ['author']
-    pagination_class = None  # Disable pagination
+    # Keyset pagination fixes the order to (created_at, id), so no OrderingFilter
+    pagination_class = PostCursorPagination
 
-    def get_queryset(self):
-        queryset = Post.objects.all().select_related('author').prefetch_related(
-            Prefetch('reaction_set', queryset=Reaction.objects.select_related('user'))
-            
-        )
+    def get_base_queryset(self):
+        # Every read path starts here, so visibility and blocks are enforced once
+        user = self.request.user
+        posts = Post.objects.visible_to(user, Post.objects.for_listing(user))
+        return exclude_blocked(posts, user, 'author')
 
+    def filter_author(self, queryset):
+        """Narrow to ?user_id= when given; anything but an integer is a 400"""
         if user_id := self.request.query_params.get('user_id'):
-            queryset = queryset.filter(author_id=user_id)
+            try:
+                queryset = queryset.filter(author_id=int(user_id))
+            except ValueError:
+                raise ValidationError({'user_id': "Must be an integer."})
+        return queryset
+
+    def get_queryset(self):
+        queryset = self.filter_author(self.get_base_queryset())
+
         if search_query := self.request.query_params.get('search'):
-            queryset = Post.objects.search(search_query)
+            queryset = Post.objects.search(search_query, queryset=queryset)
 
         return queryset
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return PostDetailSerializer
+        elif self.action == 'search':
+            return PostSearchSerializer
         elif self.action in ['create', 'update', 'partial_update']:
             return PostCreateUpdateSerializer
         return PostSerializerWithAttachments
@@ -67,25 +101,50 @@ class PostViewSet(viewsets.ModelViewSet):
         # Let the serializer handle attachments
         serializer.save()
 
+    def paginated_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Full-text search over titles and content, best match first, with highlighted snippets."""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response(
+                {"error": "Query parameter 'q' is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        queryset = self.filter_author(self.get_base_queryset())
+        posts = Post.objects.search_with_highlights(query, queryset=queryset)
+
+        paginator = PostSearchPagination()
+        page = paginator.paginate_queryset(posts, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=True, methods=['get'])
     def reactions(self, request, pk=None):
-        """Get all reactions for a specific post."""
+        """Get the reactions to a specific post, newest first, a page at a time."""
         post = self.get_object()
-        reactions = post.reaction_set.select_related('user')
-        return Response(ReactionSerializer(reactions, many=True).data)
+        reactions = exclude_blocked(post.reaction_set.select_related('user'), request.user)
+        paginator = ReactionCursorPagination()
+        page = paginator.paginate_queryset(reactions, request, view=self)
+        return paginator.get_paginated_response(ReactionSerializer(page, many=True).data)
 
     @action(detail=False, methods=['get'])
     def my_posts(self, request):
         """Get all posts created by the authenticated user."""
-        posts = Post.objects.filter(author=request.user).select_related('author')
-        return Response(self.get_serializer(posts, many=True).data)
+        posts = self.get_base_queryset().filter(author=request.user)
+        return self.paginated_response(posts)
 
     @action(detail=False, methods=['get'], url_path='user/(?P<user_id>\d+)')
     def user_posts(self, request, user_id):
         """Get all posts created by a specific user."""
         user = get_object_or_404(User, pk=user_id)
-        posts = Post.objects.filter(author=user).select_related('author')
-        return Response(self.get_serializer(posts, many=True).data)
+        posts = self.get_base_queryset().filter(author=user)
+        return self.paginated_response(posts)
 class ReactionViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing reactions to posts.
@@ -100,9 +159,63 @@ class ReactionViewSet(viewsets.ModelViewSet):
                              .select_related('post', 'user')\
                              .order_by('-id')
 
+    def reactable_posts(self):
+        """Posts the caller may react to: visible to them, with no block either way"""
+        return exclude_blocked(Post.objects.visible_to(self.request.user), self.request.user, 'author')
+
     def create(self, request, *args, **kwargs):
-        request.data.setdefault('user_id', request.user.id)
-        return super().create(request, *args, **kwargs)
+        # Reactions are always the caller's own, whatever user_id says
+        data = request.data.copy()
+        data['user_id'] = request.user.id
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    # Route generic CRUD through the manager so PostStats stays in step and
+    # the same visibility and block checks as react() apply
+    def perform_create(self, serializer):
+        data = serializer.validated_data
+        result = Reaction.objects.set_reaction(
+            user=self.request.user, post=data['post'], reaction_type=data['reaction'],
+            posts=self.reactable_posts(),
+        )
+        if result is None:
+            raise NotFound("No Post matches the given query.")
+        serializer.instance, _ = result
+
+    def perform_update(self, serializer):
+        instance = serializer.instance
+        reaction_type = serializer.validated_data.get('reaction', instance.reaction)
+        result = Reaction.objects.set_reaction(
+            user=self.request.user, post=instance.post_id, reaction_type=reaction_type,
+            posts=self.reactable_posts(),
+        )
+        if result is None:
+            raise NotFound("No Post matches the given query.")
+        serializer.instance, _ = result
+
+    def perform_destroy(self, instance):
+        Reaction.objects.delete_reaction(user=instance.user, post=instance.post_id)
+
+    @action(detail=False, methods=['get'])
+    def mine(self, request):
+        """The user's reactions to the posts in ?post_ids=1,2,3 as {post_id: reaction}."""
+        raw = [part for part in request.query_params.get('post_ids', '').split(',') if part]
+        post_ids = [parse_id(part) for part in raw]
+        if not post_ids or None in post_ids:
+            return Response(
+                {"error": "post_ids must be a comma-separated list of post IDs"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(raw) > (limit := getattr(settings, 'REACTIONS_LOOKUP_MAX_IDS', 500)):
+            return Response(
+                {"error": f"At most {limit} post IDs per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        # Posts without a reaction are left out
+        return Response({"reactions": viewer_reactions(request, post_ids)})
 
     @action(detail=False, methods=['post'])
     def react(self, request):
@@ -110,38 +223,44 @@ class ReactionViewSet(viewsets.ModelViewSet):
         post_id = request.data.get('post')
         reaction_type = request.data.get('reaction')
 
-        if not post_id or not reaction_type:
+        if (post_id := parse_id(post_id)) is None or not reaction_type:
             return Response(
                 {"error": "Both post and reaction are required"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        post = get_object_or_404(Post, id=post_id)
-        reaction = Reaction.objects.set_reaction(
-            user=request.user,
-            post=post,
-            reaction_type=reaction_type
-        )
-
-        if not reaction:
+        if reaction_type not in dict(Reaction.REACT_CHOICES):
             return Response(
                 {"error": f"Invalid reaction type. Choose from: {dict(Reaction.REACT_CHOICES)}"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        return Response(self.get_serializer(reaction[0]).data)
+        posts = self.reactable_posts()
+        if getattr(settings, 'POSTS_REACTIONS_COALESCE', False):
+            get_object_or_404(posts.values('pk'), id=post_id)
+            reaction_buffer.react(request.user.pk, post_id, reaction_type)
+            return Response({"post": post_id, "reaction": reaction_type}, status=status.HTTP_202_ACCEPTED)
+
+        # The visibility check is part of the upsert: no separate Post load
+        result = Reaction.objects.set_reaction(request.user, post_id, reaction_type, posts=posts)
+        if result is None:
+            return Response({"detail": "No Post matches the given query."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self.get_serializer(result[0]).data)
 
     @action(detail=False, methods=['post'])
     def unreact(self, request):
         """Remove a reaction from a post."""
-        if not (post_id := request.data.get('post')):
+        if (post_id := parse_id(request.data.get('post'))) is None:
             return Response(
                 {"error": "Post ID is required"},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        post = get_object_or_404(Post, id=post_id)
-        deleted_count, _ = Reaction.objects.delete_reaction(user=request.user, post=post)
+        if getattr(settings, 'POSTS_REACTIONS_COALESCE', False):
+            reaction_buffer.unreact(request.user.pk, post_id)
+            return Response(status=status.HTTP_202_ACCEPTED)
+
+        deleted_count, _ = Reaction.objects.delete_reaction(user=request.user, post=post_id)
 
         if not deleted_count:
             return Response(
@@ -170,8 +289,9 @@ class CommentViewSet(viewsets.ModelViewSet):
         # Filter by post_id if provided
         if post_id := self.request.query_params.get('post_id'):
             queryset = Comment.objects.get_comments_for_post(
-                post_id=post_id,
-                include_deleted=False
+                post=post_id,
+                include_deleted=False,
+                viewer=self.request.user
             )
         # Filter to get user's comments
         elif user_id := self.request.query_params.get('user_id'):
@@ -181,7 +301,11 @@ class CommentViewSet(viewsets.ModelViewSet):
                 include_deleted=False
             )
 
-        return queryset
+        return exclude_blocked(queryset.filter(post__in=self.visible_posts()), self.request.user)
+
+    def visible_posts(self):
+        user = self.request.user
+        return exclude_blocked(Post.objects.visible_to(user), user, 'author').values('pk')
 
     def get_serializer_class(self):
         """Return appropriate serializer based on the action"""
@@ -193,6 +317,7 @@ class CommentViewSet(viewsets.ModelViewSet):
         """Create a new comment or reply"""
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        get_object_or_404(self.visible_posts(), pk=serializer.validated_data['post'].id)
 
         # Use the manager's create_comment method
         comment = Comment.objects.create_comment(
@@ -238,7 +363,7 @@ class CommentViewSet(viewsets.ModelViewSet):
 
         # Determine if this should be a hard delete
         hard_delete = request.query_params.get('hard_delete') == 'true'
-        if hard_delete and not request.user.has_perm('app.can_moderate'):
+        if hard_delete and not request.user.has_perm(Comment.MODERATE_PERMISSION):
             return Response(
                 {"error": "You don't have permission to permanently delete comments"},
                 status=status.HTTP_403_FORBIDDEN
@@ -254,26 +379,83 @@ class CommentViewSet(viewsets.ModelViewSet):
         except PermissionError as e:
             return Response({"error": str(e)}, status=status.HTTP_403_FORBIDDEN)
 
+    @action(detail=False, methods=['post'])
+    def moderate(self, request):
+        """
+        Soft-delete or restore comments in bulk (moderators only). Select
+        them with any of `ids`, `author` and `post`; every selector given
+        must match. Returns how many comments changed state.
+        """
+        if not request.user.has_perm(Comment.MODERATE_PERMISSION):
+            return Response(
+                {"error": "You don't have permission to moderate comments"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = CommentModerationSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        comments = Comment.objects.all()
+        if 'ids' in data:
+            comments = comments.filter(pk__in=data['ids'])
+        if 'author' in data:
+            comments = comments.filter(user=data['author'])
+        if 'post' in data:
+            comments = comments.filter(post=data['post'])
+        affected = Comment.objects.moderate(comments, request.user, delete=data['action'] == 'delete')
+        return Response({"action": data['action'], "affected": affected})
+
     @action(detail=False, methods=['get'])
     def my_comments(self, request):
         """Get all comments by the authenticated user (non-deleted only)"""
         comments = Comment.objects.get_user_comments(
             user=request.user,
             include_deleted=False
-        )
+        ).filter(post__in=self.visible_posts())
         serializer = CommentCreateSerializer(comments, many=True)
         return Response(serializer.data)
 
     @action(detail=False, methods=['get'], url_path='post/(?P<post_id>\\d+)')
     def post_comments(self, request, post_id=None):
-        """Get all comments for a specific post (non-deleted only)"""
-        post = get_object_or_404(Post, pk=post_id)
-        comments = Comment.objects.get_comments_for_post(
-            post=post,
-            include_deleted=False
-        ).select_related('user')
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        """
+        A page of a post's top-level comments (non-deleted only), oldest
+        first, each with its first replies; two queries whatever the thread size.
+        """
+        post = get_object_or_404(self.visible_posts(), pk=post_id)
+        return self.paginated_comments(Comment.objects.top_level(post['pk'], request.user), with_replies=True)
+
+    @action(detail=True, methods=['get'])
+    def replies(self, request, pk=None):
+        """A page of a comment's direct replies, oldest first; follows a comment's more_replies_url"""
+        comment = self.get_object()
+        return self.paginated_comments(Comment.objects.replies_to(comment, request.user))
+
+    def paginated_comments(self, queryset, with_replies=False):
+        paginator = CommentCursorPagination()
+        page = paginator.paginate_queryset(queryset, self.request, view=self)
+        if with_replies:
+            Comment.objects.attach_replies(page, viewer=self.request.user)
+        else:
+            for comment in page:
+                set_more_replies(comment)
+        serializer = CommentSerializer(page, many=True, context={'request': self.request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        """A comment and the replies below it; loads what a cut-off thread left out"""
+        comment = self.get_object()
+        [comment] = Comment.objects.get_thread(comment.post_id, root=comment, viewer=request.user,
+                                               max_depth=self.max_depth_param())
+        return Response(CommentSerializer(comment, context={'request': request}).data)
+
+    def max_depth_param(self):
+        """?max_depth=, never deeper than COMMENTS_THREAD_MAX_DEPTH"""
+        limit = getattr(settings, 'COMMENTS_THREAD_MAX_DEPTH', 8)
+        try:
+            return min(max(int(self.request.query_params.get('max_depth', limit)), 0), limit)
+        except ValueError:
+            return limit
 
 
 class AttachmentViewSet(viewsets.ModelViewSet):
@@ -323,3 +505,113 @@ class AttachmentViewSet(viewsets.ModelViewSet):
         context = super().get_serializer_context()
         context['request'] = self.request
         return context
+
+class UploadSessionViewSet(viewsets.GenericViewSet):
+    """
+    Resumable uploads for large attachments:
+
+        POST   /api/uploads/                 {post, filename, size, sha256?} opens a session
+        PUT    /api/uploads/<id>/            one chunk; Content-Range: bytes <start>-<end>/<size>
+                                             and X-Chunk-SHA256: <hex digest of the chunk>
+        GET    /api/uploads/<id>/            how many bytes arrived, to resume from after a drop
+        POST   /api/uploads/<id>/complete/   turns the upload into an Attachment
+        DELETE /api/uploads/<id>/            abandons it
+
+    Chunk bodies are read straight from the request stream, never parsed or
+    buffered whole, so server memory stays flat whatever the file size.
+    """
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = None
+    CONTENT_RANGE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+
+    def get_queryset(self):
+        return UploadSession.objects.live().filter(user=self.request.user)
+
+    def create(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        post = serializer.validated_data['post']
+        if post.author != request.user:
+            return Response(
+                {"error": "You don't own this post"},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer.save(user=request.user)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return Response(self.get_serializer(self.get_object()).data)
+
+    def update(self, request, pk=None):
+        match = self.CONTENT_RANGE.match(request.headers.get('Content-Range', ''))
+        checksum = request.headers.get('X-Chunk-SHA256', '')
+        if not match or not checksum:
+            return Response(
+                {"error": "Content-Range and X-Chunk-SHA256 headers are required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        start, end, total = map(int, match.groups())
+        length = end - start + 1
+        content_length = request.headers.get('Content-Length', '')
+        if length <= 0 or length > getattr(settings, 'ATTACHMENTS_UPLOAD_MAX_CHUNK', 16 * 1024 ** 2) \
+                or not (content_length.isascii() and content_length.isdecimal()) \
+                or int(content_length) != length:
+            return Response(
+                {"error": "Chunk length must match Content-Length and the upload's chunk limit"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            try:
+                # One chunk at a time per session; a parallel PUT is told to retry
+                with transaction.atomic():
+                    session = get_object_or_404(self.get_queryset().select_for_update(nowait=True), pk=pk)
+            except DatabaseError:
+                return Response(
+                    {"error": "Another chunk of this upload is being written"},
+                    status=status.HTTP_409_CONFLICT
+                )
+            if session.attachment_id is not None or total != session.size or end >= session.size:
+                return Response(
+                    {"error": "Range is outside this upload"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            if start != session.received:
+                # Resending a chunk that already arrived, or skipping ahead
+                return Response(
+                    {"error": "Chunks must be sent in order", "received": session.received},
+                    status=status.HTTP_409_CONFLICT
+                )
+            try:
+                session.append(request.stream, length, checksum)
+            except UploadSession.ChecksumMismatch as exc:
+                return Response(
+                    {"error": str(exc), "received": session.received},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        return Response(self.get_serializer(session).data)
+
+    def destroy(self, request, pk=None):
+        self.get_object().delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        """Finish the upload; the new attachment is queued for processing like any other."""
+        with transaction.atomic():
+            session = get_object_or_404(self.get_queryset().select_for_update(), pk=pk)
+            if session.attachment_id is not None:
+                return Response(AttachmentSerializer(session.attachment, context={'request': request}).data)
+            try:
+                attachment = session.complete()
+            except (UploadSession.Incomplete, UploadSession.ChecksumMismatch) as exc:
+                return Response(
+                    {"error": str(exc), "received": session.received},
+                    status=status.HTTP_409_CONFLICT if isinstance(exc, UploadSession.Incomplete)
+                    else status.HTTP_400_BAD_REQUEST
+                )
+        return Response(
+            AttachmentSerializer(attachment, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
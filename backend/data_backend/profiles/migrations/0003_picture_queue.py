@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:31
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def requeue_pictures_without_derivatives(apps, schema_editor):
+    # Pictures saved before this made their derivatives inline, and one
+    # whose render failed was recorded as done with none; mark those due
+    # again. Pictures from before 0002 have no source and are due already,
+    # so the worker's first run backfills both.
+    Profile = apps.get_model('profiles', 'Profile')
+    Profile.objects.exclude(profile_picture='').exclude(profile_picture__isnull=True).filter(
+        picture_derivatives={},
+    ).update(picture_derivatives_source='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('profiles', '0002_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='picture_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='picture_available_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(requeue_pictures_without_derivatives, migrations.RunPython.noop),
+    ]
@@ -1,21 +1,123 @@
-from django.db import models
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, models
 from django.contrib.auth.models import User
+from django.utils import timezone
+from data_backend.images import store_derivatives, delete_derivatives
 
+logger = logging.getLogger(__name__)
 
 
+# A picture is due while its derivatives were made from another file (or
+# never made). Claims share the attachment queue's lease, retry and
+# backoff settings, and run in the same process_attachments worker.
+CLAIM_PICTURES_SQL = """
+UPDATE profiles_profile p
+SET picture_attempts = p.picture_attempts + 1, picture_available_at = %(lease_until)s
+WHERE p.id IN (
+    SELECT id FROM profiles_profile
+    WHERE profile_picture <> '' AND profile_picture <> picture_derivatives_source
+      AND picture_available_at <= %(now)s AND picture_attempts < %(max_attempts)s
+    ORDER BY picture_available_at, id
+    LIMIT %(limit)s
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING p.id
+"""
 
 
+class ProfileManager(models.Manager):
+    def claim_pictures(self, limit, lease=None, now=None):
+        """
+        Lease up to `limit` profiles whose picture needs derivatives and
+        return them, like AttachmentManager.claim
+        """
+        now = now or timezone.now()
+        lease = lease or getattr(settings, 'ATTACHMENTS_LEASE', 300)
+        with connection.cursor() as cursor:
+            cursor.execute(CLAIM_PICTURES_SQL, {
+                'now': now, 'lease_until': now + timedelta(seconds=lease),
+                'max_attempts': getattr(settings, 'ATTACHMENTS_MAX_ATTEMPTS', 5), 'limit': limit,
+            })
+            ids = [row[0] for row in cursor.fetchall()]
+        return list(self.filter(pk__in=ids).order_by('picture_available_at', 'id')) if ids else []
 
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True)
     profile_picture = models.ImageField(upload_to='profile_pictures/', blank=True, null=True)
+    # Resized copies of profile_picture (see data_backend/images.py) and the
+    # file they were made from; the process_attachments worker makes them
+    picture_derivatives = models.JSONField(default=dict, blank=True)
+    picture_derivatives_source = models.CharField(max_length=255, blank=True)
+    picture_attempts = models.PositiveSmallIntegerField(default=0)
+    picture_available_at = models.DateTimeField(default=timezone.now)
     date_of_birth = models.DateField(null=True, blank=True)
     location = models.CharField(max_length=100, blank=True)
     website = models.URLField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ProfileManager()
+
     def __str__(self):
         return self.user.username
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_picture = instance.__dict__.get('profile_picture') or ''
+        return instance
+
+    def save(self, *args, **kwargs):
+        if (self.profile_picture.name or '') != getattr(self, '_loaded_picture', ''):
+            # A new picture is a new job: due now, with a fresh set of attempts
+            self.picture_attempts = 0
+            self.picture_available_at = timezone.now()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'picture_attempts', 'picture_available_at'}
+        super().save(*args, **kwargs)
+        self._loaded_picture = self.profile_picture.name or ''
+        if not self.profile_picture and self.picture_derivatives_source:
+            self.clear_picture_derivatives()
+
+    @property
+    def current_picture_derivatives(self):
+        """picture_derivatives, or {} while they belong to a previous picture"""
+        if self.profile_picture and self.profile_picture.name == self.picture_derivatives_source:
+            return self.picture_derivatives
+        return {}
+
+    def clear_picture_derivatives(self):
+        old = self.picture_derivatives
+        Profile.objects.filter(pk=self.pk).update(picture_derivatives={}, picture_derivatives_source='')
+        self.picture_derivatives, self.picture_derivatives_source = {}, ''
+        delete_derivatives(self.profile_picture.storage, old)
+
+    def mark_picture_ready(self, rendered):
+        """Store derivatives made by data_backend.images.render_derivatives for the claimed picture"""
+        source = self.profile_picture.name
+        stored = store_derivatives(self.profile_picture, rendered)
+        # The picture may have been replaced while this one was rendered
+        updated = Profile.objects.filter(pk=self.pk, profile_picture=source).update(
+            picture_derivatives=stored, picture_derivatives_source=source,
+        )
+        if updated:
+            old = self.picture_derivatives
+            self.picture_derivatives, self.picture_derivatives_source = stored, source
+        else:
+            old = stored
+        delete_derivatives(self.profile_picture.storage, old)
+
+    def mark_picture_failed(self, error, now=None):
+        """Retry with the attachment queue's backoff; after the last attempt clients keep the original"""
+        logger.warning("No derivatives for profile %s picture %s (attempt %s): %s",
+                       self.pk, self.profile_picture.name, self.picture_attempts, error)
+        backoff = getattr(settings, 'ATTACHMENTS_RETRY_BACKOFF', 30) * 2 ** (self.picture_attempts - 1)
+        self.picture_available_at = (now or timezone.now()) + timedelta(seconds=backoff)
+        Profile.objects.filter(pk=self.pk, profile_picture=self.profile_picture.name).update(
+            picture_available_at=self.picture_available_at,
+        )
@@ -3,6 +3,7 @@ from django.contrib.auth.models import User
 from authentification.serializers import UserSerializer
 
 from .models import Profile
+from data_backend.images import derivative_urls
 
 
 
@@ -16,18 +17,23 @@ class ProfileSerializer(serializers.ModelSerializer):
         required=False
     )
     profile_picture_url = serializers.SerializerMethodField(read_only=True)
+    profile_picture_srcset = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Profile
         fields = ['id', 'user', 'user_id', 'bio', 'profile_picture', 'profile_picture_url',
-                 'date_of_birth', 'location', 'website', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at', 'profile_picture_url']
+                 'profile_picture_srcset', 'date_of_birth', 'location', 'website', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'created_at', 'updated_at', 'profile_picture_url', 'profile_picture_srcset']
 
     def get_profile_picture_url(self, obj):
         if obj.profile_picture and hasattr(obj.profile_picture, 'url'):
             return self.context['request'].build_absolute_uri(obj.profile_picture.url)
         return None
 
+    def get_profile_picture_srcset(self, obj):
+        # Empty until derivatives exist; profile_picture_url is the fallback
+        return derivative_urls(self.context.get('request'), obj.profile_picture.storage, obj.current_picture_derivatives)
+
     def validate_profile_picture(self, value):
         if value:
             # Check file size (limit to 5MB)
@@ -1,3 +1,71 @@
-from django.test import TestCase
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PILImage
+from rest_framework.test import APIRequestFactory
+
+from .models import Profile
+from .serializers import ProfileSerializer
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), ATTACHMENTS_MAX_ATTEMPTS=2, ATTACHMENTS_RETRY_BACKOFF=30)
+class ProfilePictureTestCase(TestCase):
+    def setUp(self):
+        self.profile = Profile.objects.create(user=User.objects.create_user(username='pictured'))
+
+    def jpeg(self, size=(400, 200)):
+        buffer = BytesIO()
+        PILImage.new('RGB', size, 'green').save(buffer, format='JPEG')
+        return SimpleUploadedFile('me.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def srcset(self):
+        self.profile.refresh_from_db()
+        request = APIRequestFactory().get('/')
+        return ProfileSerializer(self.profile, context={'request': request}).data['profile_picture_srcset']
+
+    def test_saving_a_picture_queues_it_for_the_worker(self):
+        self.profile.profile_picture = self.jpeg()
+        self.profile.save()
+        self.assertEqual(self.srcset(), {})
+
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        self.assertEqual({name: (v['width'], v['height']) for name, v in self.srcset().items()},
+                         {'thumb': (160, 80)})
+        old = self.profile.picture_derivatives['thumb']['webp']
+
+        # A replacement hides the old derivatives until its own are made, then removes them
+        self.profile.profile_picture = self.jpeg((800, 400))
+        self.profile.save()
+        self.assertEqual(self.srcset(), {})
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        self.assertEqual(set(self.srcset()), {'thumb', 'medium'})
+        self.assertFalse(self.profile.profile_picture.storage.exists(old))
+
+    def test_existing_pictures_are_backfilled(self):
+        # Stored without going through save(), as pictures uploaded before derivatives were
+        self.profile.profile_picture.save('old.jpg', self.jpeg(), save=False)
+        Profile.objects.filter(pk=self.profile.pk).update(profile_picture=self.profile.profile_picture.name)
+        call_command('process_attachments', '--once', '--processes=1', stdout=StringIO())
+        self.assertEqual(set(self.srcset()), {'thumb'})
+
+    def test_unreadable_pictures_back_off_and_keep_the_save(self):
+        self.profile.profile_picture = SimpleUploadedFile('bomb.jpg', b'not an image', content_type='image/jpeg')
+        self.profile.save()
+
+        now = timezone.now()
+        with self.assertLogs('profiles.models', 'WARNING'):
+            [claimed] = Profile.objects.claim_pictures(5, now=now)
+            claimed.mark_picture_failed(ValueError('cannot decode'), now=now)
+            self.assertEqual(Profile.objects.claim_pictures(5, now=now + timedelta(seconds=29)), [])
+            [claimed] = Profile.objects.claim_pictures(5, now=now + timedelta(seconds=30))
+            claimed.mark_picture_failed(ValueError('cannot decode'), now=now)
+        # Out of attempts: clients keep the original
+        self.assertEqual(Profile.objects.claim_pictures(5, now=now + timedelta(days=1)), [])
+        self.assertEqual(self.srcset(), {})
+        self.assertTrue(self.profile.profile_picture.name.endswith('.jpg'))
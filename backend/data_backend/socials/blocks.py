@@ -0,0 +1,24 @@
+"""
+Hiding blocked users from listings.
+
+A block works both ways: neither side sees the other's posts, comments,
+reactions or profile in search. The ids come from `block_list`, a cached
+sorted array per user (see socials/graph.py), so a listing pays no query
+for them and only gains a `NOT IN` when the viewer has blocks at all.
+"""
+from .graph import block_list
+
+
+def blocked_user_ids(user):
+    """Ids of the users blocked by or blocking `user`, as a list; empty for anonymous users"""
+    if user is None or not user.is_authenticated:
+        return []
+    return block_list.blocked_ids(user).tolist()
+
+
+def exclude_blocked(queryset, user, field='user'):
+    """`queryset` without the rows whose `field` is a user blocked by or blocking `user`"""
+    blocked = blocked_user_ids(user)
+    if not blocked:
+        return queryset
+    return queryset.exclude(**{f'{field}__in': blocked})
@@ -0,0 +1,137 @@
+"""
+Per-process relationship graphs.
+
+For one Relationship status, each user's related ids are kept as a sorted
+int64 NumPy array. `friend_graph` (accepted) answers friendship checks
+with a binary search, friend counts with a length and mutual friends with
+a sorted-array intersection; `block_list` (blocked) feeds the block
+filter in socials.blocks. Neither needs SQL once a user is loaded.
+
+Arrays are loaded lazily from Relationship rows and kept for the
+FRIEND_GRAPH_MAX_USERS (BLOCK_LIST_MAX_USERS) most recently used users.
+Committed Relationship changes are applied in place through
+socials/signals.py; FRIEND_GRAPH_TTL (BLOCK_LIST_TTL) bounds how stale other
+processes can get.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from .models import Relationship
+
+
+class RelationshipGraph:
+    """Sorted ids of the users related to each user through `status` rows"""
+
+    def __init__(self, status, max_users, ttl):
+        self.status = status
+        self.max_users = max_users
+        self.ttl = ttl
+        self._adjacency = OrderedDict()  # user id -> (expires_at, sorted related ids)
+        self._seq = 0  # bumped for every applied change
+        self._changed = {}  # user id -> seq of the user's latest change
+        self._changed_floor = -1  # seq assumed for users pruned from _changed
+        self._lock = threading.Lock()
+
+    def related_ids(self, user):
+        user_id = getattr(user, 'pk', user)
+        with self._lock:
+            cached = self._adjacency.get(user_id)
+            if cached is not None and cached[0] >= time.monotonic():
+                self._adjacency.move_to_end(user_id)
+                return cached[1]
+            started = self._seq
+
+        related = np.array(Relationship.objects.get_related_ids(user_id, self.status), dtype=np.int64)
+        related.sort()
+        with self._lock:
+            # An edge committed while we were querying may be missing from `related`
+            if self._changed.get(user_id, self._changed_floor) <= started:
+                self._store(user_id, related)
+        return related
+
+    def is_related(self, user1, user2):
+        related = self.related_ids(user1)
+        other_id = getattr(user2, 'pk', user2)
+        i = np.searchsorted(related, other_id)
+        return bool(i < len(related) and related[i] == other_id)
+
+    def add_edge(self, user1_id, user2_id):
+        with self._lock:
+            self._update(user1_id, user2_id, add=True)
+            self._update(user2_id, user1_id, add=True)
+
+    def remove_edge(self, user1_id, user2_id):
+        with self._lock:
+            self._update(user1_id, user2_id, add=False)
+            self._update(user2_id, user1_id, add=False)
+
+    def clear(self):
+        with self._lock:
+            self._adjacency.clear()
+            self._changed.clear()
+
+    def _store(self, user_id, friends):
+        self._adjacency[user_id] = (time.monotonic() + self.ttl, friends)
+        self._adjacency.move_to_end(user_id)
+        while len(self._adjacency) > self.max_users:
+            self._adjacency.popitem(last=False)
+
+    def _update(self, user_id, other_id, add):
+        self._seq += 1
+        self._changed[user_id] = self._seq
+        if len(self._changed) > self.max_users * 2:
+            # Only loads in flight read these; forgetting them makes every
+            # such load skip caching, which is safe
+            self._changed = {}
+            self._changed_floor = self._seq
+        cached = self._adjacency.get(user_id)
+        if cached is None:
+            return
+        expires_at, related = cached
+        i = np.searchsorted(related, other_id)
+        present = i < len(related) and related[i] == other_id
+        # Arrays are replaced, never mutated, so callers can keep the ones they hold
+        if add and not present:
+            self._adjacency[user_id] = (expires_at, np.insert(related, i, other_id))
+        elif not add and present:
+            self._adjacency[user_id] = (expires_at, np.delete(related, i))
+
+
+class FriendGraph(RelationshipGraph):
+    def __init__(self, max_users, ttl):
+        super().__init__('accepted', max_users, ttl)
+
+    friend_ids = RelationshipGraph.related_ids
+    are_friends = RelationshipGraph.is_related
+    add_friendship = RelationshipGraph.add_edge
+    remove_friendship = RelationshipGraph.remove_edge
+
+    def friend_count(self, user):
+        return len(self.friend_ids(user))
+
+    def mutual_friend_ids(self, user1, user2):
+        return np.intersect1d(self.friend_ids(user1), self.friend_ids(user2), assume_unique=True)
+
+
+class BlockList(RelationshipGraph):
+    """Users on either side of a block: who `user` blocked and who blocked `user`"""
+
+    def __init__(self, max_users, ttl):
+        super().__init__('blocked', max_users, ttl)
+
+    blocked_ids = RelationshipGraph.related_ids
+    is_blocked = RelationshipGraph.is_related
+
+
+friend_graph = FriendGraph(
+    max_users=getattr(settings, 'FRIEND_GRAPH_MAX_USERS', 100_000),
+    ttl=getattr(settings, 'FRIEND_GRAPH_TTL', 300),
+)
+block_list = BlockList(
+    max_users=getattr(settings, 'BLOCK_LIST_MAX_USERS', 100_000),
+    ttl=getattr(settings, 'BLOCK_LIST_TTL', 300),
+)
@@ -0,0 +1,116 @@
+import random
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from socials.graph import friend_graph
+from socials.models import Relationship
+
+BENCH_PREFIX = 'graph-bench-'
+
+SEED_USERS_SQL = """
+INSERT INTO auth_user (password, is_superuser, username, first_name, last_name, email,
+                       is_staff, is_active, date_joined)
+SELECT '!', false, %(prefix)s || g, '', '', '', false, true, now()
+FROM generate_series(1, %(users)s) g
+"""
+
+# Random accepted friendships among the bench users; reversed duplicates
+# are dropped by the canonical pair constraint
+SEED_FRIENDSHIPS_SQL = """
+INSERT INTO socials_relationship (sender_id, receiver_id, status, created_at, updated_at)
+SELECT a, b, 'accepted', now(), now()
+FROM (
+    SELECT %(first)s + floor(random() * %(users)s)::int AS a,
+           %(first)s + floor(random() * %(users)s)::int AS b
+    FROM generate_series(1, %(edges)s)
+) pairs
+WHERE a <> b
+ON CONFLICT DO NOTHING
+"""
+
+CLEANUP_SQL = """
+DELETE FROM socials_relationship r
+USING auth_user u
+WHERE u.username LIKE %(pattern)s AND u.id IN (r.sender_id, r.receiver_id)
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark friendship checks, friend counts and mutual friends through "
+        "RelationshipManager (SQL) and socials.graph.friend_graph (in memory). With "
+        "--seed, '%s<n>' users with random friendships are created first." % BENCH_PREFIX
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true', help="Create synthetic users and friendships first")
+        parser.add_argument('--users', type=int, default=100_000)
+        parser.add_argument('--degree', type=int, default=50, help="Average friends per synthetic user")
+        parser.add_argument('--runs', type=int, default=2000, help="Timed calls per operation")
+        parser.add_argument('--cleanup', action='store_true', help="Delete the synthetic users and exit")
+
+    def handle(self, *args, **options):
+        bench_users = User.objects.filter(username__startswith=BENCH_PREFIX)
+        if options['cleanup']:
+            # Raw deletes: per-row Relationship signals would replay every unfriend
+            with connection.cursor() as cursor:
+                cursor.execute(CLEANUP_SQL, {'pattern': BENCH_PREFIX + '%'})
+            deleted, _ = bench_users.delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} synthetic row(s)"))
+            return
+
+        if options['seed']:
+            self.seed(options['users'], options['degree'])
+
+        user_ids = list(bench_users.values_list('id', flat=True))
+        if len(user_ids) < 2:
+            self.stdout.write(self.style.ERROR("No synthetic users found, run with --seed first"))
+            return
+        self.stdout.write(f"users: {len(user_ids)}, friendships: {Relationship.objects.count()}")
+
+        rng = random.Random(42)
+        pairs = [tuple(rng.sample(user_ids, 2)) for _ in range(options['runs'])]
+        manager = Relationship.objects
+
+        def sql_mutual(a, b):
+            return set(manager.get_friend_ids(a)) & set(manager.get_friend_ids(b))
+
+        self.report('are_friends    sql', pairs, lambda a, b: manager.are_friends(a, b))
+        self.report('friend count   sql', pairs, lambda a, b: manager.get_friends(a).count())
+        self.report('mutual friends sql', pairs, sql_mutual)
+
+        friend_graph.clear()
+        self.report('are_friends    graph cold', pairs, friend_graph.are_friends)
+        for _, b in pairs:
+            friend_graph.friend_ids(b)
+        self.report('are_friends    graph', pairs, friend_graph.are_friends)
+        self.report('friend count   graph', pairs, lambda a, b: friend_graph.friend_count(a))
+        self.report('mutual friends graph', pairs, friend_graph.mutual_friend_ids)
+
+    def seed(self, users, degree):
+        started = time.perf_counter()
+        with connection.cursor() as cursor:
+            cursor.execute(SEED_USERS_SQL, {'prefix': BENCH_PREFIX, 'users': users})
+            first = User.objects.filter(username__startswith=BENCH_PREFIX).order_by('id').values_list('id', flat=True)[0]
+            cursor.execute(SEED_FRIENDSHIPS_SQL, {
+                'first': first, 'users': users, 'edges': users * degree // 2,
+            })
+            cursor.execute("ANALYZE auth_user")
+            cursor.execute("ANALYZE socials_relationship")
+        self.stdout.write(f"seeded {users} users in {time.perf_counter() - started:.1f}s")
+
+    def report(self, label, pairs, operation):
+        timings = []
+        for a, b in pairs:
+            started = time.perf_counter()
+            operation(a, b)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))]
+        self.stdout.write(
+            f"{label:<28} p50={statistics.median(timings):8.3f}ms p99={p99:8.3f}ms"
+        )
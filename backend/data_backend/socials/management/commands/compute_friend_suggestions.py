@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from socials import recommendations
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute 'people you may know' suggestions. By default only the neighbourhoods "
+        "of users whose friendships changed since the last run are recomputed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help="Recompute every user's suggestions")
+        parser.add_argument('--batch-size', type=int, default=recommendations.BATCH_SIZE,
+                            help="Users scored per sparse-product block")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        if options['full']:
+            written = recommendations.compute_all(batch_size=options['batch_size'])
+            summary = f"Wrote {written} suggestion(s) for every user"
+        else:
+            users, written = recommendations.compute_pending(batch_size=options['batch_size'])
+            summary = f"Wrote {written} suggestion(s) for {users} user(s)"
+        self.stdout.write(self.style.SUCCESS(f"{summary} in {time.perf_counter() - started:.1f}s"))
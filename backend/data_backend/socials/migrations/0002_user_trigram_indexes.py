@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # auth_user belongs to django.contrib.auth, so these indexes are raw SQL.
+        # The full-name expression must stay identical to socials.models.FullName.
+        migrations.RunSQL(
+            sql=[
+                "CREATE INDEX socials_user_username_trgm ON auth_user USING gin (username gin_trgm_ops)",
+                "CREATE INDEX socials_user_fullname_trgm ON auth_user "
+                "USING gin ((first_name || ' ' || last_name) gin_trgm_ops)",
+            ],
+            reverse_sql=[
+                "DROP INDEX IF EXISTS socials_user_username_trgm",
+                "DROP INDEX IF EXISTS socials_user_fullname_trgm",
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0002_user_trigram_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Serves LOWER(username) LIKE 'prefix%' ORDER BY LOWER(username) for the
+        # typeahead. Byte-wise "C" ordering is what text_pattern_ops would give,
+        # but unlike text_pattern_ops it can also satisfy the ORDER BY
+        migrations.RunSQL(
+            sql='CREATE INDEX socials_user_username_prefix ON auth_user '
+                '((LOWER(username) COLLATE "C"), id)',
+            reverse_sql="DROP INDEX IF EXISTS socials_user_username_prefix",
+        ),
+    ]
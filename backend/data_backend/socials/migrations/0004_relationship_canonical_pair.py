@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 06:12
+
+import django.db.models.functions.comparison
+from django.conf import settings
+from django.db import migrations, models
+
+
+# Both directions of a pair could be stored before. Keep one row per pair,
+# preferring blocked over accepted over pending, then the oldest.
+DEDUPLICATE_SQL = """
+DELETE FROM socials_relationship r
+USING socials_relationship o
+WHERE LEAST(o.sender_id, o.receiver_id) = LEAST(r.sender_id, r.receiver_id)
+  AND GREATEST(o.sender_id, o.receiver_id) = GREATEST(r.sender_id, r.receiver_id)
+  AND o.id <> r.id
+  AND (
+      array_position(ARRAY['pending', 'accepted', 'blocked'], o.status::text),
+      -o.id
+  ) > (
+      array_position(ARRAY['pending', 'accepted', 'blocked'], r.status::text),
+      -r.id
+  )
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('socials', '0003_user_username_prefix_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunSQL(DEDUPLICATE_SQL, reverse_sql=migrations.RunSQL.noop),
+        # Generated columns are computed for existing rows when they are added
+        migrations.AddField(
+            model_name='relationship',
+            name='high_user_id',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Greatest('sender', 'receiver'), output_field=models.IntegerField()),
+        ),
+        migrations.AddField(
+            model_name='relationship',
+            name='low_user_id',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.comparison.Least('sender', 'receiver'), output_field=models.IntegerField()),
+        ),
+        migrations.AddIndex(
+            model_name='relationship',
+            index=models.Index(fields=['high_user_id', 'low_user_id'], name='socials_rel_high_pair_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='relationship',
+            constraint=models.UniqueConstraint(fields=('low_user_id', 'high_user_id'), name='socials_relationship_pair_uniq'),
+        ),
+    ]
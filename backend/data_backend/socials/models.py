@@ -1,9 +1,24 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef, Value
+from django.db.models.functions import Cast, Greatest, Least
+from django.contrib.postgres.search import TrigramSimilarity, TrigramWordSimilarity
 
 # Create your models here.
 
+class FullName(models.Func):
+    """
+    first_name || ' ' || last_name, rendered exactly like the expression
+    of the trigram index created in socials/migrations/0002 so it gets used.
+    """
+    template = '(%(expressions)s)'
+    arg_joiner = " || ' ' || "
+    output_field = models.TextField()
+
+    def __init__(self, first_name='first_name', last_name='last_name', **extra):
+        super().__init__(first_name, last_name, **extra)
+
+
 class RelationshipManager(models.Manager):
     def get_user_relationships(self, user):
         """Get all relationships where the user is either sender or receiver"""
@@ -12,29 +27,93 @@ class RelationshipManager(models.Manager):
         )
 
     def get_friends(self, user):
-        """Get all users who have an accepted relationship with the given user"""
-        relationships = self.filter(
-            (Q(sender=user) | Q(receiver=user)) & Q(status='accepted')
+        """Get all users who have an accepted relationship with the given user, in one query"""
+        user_id = getattr(user, 'pk', user)
+        accepted = self.filter(status='accepted').order_by()
+        # UNION ALL rather than OR'd IN clauses, so each side is an index scan
+        friend_ids = accepted.filter(low_user_id=user_id).values('high_user_id').union(
+            accepted.filter(high_user_id=user_id).values('low_user_id'), all=True
         )
-        friends = []
-        for relationship in relationships:
-            if relationship.sender == user:
-                friends.append(relationship.receiver)
-            else:
-                friends.append(relationship.sender)
-        return friends
+        return User.objects.filter(pk__in=friend_ids).order_by('username')
+
+    def between(self, user1, user2):
+        """
+        The relationship between two users whoever sent it, as one seek on the
+        canonical (low_user_id, high_user_id) pair. Either side may be an
+        expression such as OuterRef('user_id').
+        """
+        a, b = getattr(user1, 'pk', user1), getattr(user2, 'pk', user2)
+        if isinstance(a, int) and isinstance(b, int):
+            low, high = min(a, b), max(a, b)
+        else:
+            low, high = Least(a, b), Greatest(a, b)
+        return self.filter(low_user_id=low, high_user_id=high)
+
+    def get_friend_ids(self, user):
+        """Ids of every user with an accepted relationship with the given user, in one query"""
+        return self.get_related_ids(user, 'accepted')
+
+    def get_related_ids(self, user, status):
+        """Ids of every user on the other side of a `status` relationship with the given user"""
+        user_id = getattr(user, 'pk', user)
+        pairs = self.filter(
+            (Q(low_user_id=user_id) | Q(high_user_id=user_id)) & Q(status=status)
+        ).values_list('low_user_id', 'high_user_id')
+        return [high if low == user_id else low for low, high in pairs]
+
+    def get_statuses(self, user, user_ids):
+        """
+        Relationship status of `user` towards each of `user_ids`, in one query:
+        'none', 'pending_sent', 'pending_received', 'accepted' or 'blocked'.
+        """
+        user_id = getattr(user, 'pk', user)
+        statuses = dict.fromkeys(user_ids, 'none')
+        rows = self.filter(
+            Q(sender_id=user_id, receiver_id__in=statuses) |
+            Q(receiver_id=user_id, sender_id__in=statuses)
+        ).values_list('sender_id', 'receiver_id', 'status')
+        for sender_id, receiver_id, status in rows:
+            if status == 'pending':
+                status = 'pending_sent' if sender_id == user_id else 'pending_received'
+            statuses[receiver_id if sender_id == user_id else sender_id] = status
+        return statuses
 
     def get_pending_requests(self, user):
         """Get all pending friend requests received by the user"""
         return self.filter(receiver=user, status='pending')
 
+    def discover_users(self, user, query=None):
+        """
+        Users with no relationship of any kind with `user`, excluded with
+        NOT EXISTS anti-joins. With a query, only fuzzy matches on username or
+        full name are kept: whole-string trigram similarity catches typos and
+        word similarity catches partial input, all served by the GIN trigram
+        indexes. Each row is annotated with its best `similarity`.
+        """
+        # Two NOT EXISTS rather than one OR'd one, so each direction can use
+        # the (sender, receiver) index or a hash anti-join
+        sent = self.filter(sender=user, receiver=OuterRef('pk'))
+        received = self.filter(sender=OuterRef('pk'), receiver=user)
+        users = User.objects.exclude(pk=user.pk).exclude(Exists(sent)).exclude(Exists(received))
+        if not query:
+            return users.annotate(similarity=Value(0.0, output_field=models.FloatField()))
+        return users.alias(full_name=FullName()).filter(
+            Q(username__trigram_similar=query) |
+            Q(username__trigram_word_similar=query) |
+            Q(full_name__trigram_similar=query) |
+            Q(full_name__trigram_word_similar=query)
+        ).annotate(
+            similarity=Cast(Greatest(
+                TrigramSimilarity('username', query),
+                TrigramWordSimilarity(query, 'username'),
+                TrigramSimilarity(FullName(), query),
+                TrigramWordSimilarity(query, FullName()),
+            ), models.FloatField())
+        )
+
     def are_friends(self, user1, user2):
         """Check if two users are friends"""
-        return self.filter(
-            ((Q(sender=user1) & Q(receiver=user2)) |
-             (Q(sender=user2) & Q(receiver=user1))) &
-            Q(status='accepted')
-        ).exists()
+        return self.between(user1, user2).filter(status='accepted').exists()
 
 
 class Relationship(models.Model):
@@ -53,6 +132,17 @@ class Relationship(models.Model):
     status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Direction-free key of the pair, so a<->b lookups need no OR
+    low_user_id = models.GeneratedField(
+        expression=Least('sender', 'receiver'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
+    high_user_id = models.GeneratedField(
+        expression=Greatest('sender', 'receiver'),
+        output_field=models.IntegerField(),
+        db_persist=True,
+    )
 
     # Add custom manager
     objects = RelationshipManager()
@@ -60,6 +150,14 @@ class Relationship(models.Model):
     class Meta:
         unique_together = ['sender', 'receiver']
         ordering = ['-updated_at']
+        constraints = [
+            models.UniqueConstraint(fields=['low_user_id', 'high_user_id'],
+                                    name='socials_relationship_pair_uniq'),
+        ]
+        indexes = [
+            # The unique constraint serves low_user_id lookups, this one the other side
+            models.Index(fields=['high_user_id', 'low_user_id'], name='socials_rel_high_pair_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} -> {self.receiver.username} ({self.get_status_display()})"
@@ -106,13 +204,52 @@ class Relationship(models.Model):
             return None
 
         # Check if there's an existing relationship
-        existing = cls.objects.filter(
-            (Q(sender=from_user) & Q(receiver=to_user)) |
-            (Q(sender=to_user) & Q(receiver=from_user))
-        ).first()
+        existing = cls.objects.between(from_user, to_user).first()
 
         if existing:
             return existing
 
-        # Create new relationship
-        return cls.objects.create(sender=from_user, receiver=to_user)
+        # Create new relationship; the pair constraint settles concurrent requests
+        try:
+            with transaction.atomic():
+                return cls.objects.create(sender=from_user, receiver=to_user)
+        except IntegrityError:
+            return cls.objects.between(from_user, to_user).first()
+
+
+class FriendSuggestionManager(models.Manager):
+    def for_user(self, user):
+        """Stored suggestions for `user`, best first"""
+        return self.filter(user=user).select_related('suggested').order_by('-score', '-mutual_count', 'suggested_id')
+
+
+class FriendSuggestion(models.Model):
+    """
+    "People you may know" rows written by socials.recommendations: users two
+    hops away, scored by their mutual friends weighted by how recent those
+    friendships are.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='friend_suggestions')
+    suggested = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    mutual_count = models.PositiveIntegerField()
+    score = models.FloatField()
+    computed_at = models.DateTimeField(auto_now=True)
+
+    objects = FriendSuggestionManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'suggested'], name='socials_suggestion_pair_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'], name='socials_suggestion_rank_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.suggested_id} for {self.user_id} ({self.mutual_count} mutual)"
+
+
+class SuggestionRefresh(models.Model):
+    """Users whose friendships changed since their suggestions were computed"""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    queued_at = models.DateTimeField(auto_now=True)
@@ -0,0 +1,10 @@
+from django.conf import settings
+
+from data_backend.pagination import KeysetPagination
+
+
+class UserDiscoveryPagination(KeysetPagination):
+    """Best-match-first keyset pagination for user discovery, without COUNT(*)."""
+    ordering = ('-similarity', '-id')
+    page_size = getattr(settings, 'USERS_PAGE_SIZE', 10)
+    max_page_size = getattr(settings, 'USERS_MAX_PAGE_SIZE', 50)
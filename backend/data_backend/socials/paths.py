@@ -0,0 +1,112 @@
+"""
+Degrees of separation between two users.
+
+A bidirectional BFS over accepted Relationship edges (blocked and pending
+rows are never followed). Each step expands the smaller of the two
+frontiers with one query on the canonical pair columns, so a path of
+length d costs about d round trips while each side only explores d/2 hops.
+
+Every search is bounded: FRIEND_PATH_MAX_FRONTIER caps the ids sent per
+query, FRIEND_PATH_MAX_EDGES the rows read per query, and
+FRIEND_PATH_TIMEOUT the wall time, enforced between steps and inside
+Postgres through statement_timeout.
+"""
+import time
+
+from django.conf import settings
+from django.db import connection, transaction, OperationalError
+from django.db.models import Q
+
+from .models import Relationship
+
+MAX_DEPTH = getattr(settings, 'FRIEND_PATH_MAX_DEPTH', 6)
+MAX_FRONTIER = getattr(settings, 'FRIEND_PATH_MAX_FRONTIER', 10_000)
+MAX_EDGES = getattr(settings, 'FRIEND_PATH_MAX_EDGES', 100_000)
+TIMEOUT = getattr(settings, 'FRIEND_PATH_TIMEOUT', 1.0)
+
+
+class SearchLimitExceeded(Exception):
+    pass
+
+
+def shortest_path(source_id, target_id, max_depth=MAX_DEPTH, exclude=()):
+    """
+    Shortest chain of user ids from `source_id` to `target_id`, both ends
+    included, that passes through none of the ids in `exclude`. Returns
+    (path, truncated): path is None when no chain of at most `max_depth`
+    friendships exists, or when a limit stopped the search first
+    (truncated is then True).
+    """
+    if source_id == target_id:
+        return [source_id], False
+    deadline = time.monotonic() + TIMEOUT
+    try:
+        # The savepoint scopes statement_timeout and is what a cancelled
+        # query rolls back to
+        with transaction.atomic():
+            path = _search(source_id, target_id, max_depth, deadline, frozenset(exclude))
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL statement_timeout = DEFAULT")
+        return path, False
+    except OperationalError:
+        # statement_timeout cancelled an expansion
+        return None, True
+    except SearchLimitExceeded:
+        return None, True
+
+
+def _search(source_id, target_id, max_depth, deadline, exclude):
+    parents = ({source_id: None}, {target_id: None})
+    frontiers = ([source_id], [target_id])
+    depth = 0
+    while depth < max_depth and frontiers[0] and frontiers[1]:
+        side = 0 if len(frontiers[0]) <= len(frontiers[1]) else 1
+        own, other = parents[side], parents[1 - side]
+        next_frontier = []
+        for user_id, friend_id in _expand(frontiers[side], deadline):
+            if friend_id in own or friend_id in exclude:
+                continue
+            own[friend_id] = user_id
+            if friend_id in other:
+                return _join(parents, friend_id)
+            next_frontier.append(friend_id)
+        frontiers = (next_frontier, frontiers[1]) if side == 0 else (frontiers[0], next_frontier)
+        depth += 1
+    return None
+
+
+def _expand(frontier, deadline):
+    """(frontier user, friend) for every accepted edge of the frontier, in one query"""
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or len(frontier) > MAX_FRONTIER:
+        raise SearchLimitExceeded
+    with connection.cursor() as cursor:
+        cursor.execute("SET LOCAL statement_timeout = %s", [max(int(remaining * 1000), 1)])
+    edges = list(
+        Relationship.objects.filter(status='accepted')
+        .filter(Q(low_user_id__in=frontier) | Q(high_user_id__in=frontier))
+        .order_by().values_list('low_user_id', 'high_user_id')[:MAX_EDGES + 1]
+    )
+    if len(edges) > MAX_EDGES:
+        raise SearchLimitExceeded
+    members = set(frontier)
+    for low, high in edges:
+        if low in members:
+            yield low, high
+        if high in members:
+            yield high, low
+
+
+def _join(parents, meeting_id):
+    forward, backward = parents
+    path = []
+    user_id = meeting_id
+    while user_id is not None:
+        path.append(user_id)
+        user_id = forward[user_id]
+    path.reverse()
+    user_id = backward[meeting_id]
+    while user_id is not None:
+        path.append(user_id)
+        user_id = backward[user_id]
+    return path
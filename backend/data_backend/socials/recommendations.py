@@ -0,0 +1,212 @@
+"""
+"People you may know".
+
+Accepted friendships form a symmetric sparse adjacency matrix A, held as
+CSR arrays (indptr/indices/weights) in NumPy. Row u of A·A lists every user
+two hops from u; the number of paths is the mutual-friend count. Each edge
+is weighted by the age of the friendship (half-life
+FRIEND_SUGGESTIONS_HALF_LIFE_DAYS, floored at 0.5), so the weighted product
+ranks users with recent mutual connections first. Pairs that already have
+a Relationship row of any status (friends, pending, blocked) are masked
+out, and the top FRIEND_SUGGESTIONS_PER_USER candidates per user are
+stored in FriendSuggestion.
+
+`compute_all` rebuilds every user's suggestions. Relationship changes
+queue both users in SuggestionRefresh (see socials/signals.py) and
+`compute_pending` then recomputes only their neighbourhoods: the queued
+users and their friends, which are the only rows of A·A an edge change
+can affect.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Relationship, FriendSuggestion, SuggestionRefresh
+
+SUGGESTIONS_PER_USER = getattr(settings, 'FRIEND_SUGGESTIONS_PER_USER', 50)
+HALF_LIFE = timedelta(days=getattr(settings, 'FRIEND_SUGGESTIONS_HALF_LIFE_DAYS', 90))
+BATCH_SIZE = getattr(settings, 'FRIEND_SUGGESTIONS_BATCH_SIZE', 1000)
+
+
+class Adjacency:
+    """Symmetric CSR adjacency over the users of the given edges, indexed 0..n-1"""
+
+    def __init__(self, edges, now):
+        low = np.fromiter((e[0] for e in edges), dtype=np.int64, count=len(edges))
+        high = np.fromiter((e[1] for e in edges), dtype=np.int64, count=len(edges))
+        age_days = np.fromiter(((now - e[2]).total_seconds() / 86400 for e in edges),
+                               dtype=np.float64, count=len(edges))
+        weight = 0.5 + 0.5 * np.exp2(-np.maximum(age_days, 0) / (HALF_LIFE.total_seconds() / 86400))
+
+        self.user_ids, local = np.unique(np.concatenate([low, high]), return_inverse=True)
+        rows = local  # both directions: low->high then high->low
+        cols = np.concatenate([local[len(edges):], local[:len(edges)]])
+        weights = np.concatenate([weight, weight])
+
+        order = np.argsort(rows, kind='stable')
+        self.indices = cols[order]
+        self.weights = weights[order]
+        self.indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=len(self.user_ids)), out=self.indptr[1:])
+
+    def expand(self, rows):
+        """
+        One hop from each of `rows`: (source row, neighbour, edge weight) for
+        every edge, in the same order as `rows`.
+        """
+        starts, ends = self.indptr[rows], self.indptr[rows + 1]
+        positions = _ranges(starts, ends - starts)
+        return np.repeat(rows, ends - starts), self.indices[positions], self.weights[positions]
+
+
+def _ranges(starts, lengths):
+    """Concatenation of arange(start, start + length) for each pair, vectorized"""
+    total = int(lengths.sum())
+    if not total:
+        return np.zeros(0, dtype=np.int64)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total, dtype=np.int64)
+
+
+def score_rows(adjacency, rows, excluded):
+    """
+    Top candidates for each of `rows` from the rows of A·A, as
+    (user_id, suggested_id, mutual_count, score) arrays. `excluded` holds
+    the global (user_id, other_id) pairs to mask, encoded with _pair_keys.
+    """
+    n = len(adjacency.user_ids)
+    source, friend, first_weight = adjacency.expand(rows)
+    # Second hop: friends of each friend, carrying the source along
+    degrees = adjacency.indptr[friend + 1] - adjacency.indptr[friend]
+    positions = _ranges(adjacency.indptr[friend], degrees)
+    source = np.repeat(source, degrees)
+    candidate = adjacency.indices[positions]
+    weight = np.repeat(first_weight, degrees) * adjacency.weights[positions]
+
+    keep = candidate != source
+    source, candidate, weight = source[keep], candidate[keep], weight[keep]
+    keys, inverse = np.unique(source * n + candidate, return_inverse=True)
+    mutual_count = np.bincount(inverse)
+    score = np.bincount(inverse, weights=weight)
+
+    user_id = adjacency.user_ids[keys // n]
+    suggested_id = adjacency.user_ids[keys % n]
+    keep = ~_contains(excluded, _pair_keys(user_id, suggested_id))
+    user_id, suggested_id = user_id[keep], suggested_id[keep]
+    mutual_count, score = mutual_count[keep], score[keep]
+
+    # Best first within each user, then cut every user to the top N. The sort
+    # is stable and rows come out of np.unique by suggested id, which breaks ties
+    order = np.lexsort((-mutual_count, -score, user_id))
+    user_id, suggested_id = user_id[order], suggested_id[order]
+    mutual_count, score = mutual_count[order], score[order]
+    first = np.searchsorted(user_id, user_id, side='left')
+    keep = np.arange(len(user_id)) - first < SUGGESTIONS_PER_USER
+    return user_id[keep], suggested_id[keep], mutual_count[keep], score[keep]
+
+
+def _contains(sorted_keys, keys):
+    """np.isin for a sorted, unique haystack, without re-sorting it every batch"""
+    if not len(sorted_keys):
+        return np.zeros(len(keys), dtype=bool)
+    positions = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return sorted_keys[positions] == keys
+
+
+def _pair_keys(a, b):
+    return (np.asarray(a, dtype=np.int64) << 32) | np.asarray(b, dtype=np.int64)
+
+
+def _excluded_pairs(user_ids=None):
+    """Both directions of every Relationship row, optionally only those touching `user_ids`"""
+    relationships = Relationship.objects.order_by()
+    if user_ids is not None:
+        relationships = relationships.filter(Q(low_user_id__in=user_ids) | Q(high_user_id__in=user_ids))
+    pairs = np.array(list(relationships.values_list('low_user_id', 'high_user_id')),
+                     dtype=np.int64).reshape(-1, 2)
+    return np.unique(np.concatenate([
+        _pair_keys(pairs[:, 0], pairs[:, 1]), _pair_keys(pairs[:, 1], pairs[:, 0]),
+    ]))
+
+
+def _accepted_edges(user_ids=None):
+    edges = Relationship.objects.filter(status='accepted').order_by()
+    if user_ids is not None:
+        edges = edges.filter(Q(low_user_id__in=user_ids) | Q(high_user_id__in=user_ids))
+    return list(edges.values_list('low_user_id', 'high_user_id', 'updated_at'))
+
+
+# One statement per batch: the arrays are unnested server-side instead of
+# building a model instance per row
+INSERT_SQL = """
+INSERT INTO socials_friendsuggestion (user_id, suggested_id, mutual_count, score, computed_at)
+SELECT user_id, suggested_id, mutual_count, score, now()
+FROM unnest(%s::int[], %s::int[], %s::int[], %s::float8[])
+    AS s (user_id, suggested_id, mutual_count, score)
+"""
+
+
+def _write(adjacency, rows, excluded, batch_size):
+    written = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            columns = score_rows(adjacency, rows[start:start + batch_size], excluded)
+            cursor.execute(INSERT_SQL, [column.tolist() for column in columns])
+            written += len(columns[0])
+    return written
+
+
+def compute_all(batch_size=BATCH_SIZE):
+    """Recompute every user's suggestions. Returns the number of rows written."""
+    started = timezone.now()
+    adjacency = Adjacency(_accepted_edges(), started)
+    excluded = _excluded_pairs()
+    with transaction.atomic():
+        FriendSuggestion.objects.all().delete()
+        written = _write(adjacency, np.arange(len(adjacency.user_ids)), excluded, batch_size)
+        SuggestionRefresh.objects.filter(queued_at__lte=started).delete()
+    return written
+
+
+def compute_pending(batch_size=BATCH_SIZE):
+    """
+    Recompute suggestions around the users queued in SuggestionRefresh.
+    Returns (users recomputed, rows written).
+    """
+    started = timezone.now()
+    queued = list(SuggestionRefresh.objects.filter(queued_at__lte=started).values_list('user_id', flat=True))
+    if not queued:
+        return 0, 0
+
+    # Sources: the queued users and their friends. Their rows of A·A need
+    # their own edges and their friends' edges.
+    sources = set(queued)
+    for low, high, _ in _accepted_edges(queued):
+        sources.update((low, high))
+    source_edges = _accepted_edges(sorted(sources))
+    neighbours = {user_id for edge in source_edges for user_id in edge[:2]}
+    adjacency = Adjacency(_accepted_edges(sorted(neighbours)) if neighbours else [], started)
+
+    sources = sorted(sources)
+    rows = np.flatnonzero(np.isin(adjacency.user_ids, sources))
+    excluded = _excluded_pairs(sources)
+    with transaction.atomic():
+        FriendSuggestion.objects.filter(user_id__in=sources).delete()
+        written = _write(adjacency, rows, excluded, batch_size)
+        SuggestionRefresh.objects.filter(user_id__in=queued, queued_at__lte=started).delete()
+    return len(sources), written
+
+
+def queue_refresh(*user_ids):
+    # Users may have been deleted since the change was made (their
+    # relationships cascade first)
+    user_ids = User.objects.filter(pk__in=user_ids).values_list('pk', flat=True)
+    SuggestionRefresh.objects.bulk_create(
+        [SuggestionRefresh(user_id=user_id) for user_id in user_ids],
+        update_conflicts=True, update_fields=['queued_at'], unique_fields=['user'],
+    )
@@ -2,7 +2,6 @@ from rest_framework import serializers
 from django.contrib.auth.models import User
 from .models import Relationship
 from authentification.serializers import UserSerializer
-from django.db.models import Q
 
 class RelationshipSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
@@ -23,6 +22,14 @@ class RelationshipSerializer(serializers.ModelSerializer):
         read_only_fields=['created_at', 'updated_at']
 
 
+class PublicUserSerializer(serializers.ModelSerializer):
+    """What anyone may see of another user: no email"""
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'first_name', 'last_name']
+        read_only_fields = fields
+
+
 class RelationshipActionSerializer(serializers.Serializer):
     user_id = serializers.IntegerField()
 
@@ -38,10 +45,7 @@ class UserSearchSerializer(UserSerializer):  # Extends your existing UserSeriali
         if not request or not request.user.is_authenticated:
             return None
 
-        # Check existing relationships with correct comparison operators
-        relationship = Relationship.objects.filter(
-            Q(sender=request.user, receiver=obj) |
-            Q(sender=obj, receiver=request.user)
-        ).first()
-
-        return relationship.status if relationship else 'none'
+        # Views resolve the whole page at once with Relationship.objects.get_statuses
+        if (statuses := self.context.get('relationship_statuses')) is not None and obj.pk in statuses:
+            return statuses[obj.pk]
+        return Relationship.objects.get_statuses(request.user, [obj.pk])[obj.pk]
@@ -0,0 +1,49 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .graph import friend_graph, block_list
+from .models import Relationship
+from .recommendations import queue_refresh
+from .typeahead import suggestions
+
+
+@receiver(post_save, sender=User)
+def refresh_typeahead_on_save(sender, instance, **kwargs):
+    suggestions.user_changed(instance)
+
+
+@receiver(post_delete, sender=User)
+def refresh_typeahead_on_delete(sender, instance, **kwargs):
+    suggestions.user_deleted(instance.pk)
+
+
+# Only committed changes reach the graphs; every update is idempotent
+@receiver(post_save, sender=Relationship)
+def refresh_graphs_on_save(sender, instance, **kwargs):
+    users = (instance.sender_id, instance.receiver_id)
+
+    def update():
+        for graph in (friend_graph, block_list):
+            if instance.status == graph.status:
+                graph.add_edge(*users)
+            else:
+                graph.remove_edge(*users)
+    transaction.on_commit(update)
+
+
+@receiver(post_delete, sender=Relationship)
+def refresh_graphs_on_delete(sender, instance, **kwargs):
+    users = (instance.sender_id, instance.receiver_id)
+
+    def update():
+        friend_graph.remove_edge(*users)
+        block_list.remove_edge(*users)
+    transaction.on_commit(update)
+
+
+@receiver(post_save, sender=Relationship)
+@receiver(post_delete, sender=Relationship)
+def queue_suggestion_refresh(sender, instance, **kwargs):
+    transaction.on_commit(lambda: queue_refresh(instance.sender_id, instance.receiver_id))
@@ -1,3 +1,368 @@
+import unittest.mock
+from datetime import timedelta
+
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.contrib.auth.models import User
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework import status
+from .models import Relationship, FriendSuggestion
+from . import paths, recommendations
+from .graph import friend_graph, block_list
+from .typeahead import PrefixTrie, suggestions
+from .views import FriendViewSet, RelationshipViewSet, UserSearchViewSet
+
+
+class UserDiscoveryTestCase(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user(username='searcher', password='password123')
+        self.friend = User.objects.create_user(username='ahmed_friend', first_name='Ahmed', last_name='Friend')
+        self.pending = User.objects.create_user(username='ahmed_pending', first_name='Ahmed', last_name='Pending')
+        self.stranger = User.objects.create_user(username='ahmedb', first_name='Ahmed', last_name='Bargaoui')
+        self.other = User.objects.create_user(username='zoe', first_name='Zoe', last_name='Martin')
+        Relationship.send_request(self.me, self.friend).accept()
+        Relationship.send_request(self.pending, self.me)
+        self.factory = APIRequestFactory()
+
+    def search(self, url):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.me)
+        return UserSearchViewSet.as_view({'get': 'list'})(request)
+
+    def test_existing_relationships_are_excluded(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.search('/api/users/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {user['id'] for user in response.data['results']}
+        self.assertEqual(ids, {self.stranger.id, self.other.id})
+        self.assertEqual({user['relationship_status'] for user in response.data['results']}, {'none'})
+        # The page is the only query; statuses are known without a lookup
+        self.assertEqual(len(ctx.captured_queries), 1)
+
+    def test_fuzzy_match_on_username_and_full_name(self):
+        # Typo in the username still finds the user
+        response = self.search('/api/users/?search=ahmdb')
+        self.assertEqual([u['id'] for u in response.data['results']], [self.stranger.id])
+
+        response = self.search('/api/users/?search=Zoe Martin')
+        self.assertEqual([u['id'] for u in response.data['results']], [self.other.id])
+
+    def test_results_are_keyset_paginated(self):
+        for i in range(5):
+            User.objects.create_user(username=f'discover{i}')
+        seen = []
+        url = '/api/users/?page_size=2'
+        while url:
+            response = self.search(url)
+            self.assertNotIn('count', response.data)
+            seen.extend(u['id'] for u in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(len(seen), 7)
+        self.assertEqual(len(set(seen)), 7)
+
+
+class CanonicalPairTestCase(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username='alice')
+        self.bob = User.objects.create_user(username='bob')
+        self.carol = User.objects.create_user(username='carol')
+
+    def test_pair_is_unique_in_both_directions(self):
+        relationship = Relationship.send_request(self.bob, self.alice)
+        self.assertEqual((relationship.low_user_id, relationship.high_user_id), (self.alice.id, self.bob.id))
+        self.assertEqual(Relationship.send_request(self.alice, self.bob), relationship)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Relationship.objects.create(sender=self.alice, receiver=self.bob)
+
+    def test_friend_lookups(self):
+        Relationship.send_request(self.bob, self.alice).accept()
+        Relationship.send_request(self.alice, self.carol).accept()
+        Relationship.send_request(self.bob, self.carol)
+
+        self.assertTrue(Relationship.objects.are_friends(self.alice, self.bob))
+        self.assertFalse(Relationship.objects.are_friends(self.carol, self.bob))
+        with self.assertNumQueries(1):
+            friends = list(Relationship.objects.get_friends(self.alice))
+        self.assertEqual(friends, [self.bob, self.carol])
+        self.assertEqual(sorted(Relationship.objects.get_friend_ids(self.carol)), [self.alice.id])
+
+
+class FriendGraphTestCase(TestCase):
+    def setUp(self):
+        friend_graph.clear()
+        self.alice, self.bob, self.carol, self.dave = (
+            User.objects.create_user(username=name) for name in ('alice', 'bob', 'carol', 'dave')
+        )
+        Relationship.send_request(self.alice, self.bob).accept()
+        Relationship.send_request(self.carol, self.alice).accept()
+        Relationship.send_request(self.bob, self.carol).accept()
+        Relationship.send_request(self.dave, self.alice)
+
+    def tearDown(self):
+        friend_graph.clear()
+
+    def test_queries_are_answered_from_memory_once_loaded(self):
+        friend_graph.friend_ids(self.alice)
+        friend_graph.friend_ids(self.bob)
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(self.alice, self.carol))
+            self.assertFalse(friend_graph.are_friends(self.alice, self.dave))
+            self.assertEqual(friend_graph.friend_count(self.alice), 2)
+            self.assertEqual(friend_graph.mutual_friend_ids(self.alice, self.bob).tolist(), [self.carol.id])
+
+    def test_committed_changes_are_applied_in_place(self):
+        friend_graph.friend_ids(self.alice)
+        pending = Relationship.objects.between(self.alice, self.dave).get()
+        friendship = Relationship.objects.between(self.alice, self.bob).get()
+        with self.captureOnCommitCallbacks(execute=True):
+            pending.accept()
+            friendship.unfriend()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(friend_graph.friend_ids(self.alice).tolist(), sorted([self.carol.id, self.dave.id]))
+
+    def test_blocking_moves_the_pair_between_graphs(self):
+        block_list.clear()
+        friend_graph.friend_ids(self.alice)
+        block_list.blocked_ids(self.alice)
+        friendship = Relationship.objects.between(self.alice, self.bob).get()
+        with self.captureOnCommitCallbacks(execute=True):
+            friendship.block()
+        with self.assertNumQueries(0):
+            self.assertFalse(friend_graph.are_friends(self.alice, self.bob))
+            self.assertTrue(block_list.is_blocked(self.alice, self.bob))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            friendship.unblock()
+        with self.assertNumQueries(0):
+            self.assertTrue(friend_graph.are_friends(self.alice, self.bob))
+            self.assertEqual(block_list.blocked_ids(self.alice).tolist(), [])
+        block_list.clear()
+
+    def test_mutual_friends_endpoint(self):
+        request = APIRequestFactory().get(f'/api/friends/mutual/{self.bob.id}/')
+        force_authenticate(request, user=self.alice)
+        response = FriendViewSet.as_view({'get': 'mutual'})(request, user_id=self.bob.id)
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual([u['id'] for u in response.data['results']], [self.carol.id])
+
+
+class FriendSuggestionTestCase(TestCase):
+    def setUp(self):
+        names = ('me', 'f1', 'f2', 'f3', 'two_mutual', 'one_mutual', 'pending', 'blocked')
+        self.users = {name: User.objects.create_user(username=name) for name in names}
+        with self.captureOnCommitCallbacks(execute=True):
+            for a, b in [('me', 'f1'), ('me', 'f2'), ('me', 'f3'), ('f1', 'two_mutual'), ('f2', 'two_mutual'),
+                         ('f3', 'one_mutual'), ('f1', 'pending'), ('f2', 'blocked')]:
+                self.befriend(a, b)
+            Relationship.send_request(self.users['me'], self.users['pending'])
+            Relationship.send_request(self.users['blocked'], self.users['me']).block()
+
+    def befriend(self, a, b):
+        Relationship.send_request(self.users[a], self.users[b]).accept()
+
+    def suggested(self, name):
+        return [(s.suggested.username, s.mutual_count) for s in FriendSuggestion.objects.for_user(self.users[name])]
+
+    def test_full_run_ranks_by_mutual_friends_and_recency(self):
+        # An old mutual connection counts less than a fresh one
+        Relationship.objects.between(self.users['f1'], self.users['pending']) \
+            .update(updated_at=timezone.now() - timedelta(days=365))
+        recommendations.compute_all()
+        # f-users are friends already; pending and blocked pairs are masked
+        self.assertEqual(self.suggested('me'), [('two_mutual', 2), ('one_mutual', 1)])
+        self.assertEqual(self.suggested('two_mutual'), [('me', 2), ('blocked', 1), ('pending', 1)])
+
+    def test_incremental_run_only_touches_changed_neighbourhoods(self):
+        recommendations.compute_all()
+        newcomer = User.objects.create_user(username='newcomer')
+        self.users['newcomer'] = newcomer
+        with self.captureOnCommitCallbacks(execute=True):
+            self.befriend('one_mutual', 'newcomer')
+
+        users, _ = recommendations.compute_pending()
+        # one_mutual, newcomer and one_mutual's friend f3
+        self.assertEqual(users, 3)
+        self.assertCountEqual(self.suggested('f3'), [('f1', 1), ('f2', 1), ('newcomer', 1)])
+        self.assertEqual(self.suggested('me'), [('two_mutual', 2), ('one_mutual', 1)])
+        self.assertEqual(recommendations.compute_pending(), (0, 0))
+
+    def test_suggestions_endpoint_drops_users_related_since(self):
+        recommendations.compute_all()
+        Relationship.send_request(self.users['me'], self.users['one_mutual'])
+        request = APIRequestFactory().get('/api/friends/suggestions/')
+        force_authenticate(request, user=self.users['me'])
+        response = FriendViewSet.as_view({'get': 'suggestions'})(request)
+        self.assertEqual([(u['username'], u['mutual_count']) for u in response.data], [('two_mutual', 2)])
+
+
+class FriendPathTestCase(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'u{i}') for i in range(6)]
+        # u0 - u1 - u2 - u3 - u4, plus a blocked shortcut u0 x u3 and a pending u1 -> u4
+        for a, b in [(0, 1), (1, 2), (2, 3), (3, 4)]:
+            Relationship.send_request(self.users[a], self.users[b]).accept()
+        Relationship.send_request(self.users[0], self.users[3]).block()
+        Relationship.send_request(self.users[1], self.users[4])
+        self.factory = APIRequestFactory()
+        block_list.clear()
+
+    def tearDown(self):
+        block_list.clear()
+
+    def ids(self, *indexes):
+        return [self.users[i].id for i in indexes]
+
+    def test_shortest_path_skips_blocked_and_pending_edges(self):
+        path, truncated = paths.shortest_path(self.users[0].id, self.users[4].id)
+        self.assertEqual(path, self.ids(0, 1, 2, 3, 4))
+        self.assertFalse(truncated)
+        self.assertEqual(paths.shortest_path(self.users[0].id, self.users[4].id, max_depth=3), (None, False))
+        self.assertEqual(paths.shortest_path(self.users[0].id, self.users[5].id), (None, False))
+
+    def test_limits_truncate_the_search(self):
+        with unittest.mock.patch.object(paths, 'MAX_EDGES', 1):
+            self.assertEqual(paths.shortest_path(self.users[0].id, self.users[4].id), (None, True))
+
+    def test_path_endpoint(self):
+        view = RelationshipViewSet.as_view({'get': 'path'})
+        request = self.factory.get(f'/api/relationships/path/{self.users[3].id}/')
+        force_authenticate(request, user=self.users[1])
+        response = view(request, user_id=self.users[3].id)
+        self.assertEqual(response.data['degrees'], 2)
+        self.assertEqual([u['id'] for u in response.data['path']], self.ids(1, 2, 3))
+        self.assertNotIn('email', response.data['path'][0])
+
+        # No path is disclosed between users who blocked each other
+        request = self.factory.get(f'/api/relationships/path/{self.users[3].id}/')
+        force_authenticate(request, user=self.users[0])
+        self.assertEqual(view(request, user_id=self.users[3].id).status_code, status.HTTP_404_NOT_FOUND)
+        # ...nor one that runs through someone on the other side of a block
+        request = self.factory.get(f'/api/relationships/path/{self.users[4].id}/')
+        force_authenticate(request, user=self.users[0])
+        self.assertEqual(view(request, user_id=self.users[4].id).status_code, status.HTTP_404_NOT_FOUND)
+
+        for max_depth in ('-1', 'two', ''):
+            request = self.factory.get(f'/api/relationships/path/{self.users[3].id}/', {'max_depth': max_depth})
+            force_authenticate(request, user=self.users[1])
+            self.assertEqual(view(request, user_id=self.users[3].id).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RelationshipStatusTestCase(TestCase):
+    def setUp(self):
+        self.me = User.objects.create_user(username='me')
+        self.friend = User.objects.create_user(username='friend')
+        self.asked = User.objects.create_user(username='asked')
+        self.asker = User.objects.create_user(username='asker')
+        self.blocked = User.objects.create_user(username='blocked')
+        self.stranger = User.objects.create_user(username='stranger')
+        Relationship.send_request(self.me, self.friend).accept()
+        Relationship.send_request(self.me, self.asked)
+        Relationship.send_request(self.asker, self.me)
+        Relationship.send_request(self.blocked, self.me).block()
+        self.factory = APIRequestFactory()
+
+    def test_statuses_are_resolved_in_one_query(self):
+        ids = [self.friend.id, self.asked.id, self.asker.id, self.blocked.id, self.stranger.id]
+        with self.assertNumQueries(1):
+            statuses = Relationship.objects.get_statuses(self.me, ids)
+        self.assertEqual(statuses, {
+            self.friend.id: 'accepted',
+            self.asked.id: 'pending_sent',
+            self.asker.id: 'pending_received',
+            self.blocked.id: 'blocked',
+            self.stranger.id: 'none',
+        })
+
+    def test_status_endpoint(self):
+        view = RelationshipViewSet.as_view({'get': 'statuses'})
+        request = self.factory.get('/api/relationships/status/', {'ids': f'{self.asked.id},{self.stranger.id}'})
+        force_authenticate(request, user=self.me)
+        response = view(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {str(self.asked.id): 'pending_sent', str(self.stranger.id): 'none'})
+
+        request = self.factory.get('/api/relationships/status/', {'ids': 'a,b'})
+        force_authenticate(request, user=self.me)
+        self.assertEqual(view(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UsernameTypeaheadTestCase(TestCase):
+    def setUp(self):
+        suggestions.clear()
+        self.me = User.objects.create_user(username='searcher')
+        self.alice = User.objects.create_user(username='Alice', first_name='Alice', last_name='Smith')
+        self.alan = User.objects.create_user(username='alan')
+        User.objects.create_user(username='bob')
+        self.factory = APIRequestFactory()
+
+    def tearDown(self):
+        suggestions.clear()
+
+    def suggest(self, q, **params):
+        request = self.factory.get('/api/users/suggest/', {'q': q, **params})
+        force_authenticate(request, user=self.me)
+        return UserSearchViewSet.as_view({'get': 'suggest'})(request)
+
+    def test_prefix_match_is_case_insensitive_and_ordered(self):
+        response = self.suggest('AL')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, [
+            {'id': self.alan.id, 'username': 'alan', 'display_name': 'alan'},
+            {'id': self.alice.id, 'username': 'Alice', 'display_name': 'Alice Smith'},
+        ])
+        self.assertEqual(len(self.suggest('al', limit=1).data), 1)
+        self.assertEqual(self.suggest('').data, [])
+
+    def test_cached_prefixes_follow_user_changes(self):
+        self.suggest('al')
+        with self.assertNumQueries(0):
+            self.suggest('al')
+
+        albert = User.objects.create_user(username='albert')
+        self.alice.username = 'zalice'
+        self.alice.save()
+        self.alan.is_active = False
+        self.alan.save()
+
+        with self.assertNumQueries(0):
+            response = self.suggest('al')
+        self.assertEqual([u['id'] for u in response.data], [albert.id])
+
+    def test_evicted_prefixes_release_their_nodes_and_names(self):
+        for username in ('carol', 'dave', 'erin', 'frank'):
+            User.objects.create_user(username=username)
+        trie = PrefixTrie(limit=10, max_prefixes=2, max_prefix_length=4, ttl=60)
+
+        def node_count(node):
+            return 1 + sum(node_count(child) for child in node.children.values())
+
+        for prefix in ('alan', 'alic', 'bob', 'caro', 'dave', 'erin', 'fran', 'se'):
+            trie.suggest(prefix)
+        # Only the last two lists and the paths to them are left
+        self.assertEqual(list(trie._lru), ['fran', 'se'])
+        self.assertEqual(node_count(trie._root), 1 + 4 + 2)
+        self.assertEqual(set(trie._names), {entry[1] for node in trie._lru.values() for entry in node.entries})
+
+        frank = User.objects.get(username='frank')
+        trie.user_deleted(frank.pk)
+        self.assertNotIn(frank.pk, trie._names)
+
+    def test_blocked_users_are_hidden_both_ways(self):
+        block_list.clear()
+        Relationship.send_request(self.alan, self.me).block()
+        self.assertEqual([u['id'] for u in self.suggest('al').data], [self.alice.id])
+        block_list.clear()
 
-# Create your tests here.
+    def test_blocked_users_do_not_shorten_a_full_list(self):
+        block_list.clear()
+        # al0..al9 sort before alan and alice and fill the cached top ten
+        early = [User.objects.create_user(username=f'al{i}') for i in range(10)]
+        for user in early[:3]:
+            Relationship.send_request(self.me, user).block()
+        expected = [user.id for user in early[3:]] + [self.alan.id, self.alice.id]
+        self.assertEqual([u['id'] for u in self.suggest('al', limit=10).data], expected[:10])
+        self.assertEqual([u['id'] for u in self.suggest('al0').data], [])
+        block_list.clear()
@@ -0,0 +1,220 @@
+"""
+Username typeahead.
+
+Suggestions come from the lower(username) COLLATE "C" prefix index
+(socials/migrations/0003), fronted by a per-process trie that caches the
+top results of hot, short prefixes. User saves and deletes are applied to
+the cached prefixes in place (see socials/signals.py); a TTL bounds how
+stale other processes can get.
+"""
+import bisect
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models.functions import Collate, Lower
+
+
+def display_name(first_name, last_name, username):
+    return f"{first_name} {last_name}".strip() or username
+
+
+def query_suggestions(prefix, limit, exclude=()):
+    """Active users whose lower-cased username starts with `prefix`, as sorted entry tuples"""
+    # COLLATE "C" matches the index, so the prefix LIKE becomes a range scan and
+    # the ORDER BY is read off the index whatever the database collation is
+    users = User.objects.filter(is_active=True)
+    if exclude:
+        users = users.exclude(id__in=list(exclude))
+    rows = users \
+        .annotate(username_lower=Collate(Lower('username'), 'C')) \
+        .filter(username_lower__startswith=prefix).order_by('username_lower', 'id') \
+        .values_list('username_lower', 'id', 'username', 'first_name', 'last_name')[:limit]
+    return [
+        (username_lower, user_id, username, display_name(first_name, last_name, username))
+        for username_lower, user_id, username, first_name, last_name in rows
+    ]
+
+
+class _Node:
+    __slots__ = ('children', 'entries', 'expires_at')
+
+    def __init__(self):
+        self.children = {}
+        self.entries = None
+        self.expires_at = 0.0
+
+
+class PrefixTrie:
+    """
+    Trie of hot prefixes. Only nodes that were looked up hold an entry list
+    (the top `limit` (username_lower, id, username, display_name) tuples in
+    index order); at most `max_prefixes` lists are kept, least recently used
+    first out. Evicting a list also drops the nodes and user names only it
+    was keeping, so memory stays bounded by `max_prefixes`.
+    """
+
+    def __init__(self, limit, max_prefixes, max_prefix_length, ttl):
+        self.limit = limit
+        self.max_prefixes = max_prefixes
+        self.max_prefix_length = max_prefix_length
+        self.ttl = ttl
+        self._root = _Node()
+        self._lru = OrderedDict()
+        self._names = {}  # user id -> [lower-cased username, number of cached lists holding it]
+        self._lock = threading.Lock()
+
+    def suggest(self, prefix, limit=None, exclude=()):
+        """The first `limit` entries for `prefix`, leaving out the user ids in `exclude`"""
+        limit = min(limit or self.limit, self.limit)
+        if len(prefix) > self.max_prefix_length:
+            return query_suggestions(prefix, limit, exclude)
+        with self._lock:
+            entries = self._get(prefix)
+        if entries is None:
+            entries = query_suggestions(prefix, self.limit)
+            with self._lock:
+                self._put(prefix, entries)
+        if exclude:
+            visible = [entry for entry in entries if entry[1] not in exclude]
+            if len(visible) < limit and len(entries) == self.limit:
+                # The cached list is full, so more matches may follow it in the
+                # database; cached lists are shared, so ask past them directly
+                return query_suggestions(prefix, limit, exclude)
+            entries = visible
+        return entries[:limit]
+
+    def user_changed(self, user):
+        with self._lock:
+            self._remove(user.pk)
+            if user.is_active:
+                self._insert((user.username.lower(), user.pk, user.username,
+                              display_name(user.first_name, user.last_name, user.username)))
+
+    def user_deleted(self, user_id):
+        with self._lock:
+            self._remove(user_id)
+
+    def clear(self):
+        with self._lock:
+            self._root = _Node()
+            self._lru.clear()
+            self._names.clear()
+
+    def _walk(self, prefix, create=False):
+        node = self._root
+        for char in prefix:
+            child = node.children.get(char)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[char] = _Node()
+            node = child
+        return node
+
+    def _cached_nodes(self, username_lower):
+        """Cached nodes along the path of `username_lower`, shortest prefix first"""
+        node = self._root
+        for length, char in enumerate(username_lower[:self.max_prefix_length], start=1):
+            node = node.children.get(char)
+            if node is None:
+                return
+            if node.entries is not None:
+                yield username_lower[:length], node
+
+    def _get(self, prefix):
+        node = self._walk(prefix)
+        if node is None or node.entries is None:
+            return None
+        if node.expires_at < time.monotonic():
+            self._evict(prefix)
+            return None
+        self._lru.move_to_end(prefix)
+        return node.entries
+
+    def _put(self, prefix, entries):
+        node = self._walk(prefix, create=True)
+        for entry in node.entries or ():
+            self._unref(entry[1])
+        node.entries = entries
+        node.expires_at = time.monotonic() + self.ttl
+        self._lru[prefix] = node
+        self._lru.move_to_end(prefix)
+        for entry in entries:
+            self._ref(entry)
+        while len(self._lru) > self.max_prefixes:
+            self._evict(next(iter(self._lru)))
+
+    def _evict(self, prefix):
+        node = self._lru.pop(prefix, None)
+        if node is None:
+            return
+        for entry in node.entries:
+            self._unref(entry[1])
+        node.entries = None
+        self._prune(prefix)
+
+    def _prune(self, prefix):
+        """Drop the nodes along `prefix`, deepest first, that hold no list and lead to none"""
+        path = [self._root]
+        for char in prefix:
+            node = path[-1].children.get(char)
+            if node is None:
+                return
+            path.append(node)
+        for depth in range(len(prefix), 0, -1):
+            node = path[depth]
+            if node.entries is not None or node.children:
+                return
+            del path[depth - 1].children[prefix[depth - 1]]
+
+    def _ref(self, entry):
+        name = self._names.setdefault(entry[1], [entry[0], 0])
+        name[0] = entry[0]
+        name[1] += 1
+
+    def _unref(self, user_id):
+        name = self._names.get(user_id)
+        if name is not None:
+            name[1] -= 1
+            if name[1] <= 0:
+                del self._names[user_id]
+
+    def _insert(self, entry):
+        for prefix, node in self._cached_nodes(entry[0]):
+            # Lists are copied on write so callers can keep returned slices
+            entries = list(node.entries)
+            bisect.insort(entries, entry)
+            node.entries = entries[:self.limit]
+            for dropped in entries[self.limit:]:
+                if dropped is not entry:
+                    self._unref(dropped[1])
+            if entry in node.entries:
+                self._ref(entry)
+
+    def _remove(self, user_id):
+        name = self._names.get(user_id)
+        if name is None:
+            return
+        for prefix, node in list(self._cached_nodes(name[0])):
+            entries = [entry for entry in node.entries if entry[1] != user_id]
+            if len(entries) == len(node.entries):
+                continue
+            if len(node.entries) == self.limit:
+                # A full list may have a successor in the database we never saw
+                self._evict(prefix)
+            else:
+                node.entries = entries
+                self._unref(user_id)
+        # Whatever is left pointed at lists no longer on this user's path
+        self._names.pop(user_id, None)
+
+
+suggestions = PrefixTrie(
+    limit=getattr(settings, 'TYPEAHEAD_LIMIT', 10),
+    max_prefixes=getattr(settings, 'TYPEAHEAD_CACHED_PREFIXES', 5000),
+    max_prefix_length=getattr(settings, 'TYPEAHEAD_MAX_CACHED_PREFIX_LENGTH', 4),
+    ttl=getattr(settings, 'TYPEAHEAD_TTL', 60),
+)
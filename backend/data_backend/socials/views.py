@@ -3,10 +3,18 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
-from .models import Relationship
-from .serializers import RelationshipSerializer, RelationshipActionSerializer,UserSearchSerializer
+from .models import Relationship, FriendSuggestion
+from .serializers import RelationshipSerializer, RelationshipActionSerializer, UserSearchSerializer, PublicUserSerializer
+from .pagination import UserDiscoveryPagination
+from .graph import friend_graph, block_list
+from .blocks import blocked_user_ids
+from . import paths
+from .typeahead import suggestions
 from authentification.serializers import UserSerializer
 from django.db.models import Q
+from django.conf import settings
+
+RELATIONSHIP_STATUS_MAX_IDS = getattr(settings, 'RELATIONSHIP_STATUS_MAX_IDS', 200)
 
 class RelationshipViewSet(viewsets.ModelViewSet):
     queryset = Relationship.objects.all()
@@ -39,6 +47,58 @@ class RelationshipViewSet(viewsets.ModelViewSet):
         return Response(result_serializer.data, status=status.HTTP_201_CREATED)
 
 
+    @action(detail=False, methods=['get'], url_path='status')
+    def statuses(self, request):
+        """Caller's relationship status with each user in ?ids=1,2,3, resolved in one query"""
+        raw_ids = ','.join(request.query_params.getlist('ids')).split(',')
+        try:
+            user_ids = list(dict.fromkeys(int(i) for i in raw_ids if i.strip()))
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma-separated list of user ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(user_ids) > RELATIONSHIP_STATUS_MAX_IDS:
+            return Response(
+                {"error": f"At most {RELATIONSHIP_STATUS_MAX_IDS} ids can be resolved at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        statuses = Relationship.objects.get_statuses(request.user, user_ids)
+        return Response({str(user_id): value for user_id, value in statuses.items()})
+
+    @action(detail=False, methods=['get'], url_path=r'path/(?P<user_id>\d+)')
+    def path(self, request, user_id=None):
+        """Shortest chain of friendships from the caller to another user (?max_depth= to narrow it)"""
+        target = get_object_or_404(User, pk=user_id)
+        max_depth = request.query_params.get('max_depth', str(paths.MAX_DEPTH))
+        if not max_depth.isdigit():
+            return Response(
+                {"error": "max_depth must be a non-negative integer"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_depth = min(int(max_depth), paths.MAX_DEPTH)
+
+        # Never reveal anything across a block, for the target or for anyone
+        # on the way: users on either side of a block with the caller are
+        # not walked through
+        blocked = blocked_user_ids(request.user)
+        if target.pk in blocked:
+            path, truncated = None, False
+        else:
+            path, truncated = paths.shortest_path(request.user.pk, target.pk, max_depth, exclude=blocked)
+        if path is None:
+            return Response(
+                {"error": f"No friendship path within {max_depth} degrees", "truncated": truncated},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        users = User.objects.in_bulk(path)
+        return Response({
+            "degrees": len(path) - 1,
+            "path": PublicUserSerializer([users[user_id] for user_id in path], many=True).data,
+        })
+
     @action(detail=True, methods=['post'])
     def unfriend(self, request, pk=None):
         relationship = self.get_object()
@@ -143,10 +203,33 @@ class FriendViewSet(viewsets.ViewSet):
 
     def list(self, request):
         """List all friends of the current user"""
-        friends = Relationship.objects.get_friends(request.user)
+        friend_ids = friend_graph.friend_ids(request.user).tolist()
+        friends = User.objects.filter(pk__in=friend_ids).order_by('username')
         serializer = UserSerializer(friends, many=True)
         return Response(serializer.data)
 
+    @action(detail=False, methods=['get'], url_path=r'mutual/(?P<user_id>\d+)')
+    def mutual(self, request, user_id=None):
+        """Friends the current user has in common with another user"""
+        other_user = get_object_or_404(User, pk=user_id)
+        mutual_ids = friend_graph.mutual_friend_ids(request.user, other_user).tolist()
+        friends = User.objects.filter(pk__in=mutual_ids).order_by('username')
+        return Response({
+            "count": len(mutual_ids),
+            "results": UserSerializer(friends, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def suggestions(self, request):
+        """People you may know: precomputed friends-of-friends, most mutual friends first"""
+        suggestions = list(FriendSuggestion.objects.for_user(request.user))
+        # Rows are refreshed in the background, so drop users related since then
+        statuses = Relationship.objects.get_statuses(request.user, [s.suggested_id for s in suggestions])
+        return Response([
+            {**UserSerializer(s.suggested).data, 'mutual_count': s.mutual_count}
+            for s in suggestions if statuses[s.suggested_id] == 'none'
+        ])
+
     @action(detail=False, methods=['get'])
     def pending_requests(self, request):
         """List all pending friend requests for the current user"""
@@ -185,7 +268,7 @@ class FriendViewSet(viewsets.ViewSet):
         other_user = get_object_or_404(User, pk=serializer.validated_data['user_id'])
 
         # Check friendship status
-        are_friends = Relationship.objects.are_friends(request.user, other_user)
+        are_friends = friend_graph.are_friends(request.user, other_user)
 
         return Response({"are_friends": are_friends})
 
@@ -196,27 +279,35 @@ class UserSearchViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = UserSearchSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserDiscoveryPagination
 
     def list(self, request):
-        user = request.user
-        existing_relationships = Relationship.objects.get_user_relationships(user)
-        existing_user_ids = [user.id] + [
-            rel.sender.id if rel.sender != user else rel.receiver.id for rel in existing_relationships
-        ]
-        queryset = User.objects.exclude(id__in=existing_user_ids)
-        search_query = request.query_params.get('search', None)
-
-        if search_query:
-            queryset = queryset.filter(
-                Q(username__icontains=search_query) |
-                Q(first_name__icontains=search_query) |
-                Q(last_name__icontains=search_query)
-            )
+        """Users without any relationship to the caller, fuzzy-matched and ranked by ?search="""
+        search_query = request.query_params.get('search', '').strip()
+        queryset = Relationship.objects.discover_users(request.user, search_query or None)
 
         page = self.paginate_queryset(queryset)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(page, many=True, context={
+            'request': request,
+            # discover_users only returns unrelated users: no lookup needed
+            'relationship_statuses': dict.fromkeys((user.pk for user in page), 'none'),
+        })
+        return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(queryset, many=True, context={'request': request})
-        return Response(serializer.data)
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """Typeahead: the first usernames starting with ?q=, served from the prefix cache"""
+        prefix = request.query_params.get('q', '').strip().lower()
+        if not prefix:
+            return Response([])
+        try:
+            limit = int(request.query_params.get('limit', suggestions.limit))
+        except ValueError:
+            limit = suggestions.limit
+        limit = max(limit, 1)
+        # Cached entries are shared by every user, so blocks are filtered per call
+        entries = suggestions.suggest(prefix, limit, exclude=set(block_list.blocked_ids(request.user).tolist()))
+        return Response([
+            {'id': user_id, 'username': username, 'display_name': display_name}
+            for _, user_id, username, display_name in entries
+        ])